@@ -2,23 +2,91 @@
 Flask API Server for VoiceBox TTS
 音声生成タスクの登録・結果取得用HTTPエンドポイント
 """
+import hmac
+import math
 import os
 import time
-from flask import Flask, request, jsonify, g, send_from_directory
+import uuid
+import redis
+from flask import Flask, request, jsonify, g, send_from_directory, send_file
 from celery.result import AsyncResult
-from celery_worker import app as celery_app
-from config import API_HOST, API_PORT
+from celery_worker import app as celery_app, LANE_QUEUES
+from config import (
+    API_HOST, API_PORT, CELERY_BROKER_URL, DEFAULT_SPEAKER, DEDUP_TTL_SECONDS,
+    ADMIN_TOKEN, PROFILE_DIR, PROFILE_SECONDS, API_KEYS, CLIENT_ID_HEADER
+)
 from flasgger import Swagger
 import yaml
 
 # Import monitoring modules
 from logger import get_api_logger
 from metrics import get_metrics_collector, get_performance_monitor
+from storage import get_audio_storage
+from text_normalizer import normalize_text, DedupWindow
+from cost_model import get_cost_model
+from dispatcher import DEFAULT_CLIENT, get_dispatcher
+from rate_limiter import get_client_quota
+from profiler import get_profiler
+from tracing import get_tracer
 
 # Initialize logger and metrics
 api_logger = get_api_logger()
 metrics = get_metrics_collector()
 perf_monitor = get_performance_monitor()
+storage = get_audio_storage()
+cost_model = get_cost_model()
+dispatcher = get_dispatcher()
+client_quota = get_client_quota()
+profiler = get_profiler()
+tracer = get_tracer()
+
+# 重複排除ウィンドウ (Redisで複数プロセス間共有、Redis以外のブローカーではプロセス内)
+dedup = DedupWindow(
+    DEDUP_TTL_SECONDS,
+    redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None,
+    namespace='tts'
+)
+
+
+def dispatch_task(job: dict):
+    """見積もり済みのタスクをレーンのキューへ投入"""
+    celery_app.send_task(
+        'voicebox.tts',
+        args=[job['text'], job['speaker']],
+        kwargs={'cost_ms': job['cost_ms'], 'lane': job['lane']},
+        task_id=job['task_id'],
+        queue=LANE_QUEUES.get(job['lane']),
+        headers=job.get('headers')  # traceparent・投入時刻 (ワーカーのキュー待ちスパン用)
+    )
+
+
+# クライアント識別子の最大長 (Redisのキー・メトリクスに使う)
+MAX_CLIENT_ID_LENGTH = 64
+
+
+def identify_client() -> str:
+    """リクエストのクライアント識別子
+
+    API_KEYS 設定時は X-API-Key に対応するクライアント名 (未登録のキーは接続元アドレス)、
+    未設定時は CLIENT_ID_HEADER の値 (なければ接続元アドレス)。
+    """
+    if API_KEYS:
+        client = API_KEYS.get(request.headers.get('X-API-Key', ''))
+    else:
+        client = request.headers.get(CLIENT_ID_HEADER)
+    return (client or request.remote_addr or DEFAULT_CLIENT)[:MAX_CLIENT_ID_LENGTH]
+
+
+# SJFスケジューリング: 保留キューから見積もりの小さい順に投入
+if dispatcher is not None:
+    dispatcher.attach(dispatch_task)
+
+# 保存形式 → MIMEタイプ
+AUDIO_MIMETYPES = {
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'opus': 'audio/ogg',
+}
 
 api = Flask(__name__, static_folder='static')
 
@@ -58,6 +126,7 @@ def after_request(response):
         duration_ms = (time.time() - g.start_time) * 1000
         api_logger.log_response(request.path, response.status_code, duration_ms)
         perf_monitor.record_api_request(request.path, duration_ms)
+    profiler.task_finished()
     return response
 
 
@@ -79,29 +148,98 @@ def create_tts_task():
     Request Body:
         {
             "text": "読み上げテキスト",
-            "speaker": 1  # オプション、デフォルト: 1
+            "speaker": 1,  # オプション、デフォルト: 1
+            "dedup": true  # オプション、重複排除 (デフォルト: true)
         }
 
     Response:
         {
             "task_id": "xxx-xxx-xxx",
-            "status": "PENDING"
+            "status": "PENDING",
+            "eta_ms": 1200,  # 完了までの見積もり (先行タスク + 自分の合成時間)
+            "lane": "short"  # short | long
         }
+
+    重複排除ウィンドウ内に同じテキスト (正規化後) があれば新規タスクを作らず、
+    先行タスクのIDを "duplicate": true 付きで返す (200)。
+    クライアント (X-API-Key / X-Client-Id) ごとのクォータを超えた場合は 429 (Retry-After 付き)。
     """
     data = request.get_json()
 
     if not data or 'text' not in data:
         return jsonify({'error': 'Missing required field: text'}), 400
 
-    text = data['text']
-    speaker = data.get('speaker')
+    text = normalize_text(data['text'])
+    if not text:
+        return jsonify({'error': 'Text is empty after normalization'}), 400
 
-    # タスクを非同期実行 (高速化: ログ出力省略)
-    task = celery_app.send_task('voicebox.tts', args=[text, speaker])
+    speaker = data.get('speaker')
+    effective_speaker = speaker if speaker is not None else DEFAULT_SPEAKER
+    client = identify_client()
+    task_id = str(uuid.uuid4())
+
+    # リクエストのトレース (クライアントの traceparent があれば引き継ぐ)
+    with tracer.span(
+        'POST /tts', request.headers.get('traceparent'),
+        task_id=task_id, speaker=effective_speaker, text_length=len(text), client=client
+    ) as span:
+        # 重複排除
+        registered = False
+        if data.get('dedup', True):
+            existing_id = dedup.check_and_add(text, effective_speaker, task_id)
+            if existing_id:
+                return jsonify({
+                    'task_id': existing_id,
+                    'status': AsyncResult(existing_id, app=celery_app).status,
+                    'duplicate': True
+                }), 200
+            registered = True
+
+        try:
+            # クライアントごとのクォータ
+            if client_quota is not None:
+                retry_after = client_quota.try_acquire(client)
+                if retry_after:
+                    # 投入しないタスクIDを重複排除に残さない (後続の同一テキストが PENDING のまま待たされる)
+                    if registered:
+                        dedup.discard(text, effective_speaker, task_id)
+                    metrics.increment('quota_rejected')
+                    response = jsonify({
+                        'error': 'Quota exceeded',
+                        'client': client,
+                        'retry_after': round(retry_after, 3)
+                    })
+                    response.headers['Retry-After'] = str(math.ceil(retry_after))
+                    return response, 429
+
+            # 合成コストの見積もり → レーン・ETA
+            cost_ms = cost_model.estimate(text, effective_speaker)
+            lane = cost_model.lane(cost_ms)
+            eta_ms = cost_model.enqueue(task_id, lane, cost_ms)
+            job = {
+                'task_id': task_id, 'text': text, 'speaker': speaker, 'cost_ms': cost_ms, 'lane': lane,
+                'client': client, 'headers': tracer.headers()
+            }
+            if span is not None:
+                span.set(cost_ms=cost_ms, lane=lane)
+
+            # タスクを非同期実行 (高速化: ログ出力省略)
+            if dispatcher is not None:
+                dispatcher.submit(**job)
+            else:
+                dispatch_task(job)
+        except Exception:
+            if registered:
+                dedup.discard(text, effective_speaker, task_id)
+            # 投入できなかったタスクの見積もりをバックログに残さない (未加算なら何もしない)
+            cost_model.dequeue(task_id)
+            raise
 
     return jsonify({
-        'task_id': task.id,
-        'status': task.status
+        'task_id': task_id,
+        'status': 'PENDING',
+        'eta_ms': round(eta_ms),
+        'lane': lane
     }), 202
 
 
@@ -139,6 +277,20 @@ def get_tts_task(task_id: str):
     return jsonify(response)
 
 
+@api.route('/tts/<task_id>/audio', methods=['GET'])
+def get_tts_audio(task_id: str):
+    """
+    生成済み音声ファイルを取得 (ストレージインデックス経由)
+    """
+    api_logger.log_request(f'/tts/{task_id}/audio', 'GET')
+
+    stored = storage.lookup(task_id)
+    if stored is None:
+        return jsonify({'error': f'Audio not found: {task_id}'}), 404
+
+    return send_file(stored.path, mimetype=AUDIO_MIMETYPES.get(stored.format))
+
+
 @api.route('/tasks', methods=['GET'])
 def list_tasks():
     """アクティブなタスク一覧"""
@@ -174,9 +326,16 @@ def get_metrics():
     """メトリクス取得"""
     api_logger.log_request('/metrics', 'GET')
 
+    # 見積もり精度はワーカーで記録されるため、コストモデル (Redisで共有) から返す
+    stats = metrics.get_stats()
+    stats['cost_estimate'] = cost_model.accuracy()
+
     return jsonify({
-        'stats': metrics.get_stats(),
-        'recent_tasks': metrics.get_recent_tasks(limit=10)
+        'stats': stats,
+        'recent_tasks': metrics.get_recent_tasks(limit=10),
+        'cost_model': cost_model.get_stats(),
+        'dispatcher': dispatcher.get_stats() if dispatcher is not None else None,
+        'quota': client_quota.get_stats() if client_quota is not None else None
     })
 
 
@@ -191,5 +350,69 @@ def get_errors():
     })
 
 
+def _check_admin_token():
+    """管理エンドポイントの認証 (ADMIN_TOKEN 未設定時は無効)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN is not set)'}), 404
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    return None
+
+
+@api.route('/admin/profile', methods=['POST'])
+def start_profile():
+    """
+    サンプリングプロファイラを開始
+
+    Request Body:
+        {
+            "target": "api",  # api (このプロセス) | workers (全ワーカーに制御コマンド)
+            "seconds": 30,    # 最大秒数
+            "tasks": 0        # 次のN件 (APIはリクエスト、ワーカーはタスク) で終了 (0 = 秒数のみ)
+        }
+    """
+    denied = _check_admin_token()
+    if denied:
+        return denied
+
+    data = request.get_json(silent=True) or {}
+    target = data.get('target', 'api')
+    try:
+        seconds = float(data.get('seconds', PROFILE_SECONDS))
+        tasks = int(data.get('tasks', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seconds and tasks must be numbers'}), 400
+
+    if target == 'workers':
+        replies = celery_app.control.broadcast(
+            'voicebox_profile', arguments={'seconds': seconds, 'tasks': tasks}, reply=True, timeout=1.0
+        )
+        return jsonify({'target': target, 'replies': replies}), 202
+    if target != 'api':
+        return jsonify({'error': f'Unknown target: {target}'}), 400
+
+    if not profiler.start(seconds, tasks):
+        return jsonify({'target': target, 'error': 'Profiler is already running', **profiler.status()}), 409
+    return jsonify({'target': target, **profiler.status()}), 202
+
+
+@api.route('/admin/profile', methods=['GET'])
+def get_profile_status():
+    """プロファイラの状態と出力済みファイル (新しい順20件)"""
+    denied = _check_admin_token()
+    if denied:
+        return denied
+
+    files = []
+    if os.path.isdir(PROFILE_DIR):
+        files = sorted(
+            (name for name in os.listdir(PROFILE_DIR) if not name.startswith('.')),
+            key=lambda name: os.path.getmtime(os.path.join(PROFILE_DIR, name)),
+            reverse=True
+        )[:20]
+    return jsonify({**profiler.status(), 'files': files})
+
+
 if __name__ == '__main__':
     api.run(host=API_HOST, port=API_PORT, debug=True)
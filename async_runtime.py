@@ -0,0 +1,125 @@
+"""
+Async Runtime for VoiceBox TTS
+ワーカーの非同期実行モード (WORKER_EXECUTION_MODE=async)
+
+preforkプールでは処理中のリクエスト1件ごとにPythonプロセスが1つ必要になる。
+非同期実行モードでは1プロセスに1本のイベントループスレッドを置き、
+Celeryの threads プールの各スレッドはコルーチンを投入して結果を待つだけにする。
+VOICEVOXへのHTTPはイベントループ上の AsyncVoicevoxClient が多重化し、
+同時リクエスト数はセマフォ (ASYNC_MAX_INFLIGHT) で制限する。
+
+タスクは同期関数のままなので、タスク名・結果スキーマ・acks_late は変わらない。
+
+threads プールでは Celery の task_time_limit / task_soft_time_limit が適用されないため、
+タスクごとの期限 (deadline) を設定し、期限内に終わらないコルーチンはイベントループ上で
+asyncio.wait_for によりキャンセルする (接続・セマフォの枠を解放して TimeoutError)。
+"""
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+from config import ASYNC_MAX_INFLIGHT
+from voicevox_client import AsyncVoicevoxClient
+
+T = TypeVar('T')
+
+
+class AsyncRuntime:
+    """バックグラウンドのイベントループ (プロセスごとに1つ)
+
+    fork後の子プロセスでは親のループスレッドが存在しないため、
+    pid が変わっていればループを作り直す。
+    """
+
+    def __init__(self, max_inflight: int = ASYNC_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._voicevox: Optional[AsyncVoicevoxClient] = None
+        # スレッド (= 処理中のタスク) ごとの期限 (time.monotonic)
+        self._local = threading.local()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._loop
+
+        with self._lock:
+            if self._pid != pid:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name='voicebox-asyncio', daemon=True
+                )
+                thread.start()
+                self._loop, self._thread = loop, thread
+                self._voicevox = AsyncVoicevoxClient(max_inflight=self.max_inflight)
+                self._pid = pid
+        return self._loop
+
+    @property
+    def voicevox(self) -> AsyncVoicevoxClient:
+        """イベントループ上で使うVOICEVOXクライアント"""
+        self._ensure_started()
+        return self._voicevox
+
+    @contextlib.contextmanager
+    def deadline(self, seconds: float) -> Iterator[None]:
+        """このスレッドで以降に run() するコルーチン全体の期限 (タスク1件の時間制限)"""
+        previous = getattr(self._local, 'deadline', None)
+        self._local.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """コルーチンをイベントループで実行し、結果を待つ (任意のスレッドから呼べる)
+
+        timeout と deadline() の残り時間の短い方を過ぎたらループ上でキャンセルして TimeoutError。
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if asyncio.iscoroutine(coro):
+                    coro.close()
+                raise TimeoutError('Task deadline exceeded')
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+        try:
+            # wait_for がキャンセルを終えるまでの猶予 (ループが詰まっている場合も戻る)
+            return future.result(None if timeout is None else timeout + 1)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self):
+        """接続を閉じてイベントループを停止"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            loop, thread = self._loop, self._thread
+            asyncio.run_coroutine_threadsafe(self._voicevox.close(), loop).result(5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+            self._pid = self._loop = self._thread = self._voicevox = None
+
+
+# グローバルインスタンス
+_async_runtime: Optional[AsyncRuntime] = None
+
+
+def get_async_runtime() -> AsyncRuntime:
+    global _async_runtime
+    if _async_runtime is None:
+        _async_runtime = AsyncRuntime()
+    return _async_runtime
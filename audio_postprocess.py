@@ -0,0 +1,292 @@
+"""
+Audio Post-processing for VoiceBox TTS
+合成済みWAVの後処理 (無音トリム・ラウドネス正規化・ローカル時間伸縮)
+
+VOICEVOXの出力は前後に prePhonemeLength / postPhonemeLength の無音があり、
+スピーカーごとに音量も異なる。NumPy でPCMを直接処理し、
+- 前後の無音を詰める (短いナレーションの体感レイテンシ短縮)
+- 有音部分のRMSを目標レベルに揃える (ピークはクリップしない範囲に制限)
+- 再合成せずに話速を変える (WSOLA)
+
+WAVはレスポンスのバッファを memoryview で解析し、np.frombuffer で
+コピーせずに参照する。トリムはビューのスライスのみで、サンプル値を
+変更する正規化・時間伸縮を行った場合だけ新しい配列を作る。
+NumPy がない環境では何もせず元のWAVを返す。
+"""
+import struct
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPyは任意依存
+    np = None
+
+from config import (
+    AUDIO_POSTPROCESS,
+    AUDIO_TRIM_SILENCE,
+    AUDIO_SILENCE_THRESHOLD_DB,
+    AUDIO_SILENCE_PAD_MS,
+    AUDIO_NORMALIZE_LOUDNESS,
+    AUDIO_TARGET_DBFS,
+    AUDIO_TIME_STRETCH
+)
+
+# 解析フレーム長 (無音判定・RMS計算)
+FRAME_MS = 10
+
+# 正規化後のピーク上限 (dBFS)
+PEAK_LIMIT_DBFS = -1.0
+
+# 目標との差がこれ未満なら正規化しない (dB)
+GAIN_TOLERANCE_DB = 0.5
+
+_FULL_SCALE = 32768.0
+
+
+class WavFormatError(ValueError):
+    """後処理できないWAV形式"""
+
+
+class WavInfo:
+    """WAVヘッダー情報とPCMデータの位置"""
+
+    __slots__ = ('channels', 'sample_rate', 'sample_width', 'data_offset', 'data_size')
+
+    def __init__(self, channels: int, sample_rate: int, sample_width: int,
+                 data_offset: int, data_size: int):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+
+def parse_wav(buf) -> WavInfo:
+    """RIFFチャンクを走査して fmt / data チャンクの位置を返す (コピーなし)"""
+    view = memoryview(buf)
+    if len(view) < 12 or bytes(view[0:4]) != b'RIFF' or bytes(view[8:12]) != b'WAVE':
+        raise WavFormatError('not a RIFF/WAVE file')
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', view, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate = struct.unpack_from('<HHI', view, body)
+            sample_width = struct.unpack_from('<H', view, body + 14)[0] // 8
+            if audio_format != 1:
+                raise WavFormatError(f'unsupported WAV format tag: {audio_format}')
+            fmt = (channels, sample_rate, sample_width)
+
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WavFormatError('data chunk before fmt chunk')
+            size = min(chunk_size, len(view) - body)
+            return WavInfo(*fmt, data_offset=body, data_size=size)
+
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise WavFormatError('data chunk not found')
+
+
+def build_wav(info: WavInfo, samples) -> bytes:
+    """PCM (int16) からWAVを組み立てる (ヘッダー + データの連結1回のみ)"""
+    data = memoryview(samples).cast('B')
+    block_align = info.channels * info.sample_width
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + len(data), b'WAVE',
+        b'fmt ', 16, 1, info.channels, info.sample_rate,
+        info.sample_rate * block_align, block_align, info.sample_width * 8,
+        b'data', len(data)
+    )
+    return header + data
+
+
+def _frame_rms_db(mono, frame: int):
+    """フレームごとのRMS (dBFS)"""
+    count = len(mono) // frame
+    frames = mono[:count * frame].reshape(count, frame).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1)) / _FULL_SCALE
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def trim_silence(samples, sample_rate: int, channels: int = 1,
+                 threshold_db: float = AUDIO_SILENCE_THRESHOLD_DB,
+                 pad_ms: float = AUDIO_SILENCE_PAD_MS):
+    """前後の無音を除去 (元配列のビューを返す)"""
+    frame = max(1, int(sample_rate * FRAME_MS / 1000))
+    mono = samples[::channels] if channels > 1 else samples
+    levels = _frame_rms_db(mono, frame)
+    voiced = np.flatnonzero(levels > threshold_db)
+    if not len(voiced):
+        return samples
+
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(mono), (voiced[-1] + 1) * frame + pad)
+    return samples[start * channels:end * channels]
+
+
+def normalize_loudness(samples, sample_rate: int, channels: int = 1,
+                       target_dbfs: float = AUDIO_TARGET_DBFS,
+                       threshold_db: float = AUDIO_SILENCE_THRESHOLD_DB):
+    """有音フレームのRMSを target_dbfs に揃える
+
+    ゲインはピークが PEAK_LIMIT_DBFS を超えない範囲に制限する。
+    変更が GAIN_TOLERANCE_DB 未満なら元配列をそのまま返す。
+    """
+    frame = max(1, int(sample_rate * FRAME_MS / 1000) * channels)
+    levels = _frame_rms_db(samples, frame)
+    voiced = levels[levels > threshold_db]
+    if not len(voiced):
+        return samples
+
+    # 有音フレームのRMS (パワー平均)
+    loudness_db = 10 * np.log10(np.mean(10 ** (voiced / 10)))
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+    gain_db = target_dbfs - loudness_db
+    if peak:
+        gain_db = min(gain_db, PEAK_LIMIT_DBFS - 20 * np.log10(peak / _FULL_SCALE))
+    if abs(gain_db) < GAIN_TOLERANCE_DB:
+        return samples
+
+    scaled = samples.astype(np.float32) * np.float32(10 ** (gain_db / 20))
+    return np.clip(np.rint(scaled), -32768, 32767).astype('<i2')
+
+
+def time_stretch(samples, sample_rate: int, speed: float,
+                 frame_ms: float = 30, search_ms: float = 6):
+    """WSOLAで話速を変更 (ピッチは維持、speed > 1 で速く・短くなる)
+
+    モノラルのみ対応 (VOICEVOXの出力は既定でモノラル)。
+    """
+    frame = int(sample_rate * frame_ms / 1000)
+    if abs(speed - 1.0) < 1e-3 or len(samples) < frame * 2:
+        return samples
+
+    hop_out = frame // 2
+    hop_in = hop_out * speed
+    tolerance = int(sample_rate * search_ms / 1000)
+    window = np.hanning(frame).astype(np.float32)
+
+    source = np.pad(samples.astype(np.float32), (tolerance, frame + tolerance))
+    frames = int((len(samples) - frame) / hop_in) + 1
+    out_len = (frames - 1) * hop_out + frame
+    out = np.zeros(out_len, dtype=np.float32)
+    norm = np.zeros(out_len, dtype=np.float32)
+
+    position = tolerance
+    for k in range(frames):
+        nominal = int(k * hop_in) + tolerance
+        if k:
+            # 直前フレームの自然な続きと最も相関が高い位置を探す
+            natural = source[position + hop_out:position + hop_out + frame]
+            region = source[nominal - tolerance:nominal + tolerance + frame]
+            position = nominal - tolerance + int(np.argmax(np.correlate(region, natural, 'valid')))
+        else:
+            position = nominal
+        start = k * hop_out
+        out[start:start + frame] += source[position:position + frame] * window
+        norm[start:start + frame] += window
+
+    out /= np.maximum(norm, 1e-3)
+    out = out[:int(len(samples) / speed)]
+    return np.clip(np.rint(out), -32768, 32767).astype('<i2')
+
+
+class AudioPostProcessor:
+    """合成済みWAVの後処理"""
+
+    def __init__(
+        self,
+        enabled: bool = AUDIO_POSTPROCESS,
+        trim: bool = AUDIO_TRIM_SILENCE,
+        normalize: bool = AUDIO_NORMALIZE_LOUDNESS,
+        target_dbfs: float = AUDIO_TARGET_DBFS,
+        speed: float = AUDIO_TIME_STRETCH
+    ):
+        self.enabled = enabled and np is not None
+        self.trim = trim
+        self.normalize = normalize
+        self.target_dbfs = target_dbfs
+        self.speed = speed
+
+    def process(self, wav_bytes: bytes, speed: Optional[float] = None) -> bytes:
+        """WAVを後処理 (変更がなければ元のバイト列をそのまま返す)
+
+        Args:
+            wav_bytes: VOICEVOXの synthesis レスポンス
+            speed: 時間伸縮の倍率 (省略時は AUDIO_TIME_STRETCH)
+        """
+        if not self.enabled:
+            return wav_bytes
+
+        try:
+            info = parse_wav(wav_bytes)
+        except (WavFormatError, struct.error):
+            return wav_bytes
+        if info.sample_width != 2:
+            return wav_bytes
+
+        view = memoryview(wav_bytes)[info.data_offset:info.data_offset + info.data_size]
+        samples = np.frombuffer(view, dtype='<i2', count=info.data_size // 2)
+        processed = samples
+
+        if self.trim:
+            processed = trim_silence(processed, info.sample_rate, info.channels)
+        if self.normalize:
+            processed = normalize_loudness(processed, info.sample_rate, info.channels, self.target_dbfs)
+        speed = self.speed if speed is None else speed
+        if info.channels == 1:
+            processed = time_stretch(processed, info.sample_rate, speed)
+
+        if processed is samples:
+            return wav_bytes
+        return build_wav(info, np.ascontiguousarray(processed))
+
+    def get_info(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'numpy': np is not None,
+            'trim': self.trim,
+            'normalize': self.normalize,
+            'target_dbfs': self.target_dbfs,
+            'speed': self.speed,
+        }
+
+
+# グローバルインスタンス
+_postprocessor: Optional[AudioPostProcessor] = None
+
+
+def get_audio_postprocessor() -> AudioPostProcessor:
+    global _postprocessor
+    if _postprocessor is None:
+        _postprocessor = AudioPostProcessor()
+    return _postprocessor
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='VoiceBox WAV post-processing')
+    parser.add_argument('input', help='入力WAV')
+    parser.add_argument('output', help='出力WAV')
+    parser.add_argument('--speed', type=float, default=None, help='時間伸縮の倍率')
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as f:
+        source = f.read()
+
+    start = time.perf_counter()
+    result = get_audio_postprocessor().process(source, speed=args.speed)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    with open(args.output, 'wb') as f:
+        f.write(result)
+    print(f'{len(source)} -> {len(result)} bytes ({elapsed_ms:.1f} ms)')
@@ -0,0 +1,263 @@
+"""
+Benchmark harness for VoiceBox TTS
+ベンチマーク共通設定
+
+外部依存 (VOICEVOX / Redis / afplay) なしで、プロセス内に以下を起動して計測する。
+- スタブVOICEVOXエンジン (レイテンシ・ジッター設定可能)
+- Celery memory:// ブローカー + cache+memory:// 結果バックエンド (Redisの代替)
+- Celeryワーカー (threadsプール)
+- Redis/Lua を使う経路 (ディスパッチャ・クォータ・コストモデル・シングルフライト・重複排除) は
+  fakeredis (Lua は lupa) に対して実行する。BENCH_REDIS_URL を指定すると実Redisを使う
+  (テストごとに FLUSHDB するため専用のDBを指定すること)
+
+Usage:
+    python -m pytest benchmarks -q
+    python -m pytest benchmarks -q --bench-check             # ベースライン比較で悪化したら失敗
+    python -m pytest benchmarks -q --bench-update-baseline   # ベースライン更新
+
+結果は --bench-save (default: benchmarks/results/latest.json) に保存され、
+benchmarks/baseline.json と比較して許容範囲 (--bench-tolerance) を超えて
+悪化した指標を終了時に一覧表示する。
+
+絶対値 (ns / ms) はマシンや他プロセスの負荷で大きく変わるため、既定ではベースライン比較で
+テストを失敗させない。各テストは同じ実行内で計測した比 (機能あり / なし) で合否を判定し、
+ベースラインとの比較は --bench-check を付けた場合のみ (ベースラインを作ったマシンでの回帰確認用)。
+"""
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_SAVE = os.path.join(BENCH_DIR, 'results', 'latest.json')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# config.py は import 時に環境変数を読むため、アプリのimport前に設定する
+# (ブローカー・結果バックエンドのみ環境変数で実Redisに差し替え可能)
+_STUB_PORT = _free_port()
+os.environ['VOICEVOX_API_URL'] = f'http://127.0.0.1:{_STUB_PORT}'
+os.environ['OUTPUT_DIR'] = tempfile.mkdtemp(prefix='voicebox-bench-')
+os.environ['PROFILE_DIR'] = os.path.join(os.environ['OUTPUT_DIR'], 'profiles')
+os.environ['TRACE_EXPORT_PATH'] = os.path.join(os.environ['OUTPUT_DIR'], 'traces.jsonl')
+os.environ['TRACING'] = 'true'  # 既定は無効 (ベースラインはトレース・後処理を有効にして計測)
+os.environ['AUDIO_POSTPROCESS'] = 'true'
+os.environ['AUTO_PLAY'] = 'false'
+os.environ['DEDUP_TTL_SECONDS'] = '0'
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+os.environ.setdefault('CELERY_RESULT_BACKEND', 'cache+memory://')
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(REPO_ROOT)  # api_server.py は openapi.yaml を相対パスで読む
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('voicebox-bench')
+    group.addoption('--bench-baseline', default=DEFAULT_BASELINE, help='比較するベースラインJSON')
+    group.addoption('--bench-save', default=DEFAULT_SAVE, help='結果の保存先JSON')
+    group.addoption('--bench-update-baseline', action='store_true', help='結果でベースラインを上書き')
+    group.addoption('--bench-check', action='store_true',
+                    help='ベースラインより許容範囲を超えて悪化した指標があればテストを失敗させる')
+    group.addoption('--bench-tolerance', type=float, default=0.5,
+                    help='許容する悪化率 (0.5 = 50%%)')
+    group.addoption('--stub-latency-ms', type=float, default=20.0, help='スタブの合成レイテンシ')
+    group.addoption('--stub-jitter-ms', type=float, default=5.0, help='スタブのジッター')
+    group.addoption('--worker-concurrency', type=int, default=8, help='ワーカーのスレッド数')
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def current_rss_kb() -> int:
+    """現在のRSS (KB)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class BenchmarkRecorder:
+    """計測結果の記録とベースライン比較"""
+
+    def __init__(self, baseline: dict, tolerance: float, enforce: bool = False):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.enforce = enforce
+        self.results = {}
+        self.regressions = []
+
+    def record(self, name: str, value: float, unit: str, higher_is_better: bool = False):
+        """指標を記録し、ベースラインより悪化していれば regressions に追加"""
+        self.results[name] = {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+        base = self.baseline.get(name)
+        if base is None:
+            return
+        base_value = base['value']
+        if higher_is_better:
+            limit = base_value * (1 - self.tolerance)
+            regressed = value < limit
+        else:
+            limit = base_value * (1 + self.tolerance)
+            regressed = value > limit
+        if regressed:
+            self.regressions.append(
+                f'{name}: {value:.3f}{unit} (baseline {base_value:.3f}{unit}, limit {limit:.3f}{unit})'
+            )
+
+    def check(self, *names: str):
+        """指定した指標 (省略時は全て) に悪化がないことを検証 (--bench-check の場合のみ、それ以外は終了時に表示)"""
+        if not self.enforce:
+            return
+        failed = [r for r in self.regressions if not names or r.split(':')[0] in names]
+        assert not failed, 'Benchmark regression:\n  ' + '\n  '.join(failed)
+
+    def to_json(self, config: dict) -> dict:
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': config,
+            'metrics': self.results,
+            'regressions': self.regressions,
+        }
+
+
+def _bench_config(pytestconfig) -> dict:
+    return {
+        'stub_latency_ms': pytestconfig.getoption('--stub-latency-ms'),
+        'stub_jitter_ms': pytestconfig.getoption('--stub-jitter-ms'),
+        'worker_concurrency': pytestconfig.getoption('--worker-concurrency'),
+    }
+
+
+# 終了時の表示用
+_recorders = []
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    """ベースラインより悪化した指標の一覧 (--bench-check なしでは失敗にしない)"""
+    regressions = [r for recorder in _recorders for r in recorder.regressions]
+    if not regressions:
+        return
+    enforced = config.getoption('--bench-check')
+    terminalreporter.section('benchmark regressions' + ('' if enforced else ' (not enforced, see --bench-check)'))
+    for regression in regressions:
+        terminalreporter.write_line(regression)
+
+
+@pytest.fixture(scope='session')
+def bench(pytestconfig):
+    """ベンチマーク記録 (セッション終了時に保存)"""
+    baseline = {}
+    baseline_path = pytestconfig.getoption('--bench-baseline')
+    update = pytestconfig.getoption('--bench-update-baseline')
+    if os.path.exists(baseline_path) and not update:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f).get('metrics', {})
+
+    recorder = BenchmarkRecorder(
+        baseline, pytestconfig.getoption('--bench-tolerance'), pytestconfig.getoption('--bench-check')
+    )
+    _recorders.append(recorder)
+    yield recorder
+
+    report = recorder.to_json(_bench_config(pytestconfig))
+    save_path = pytestconfig.getoption('--bench-save')
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    if update:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+@pytest.fixture
+def redis_client():
+    """Redis/Lua 経路のテスト用のRedis (BENCH_REDIS_URL があれば実Redis、なければ fakeredis)"""
+    url = os.environ.get('BENCH_REDIS_URL')
+    if url:
+        import redis
+        client = redis.from_url(url)
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa', reason='fakeredis の Lua スクリプト実行に lupa が必要')
+        client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    client.flushdb()
+    yield client
+    client.flushdb()
+    client.close()
+
+
+@pytest.fixture(params=['local', 'redis'])
+def shared_redis(request):
+    """プロセス内 (None) と Redis の両方で実行するテスト用"""
+    if request.param == 'local':
+        return None
+    return request.getfixturevalue('redis_client')
+
+
+@pytest.fixture(scope='session')
+def stub_engine(pytestconfig):
+    """スタブVOICEVOXエンジン"""
+    from stub_voicevox import StubVoicevoxEngine
+
+    engine = StubVoicevoxEngine(
+        port=_STUB_PORT,
+        latency_ms=pytestconfig.getoption('--stub-latency-ms'),
+        jitter_ms=pytestconfig.getoption('--stub-jitter-ms'),
+    ).start()
+    yield engine
+    engine.stop()
+
+
+@pytest.fixture(scope='session')
+def celery_stack(pytestconfig, stub_engine):
+    """Celeryアプリ + プロセス内ワーカー"""
+    from celery.contrib.testing.worker import start_worker
+    import celery_worker
+
+    # memory:// ブローカーはポーリング (既定1秒) のため間隔を短くする。
+    # また同期ループはプリフェッチ分を処理し終えると drain_events の
+    # タイムアウト (2秒) まで次を取りに行かないため、プリフェッチを大きくする。
+    if celery_worker.app.conf.broker_url.startswith('memory'):
+        celery_worker.app.conf.broker_transport_options = {'polling_interval': 0.001}
+        celery_worker.app.conf.worker_prefetch_multiplier = 256
+
+    with start_worker(
+        celery_worker.app,
+        pool='threads',
+        concurrency=pytestconfig.getoption('--worker-concurrency'),
+        perform_ping_check=False,
+        loglevel='WARNING',
+        shutdown_timeout=30
+    ):
+        yield celery_worker.app
+
+
+@pytest.fixture(scope='session')
+def api_client(celery_stack):
+    """Flaskテストクライアント"""
+    import api_server
+
+    return api_server.api.test_client()
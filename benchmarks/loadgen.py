@@ -0,0 +1,473 @@
+"""
+Open-loop Load Generator for VoiceBox TTS
+POST /tts を目標の到着レート (一定間隔 / ポアソン) で投入し、完了までを追跡する負荷生成ツール
+
+tests/test_load.sh のような直列ループ (closed-loop) は、システムが遅くなると次の送信も遅れるため、
+待たされたはずのリクエストが計測されない (coordinated omission)。
+このツールは送信予定時刻をあらかじめ決め、レイテンシを「予定時刻 → 応答・完了」で計測する。
+送信スレッドが詰まって実際の送信が遅れた分も待ち時間として含まれる (補正後)。
+比較のため「実際の送信時刻 → 応答・完了」(補正なし) も記録する。
+
+- 送信: 到着レートに従って送信スレッドプールへ投入 (keep-alive のHTTP接続)
+- 完了: GET /tts/<task_id> のポーリング (分解能は --poll-interval)
+- テキスト長・話者: リプレイファイル (JSONL) から抽出
+    text / body / message フィールド、または text_length (トレースの attributes も可) と speaker
+- 複数のレートを順に投入 (--rates) し、完了スループットが到着レートに追いつかなくなる
+  飽和点と最大スループットを報告する
+
+Usage:
+    python benchmarks/loadgen.py --rate 10 --duration 60 --replay requests.jsonl
+    python benchmarks/loadgen.py --rates 5,10,20,40 --duration 30 --arrival constant --json load.json
+    python benchmarks/loadgen.py --rates 5,10,20 --replay logs/traces.jsonl --slo-ms 3000
+"""
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 報告するパーセンタイル
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+# 完了スループットが到着レートのこの割合を下回ったら飽和とみなす
+SATURATION_RATIO = 0.9
+
+# text_length のみのリプレイで使う文字 (1文字 ≒ 1モーラ)
+_FILLER = 'あいうえおかきくけこさしすせそたちつてとなにぬねの'
+
+
+class LatencyHistogram:
+    """HDR形式のレイテンシヒストグラム (マイクロ秒)
+
+    2のべき乗の区間ごとに線形のサブバケットを持ち、全範囲で相対誤差を
+    10^-significant_digits 以下に保つ。記録は O(1)、メモリは値の桁数に比例。
+    """
+
+    def __init__(self, significant_digits: int = 3):
+        self.sub_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.sub_count = 1 << self.sub_bits
+        self.sub_half = self.sub_count >> 1
+        self.counts: List[int] = [0] * self.sub_count
+        self.total = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.sub_half + (value >> shift) - self.sub_half
+
+    def _highest_equivalent(self, index: int) -> int:
+        if index < self.sub_count:
+            return index
+        shift, offset = divmod(index - self.sub_count, self.sub_half)
+        shift += 1
+        return ((offset + self.sub_half + 1) << shift) - 1
+
+    def record(self, value_us: float, count: int = 1):
+        value = max(int(value_us), 0)
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> int:
+        """q (0〜1) 分位の値 (同じバケットの最大値、記録された最大値を超えない)"""
+        if not self.total:
+            return 0
+        target = max(math.ceil(q * self.total), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def to_dict(self, percentiles: Sequence[float] = PERCENTILES) -> dict:
+        """ミリ秒単位の要約"""
+        summary = {'count': self.total, 'mean_ms': self.mean / 1000, 'max_ms': self.max / 1000}
+        for q in percentiles:
+            summary[f'p{q * 100:g}_ms'] = self.percentile(q) / 1000
+        return summary
+
+
+class Workload:
+    """リプレイファイルから抽出した (テキスト, 話者) の分布"""
+
+    def __init__(self, samples: List[Tuple[str, Optional[int]]], speakers: Sequence[int] = (1,)):
+        if not samples:
+            raise ValueError('Workload has no samples')
+        self.samples = samples
+        self.speakers = list(speakers)
+
+    @classmethod
+    def from_file(cls, path: str, speakers: Sequence[int] = (1,)) -> 'Workload':
+        samples = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('name') not in (None, 'POST /tts'):
+                    # トレースのJSONLは POST /tts のスパンのみ
+                    continue
+                sample = cls._parse(entry)
+                if sample is not None:
+                    samples.append(sample)
+        return cls(samples, speakers)
+
+    @staticmethod
+    def _parse(entry: dict) -> Optional[Tuple[str, Optional[int]]]:
+        attributes = entry.get('attributes') or {}
+        speaker = entry.get('speaker', attributes.get('speaker'))
+        for key in ('text', 'body', 'message'):
+            if isinstance(entry.get(key), str) and entry[key].strip():
+                return entry[key], speaker
+        length = entry.get('text_length', attributes.get('text_length'))
+        if length:
+            repeat = _FILLER * (int(length) // len(_FILLER) + 1)
+            return repeat[:int(length)] + '。', speaker
+        return None
+
+    @classmethod
+    def default(cls, speakers: Sequence[int] = (1,)) -> 'Workload':
+        """リプレイファイルがない場合の短文・長文の混在"""
+        texts = ['ビルド完了。', 'テストを実行しています。', 'ファイルを保存しました。変更は3件です。',
+                 'プルリクエストのレビューが完了しました。指摘事項は2件で、いずれも軽微な修正です。']
+        return cls([(text, None) for text in texts], speakers)
+
+    def sample(self, rng: random.Random) -> Tuple[str, int]:
+        text, speaker = rng.choice(self.samples)
+        return text, speaker if speaker is not None else rng.choice(self.speakers)
+
+
+def arrival_times(rate: float, duration: float, arrival: str, rng: random.Random) -> List[float]:
+    """開始からの送信予定時刻 (秒)"""
+    times = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate) if arrival == 'poisson' else 1 / rate
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+@dataclass
+class StageResult:
+    """1つの到着レートでの結果"""
+    rate: float
+    duration: float
+    offered: float = 0.0  # 実際の到着数 / 秒 (ポアソンでは rate からぶれる)
+    sent: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    errors: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    send_lag_max_ms: float = 0.0
+    throughput: float = 0.0
+    submit: LatencyHistogram = field(default_factory=LatencyHistogram)
+    submit_uncorrected: LatencyHistogram = field(default_factory=LatencyHistogram)
+    e2e: LatencyHistogram = field(default_factory=LatencyHistogram)
+    e2e_uncorrected: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def saturated(self, slo_ms: Optional[float] = None) -> bool:
+        """完了が到着レートに追いつかない・タイムアウト・SLO超過"""
+        if self.timed_out or self.throughput < self.offered * SATURATION_RATIO:
+            return True
+        return slo_ms is not None and self.e2e.percentile(0.99) / 1000 > slo_ms
+
+    def to_dict(self) -> dict:
+        return {
+            'rate': self.rate,
+            'duration': self.duration,
+            'offered': self.offered,
+            'sent': self.sent,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'throughput': self.throughput,
+            'send_lag_max_ms': self.send_lag_max_ms,
+            'submit_ms': self.submit.to_dict(),
+            'submit_uncorrected_ms': self.submit_uncorrected.to_dict(),
+            'e2e_ms': self.e2e.to_dict(),
+            'e2e_uncorrected_ms': self.e2e_uncorrected.to_dict(),
+        }
+
+
+class OpenLoopLoadGenerator:
+    """オープンループの負荷生成
+
+    Args:
+        base_url: APIサーバーのURL
+        workload: テキスト・話者の分布
+        senders: 送信スレッド数 (超える同時送信は予定時刻から遅れ、補正後のレイテンシに含まれる)
+        pollers: 完了確認スレッド数
+        poll_interval: 完了確認の間隔 (秒)
+        timeout: ステージ終了後に完了を待つ最大秒数
+        client_id: X-Client-Id ヘッダー (クォータ・公平キューの単位)
+        dedup: POST /tts の重複排除 (リプレイで同じテキストが続くため既定は無効)
+        seed: 到着間隔・テキスト選択の乱数シード
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        workload: Workload,
+        senders: int = 64,
+        pollers: int = 4,
+        poll_interval: float = 0.02,
+        timeout: float = 60.0,
+        client_id: str = 'loadgen',
+        dedup: bool = False,
+        seed: int = 0
+    ):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.workload = workload
+        self.senders = senders
+        self.pollers = pollers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.client_id = client_id
+        self.dedup = dedup
+        self.rng = random.Random(seed)
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, dict]:
+        """keep-alive 接続でリクエスト (切断時は1回だけ再接続)"""
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json', 'X-Client-Id': self.client_id}
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, json.loads(data) if data else {}
+            except (OSError, http.client.HTTPException, ValueError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        raise RuntimeError('unreachable')
+
+    # ------------------------------------------------------------------
+    # ステージ
+    # ------------------------------------------------------------------
+
+    def run_stage(self, rate: float, duration: float, arrival: str = 'poisson') -> StageResult:
+        """到着レート rate (件/秒) で duration 秒間投入し、全タスクの完了 (またはタイムアウト) まで追跡"""
+        result = StageResult(rate, duration)
+        lock = threading.Lock()
+        pending: Dict[str, Tuple[float, float]] = {}  # task_id → (予定時刻, 実送信時刻)
+        sending_done = threading.Event()
+        last_completion = [0.0]
+
+        def send(intended: float, text: str, speaker: int):
+            actual = time.perf_counter()
+            try:
+                status, body = self._request('POST', '/tts', {'text': text, 'speaker': speaker, 'dedup': self.dedup})
+            except Exception:
+                status, body = None, {}
+            now = time.perf_counter()
+            with lock:
+                result.sent += 1
+                result.send_lag_max_ms = max(result.send_lag_max_ms, (actual - intended) * 1000)
+                result.submit.record((now - intended) * 1e6)
+                result.submit_uncorrected.record((now - actual) * 1e6)
+                if status in (200, 202):
+                    result.accepted += 1
+                    pending[body['task_id']] = (intended, actual)
+                elif status == 429:
+                    result.rejected += 1
+                else:
+                    result.errors += 1
+
+        def poll(shard: int):
+            while True:
+                with lock:
+                    items = [(task_id, times) for task_id, times in pending.items()
+                             if hash(task_id) % self.pollers == shard]
+                    finished = sending_done.is_set() and not pending
+                if finished:
+                    return
+                for task_id, (intended, actual) in items:
+                    try:
+                        status, body = self._request('GET', f'/tts/{task_id}')
+                    except Exception:
+                        continue
+                    state = body.get('status')
+                    if status != 200 or state not in ('SUCCESS', 'FAILURE'):
+                        continue
+                    now = time.perf_counter()
+                    outcome = body.get('result')
+                    success = state == 'SUCCESS' and not (isinstance(outcome, dict) and outcome.get('success') is False)
+                    with lock:
+                        if pending.pop(task_id, None) is None:
+                            continue
+                        result.e2e.record((now - intended) * 1e6)
+                        result.e2e_uncorrected.record((now - actual) * 1e6)
+                        if success:
+                            result.completed += 1
+                        else:
+                            result.failed += 1
+                        last_completion[0] = max(last_completion[0], now)
+                time.sleep(self.poll_interval)
+
+        schedule = arrival_times(rate, duration, arrival, self.rng)
+        result.offered = len(schedule) / duration
+        pollers = [threading.Thread(target=poll, args=(i,), daemon=True) for i in range(self.pollers)]
+        for thread in pollers:
+            thread.start()
+
+        start = time.perf_counter() + 0.05
+        with ThreadPoolExecutor(self.senders, thread_name_prefix='loadgen-send') as executor:
+            for offset in schedule:
+                intended = start + offset
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # 送信スレッドが埋まっていても予定時刻は変えない (遅れは補正後のレイテンシに含まれる)
+                executor.submit(send, intended, *self.workload.sample(self.rng))
+        sending_done.set()
+
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            with lock:
+                if not pending:
+                    break
+            time.sleep(self.poll_interval)
+
+        with lock:
+            # 未完了のタスクは打ち切り時点までのレイテンシで記録 (除外すると分布が良く見える)
+            now = time.perf_counter()
+            for intended, actual in pending.values():
+                result.e2e.record((now - intended) * 1e6)
+                result.e2e_uncorrected.record((now - actual) * 1e6)
+            result.timed_out = len(pending)
+            pending.clear()
+        for thread in pollers:
+            thread.join()
+
+        elapsed = max(last_completion[0], start + duration) - start
+        result.throughput = (result.completed + result.failed) / elapsed if elapsed > 0 else 0.0
+        return result
+
+    def sweep(
+        self,
+        rates: Sequence[float],
+        duration: float,
+        arrival: str = 'poisson',
+        slo_ms: Optional[float] = None,
+        stop_on_saturation: bool = True
+    ) -> dict:
+        """到着レートを順に上げて投入し、飽和点・最大スループットを求める"""
+        stages = []
+        for rate in rates:
+            stage = self.run_stage(rate, duration, arrival)
+            stages.append(stage)
+            print(format_stage(stage, slo_ms), flush=True)
+            if stop_on_saturation and stage.saturated(slo_ms):
+                break
+
+        sustainable = [stage.rate for stage in stages if not stage.saturated(slo_ms)]
+        return {
+            'arrival': arrival,
+            'slo_ms': slo_ms,
+            'stages': [stage.to_dict() for stage in stages],
+            'max_sustainable_rate': max(sustainable) if sustainable else None,
+            'saturation_throughput': max(stage.throughput for stage in stages) if stages else 0.0,
+        }
+
+
+def format_stage(stage: StageResult, slo_ms: Optional[float] = None) -> str:
+    """1行の要約"""
+    e2e = stage.e2e.to_dict()
+    return (
+        f"rate {stage.rate:>7.1f}/s (offered {stage.offered:>7.1f}/s)  sent {stage.sent:>6}  done {stage.completed:>6}  "
+        f"429 {stage.rejected:>4}  err {stage.errors + stage.failed:>4}  timeout {stage.timed_out:>4}  "
+        f"thr {stage.throughput:>7.1f}/s  "
+        f"submit p99 {stage.submit.percentile(0.99) / 1000:>7.1f}ms  "
+        f"e2e p50 {e2e['p50_ms']:>8.1f} p90 {e2e['p90_ms']:>8.1f} p99 {e2e['p99_ms']:>8.1f} "
+        f"p99.9 {e2e['p99.9_ms']:>8.1f} max {e2e['max_ms']:>8.1f}ms  "
+        f"(uncorrected p99 {stage.e2e_uncorrected.percentile(0.99) / 1000:.1f}ms)"
+        f"{'  SATURATED' if stage.saturated(slo_ms) else ''}"
+    )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='VoiceBox open-loop load generator')
+    parser.add_argument('--url', default='http://localhost:5001', help='APIサーバーのURL')
+    rate_group = parser.add_mutually_exclusive_group()
+    rate_group.add_argument('--rate', type=float, default=5.0, help='到着レート (件/秒)')
+    rate_group.add_argument('--rates', help='順に投入する到着レート (カンマ区切り、飽和で停止)')
+    parser.add_argument('--duration', type=float, default=30.0, help='レートごとの投入秒数')
+    parser.add_argument('--arrival', choices=('poisson', 'constant'), default='poisson')
+    parser.add_argument('--replay', help='テキスト長・話者を抽出するJSONL (requests.jsonl, logs/traces.jsonl など)')
+    parser.add_argument('--speakers', default='1', help='リプレイに話者がない場合の話者 (カンマ区切り、一様)')
+    parser.add_argument('--senders', type=int, default=64)
+    parser.add_argument('--pollers', type=int, default=4)
+    parser.add_argument('--poll-interval', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=60.0, help='投入終了後に完了を待つ最大秒数')
+    parser.add_argument('--slo-ms', type=float, help='e2e p99 (補正後) がこれを超えたら飽和とみなす')
+    parser.add_argument('--client-id', default='loadgen')
+    parser.add_argument('--dedup', action='store_true', help='POST /tts の重複排除を有効にする')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果 (ヒストグラムの要約) の保存先')
+    args = parser.parse_args()
+
+    speakers = [int(s) for s in args.speakers.split(',')]
+    workload = Workload.from_file(args.replay, speakers) if args.replay else Workload.default(speakers)
+    generator = OpenLoopLoadGenerator(
+        args.url, workload,
+        senders=args.senders, pollers=args.pollers, poll_interval=args.poll_interval,
+        timeout=args.timeout, client_id=args.client_id, dedup=args.dedup, seed=args.seed
+    )
+    rates = [float(r) for r in args.rates.split(',')] if args.rates else [args.rate]
+    report = generator.sweep(rates, args.duration, args.arrival, args.slo_ms)
+    print(f"max sustainable rate: {report['max_sustainable_rate']}/s, "
+          f"saturation throughput: {report['saturation_throughput']:.1f}/s")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
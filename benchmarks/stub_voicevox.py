@@ -0,0 +1,243 @@
+"""
+Stub VOICEVOX Engine for VoiceBox TTS benchmarks
+ベンチマーク用のVOICEVOXスタブエンジン
+
+実エンジンの代わりに、設定したレイテンシ・ジッターで応答する。
+- GET  /version
+- POST /audio_query?speaker=&text=   1文字 = 1モーラの audio_query を返す
+- POST /synthesis?speaker=           モーラ数に比例した長さのWAVを返す
+                                     (前後に prePhonemeLength / postPhonemeLength の無音)
+- POST /multi_synthesis?speaker=     audio_query の配列を受け取り、001.wav, 002.wav, ... のZIPを返す
+処理時間 = latency_ms + per_mora_ms * モーラ数 + U(-jitter_ms, +jitter_ms)
+multi_synthesis は latency_ms を1回分 + 2件目以降1件あたり batch_item_ms + 全クエリのモーラ数分
+engine_slots > 0 の場合、合成は同時に engine_slots 件まで (超えた分はエンジン内で待つ)
+"""
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import urllib.parse
+import wave
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 句読点でアクセント句を区切る
+_PHRASE_BREAKS = set('、。,.!?！？ 　')
+
+
+def build_audio_query(text: str, sample_rate: int) -> dict:
+    """VOICEVOX互換の audio_query を生成"""
+    accent_phrases = []
+    moras = []
+    for char in text:
+        if char in _PHRASE_BREAKS:
+            if moras:
+                accent_phrases.append({
+                    'moras': moras, 'accent': 1, 'pause_mora': None, 'is_interrogative': False
+                })
+                moras = []
+            continue
+        moras.append({
+            'text': char, 'consonant': None, 'consonant_length': None,
+            'vowel': 'a', 'vowel_length': 0.08, 'pitch': 5.5
+        })
+    if moras:
+        accent_phrases.append({
+            'moras': moras, 'accent': 1, 'pause_mora': None, 'is_interrogative': False
+        })
+
+    return {
+        'accent_phrases': accent_phrases,
+        'speedScale': 1.0,
+        'pitchScale': 0.0,
+        'intonationScale': 1.0,
+        'volumeScale': 1.0,
+        'prePhonemeLength': 0.1,
+        'postPhonemeLength': 0.1,
+        'outputSamplingRate': sample_rate,
+        'outputStereo': False,
+        'kana': text,
+    }
+
+
+def count_moras(query: dict) -> int:
+    return sum(len(phrase['moras']) for phrase in query.get('accent_phrases', []))
+
+
+def render_wav(query: dict) -> bytes:
+    """audio_query から無音 + 正弦波のWAVを生成"""
+    sample_rate = query.get('outputSamplingRate', 24000)
+    speed = query.get('speedScale', 1.0) or 1.0
+    voiced = sum(
+        mora['vowel_length'] for phrase in query.get('accent_phrases', []) for mora in phrase['moras']
+    ) / speed
+    pre = int(query.get('prePhonemeLength', 0.1) * sample_rate)
+    post = int(query.get('postPhonemeLength', 0.1) * sample_rate)
+    voiced_samples = int(voiced * sample_rate)
+
+    period = [int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate)) for i in range(sample_rate // 220)]
+    tone = struct.pack(f'<{len(period)}h', *period)
+    repeats = voiced_samples // len(period) + 1
+    pcm = b'\x00\x00' * pre + (tone * repeats)[:voiced_samples * 2] + b'\x00\x00' * post
+
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+class StubVoicevoxEngine:
+    """VOICEVOXスタブエンジン (スレッドで起動)"""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency_ms: float = 20.0,
+        jitter_ms: float = 5.0,
+        per_mora_ms: float = 1.0,
+        query_latency_ms: float = 2.0,
+        sample_rate: int = 24000,
+        seed: int = 0,
+        batch_item_ms: float = 2.0,
+        engine_slots: int = 0
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_mora_ms = per_mora_ms
+        self.query_latency_ms = query_latency_ms
+        self.sample_rate = sample_rate
+        self.batch_item_ms = batch_item_ms
+        self.requests = Counter()
+        self._slots = threading.Semaphore(engine_slots) if engine_slots > 0 else None
+
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _delay(self, base_ms: float, moras: int = 0):
+        with self._rng_lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        delay_ms = max(0.0, base_ms + self.per_mora_ms * moras + jitter)
+        time.sleep(delay_ms / 1000)
+
+    def _synthesize_delay(self, base_ms: float, moras: int):
+        """合成の処理時間 (engine_slots の上限まで同時実行)"""
+        if self._slots is None:
+            self._delay(base_ms, moras)
+            return
+        with self._slots:
+            self._delay(base_ms, moras)
+
+    def _make_handler(self):
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path
+                engine.requests[path] += 1
+                if path == '/version':
+                    self._send(200, b'"stub"', 'application/json')
+                else:
+                    self._send(404, b'{}', 'application/json')
+
+            def do_POST(self):
+                parsed = urllib.parse.urlsplit(self.path)
+                params = urllib.parse.parse_qs(parsed.query)
+                engine.requests[parsed.path] += 1
+                body = self._read_body()
+
+                if parsed.path == '/audio_query':
+                    text = params.get('text', [''])[0]
+                    engine._delay(engine.query_latency_ms)
+                    query = build_audio_query(text, engine.sample_rate)
+                    self._send(200, json.dumps(query).encode(), 'application/json')
+
+                elif parsed.path == '/synthesis':
+                    query = json.loads(body)
+                    engine._synthesize_delay(engine.latency_ms, count_moras(query))
+                    self._send(200, render_wav(query), 'audio/wav')
+
+                elif parsed.path == '/multi_synthesis':
+                    queries = json.loads(body)
+                    engine._synthesize_delay(
+                        engine.latency_ms + engine.batch_item_ms * max(len(queries) - 1, 0),
+                        sum(count_moras(query) for query in queries)
+                    )
+                    buf = io.BytesIO()
+                    with zipfile.ZipFile(buf, 'w') as archive:
+                        for i, query in enumerate(queries):
+                            archive.writestr(f'{i + 1:03d}.wav', render_wav(query))
+                    self._send(200, buf.getvalue(), 'application/zip')
+
+                else:
+                    self._send(404, b'{}', 'application/json')
+
+        return Handler
+
+    def start(self) -> 'StubVoicevoxEngine':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stub VOICEVOX engine')
+    parser.add_argument('--port', type=int, default=50021)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--per-mora-ms', type=float, default=1.0)
+    parser.add_argument('--batch-item-ms', type=float, default=2.0)
+    parser.add_argument('--engine-slots', type=int, default=0, help='合成の同時実行数 (0 = 無制限)')
+    args = parser.parse_args()
+
+    stub = StubVoicevoxEngine(
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        per_mora_ms=args.per_mora_ms,
+        batch_item_ms=args.batch_item_ms,
+        engine_slots=args.engine_slots
+    ).start()
+    print(f'Stub VOICEVOX engine listening on {stub.url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,130 @@
+"""
+Async execution mode benchmarks
+非同期実行モード (threadsプール + イベントループ) と prefork のメモリ・スループット比較
+"""
+import multiprocessing
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import current_rss_kb
+from worker_models import NoopTask, process_memory_kb, sync_synthesize
+
+PREFORK_PROCESSES = 8
+ASYNC_SLOTS = 64
+TASKS = 400
+RESULT_TIMEOUT = 30
+
+
+def _text(i: int) -> str:
+    return f"非同期実行モード{i}番目のナレーションです。"
+
+
+@pytest.fixture
+def async_mode(monkeypatch, stub_engine):
+    """celery_worker を非同期実行モードに切り替える"""
+    import celery_worker
+    from async_runtime import AsyncRuntime
+
+    runtime = AsyncRuntime(max_inflight=ASYNC_SLOTS)
+    monkeypatch.setattr(celery_worker, 'async_runtime', runtime)
+    yield runtime
+    runtime.stop()
+
+
+def test_async_mode_task_schema(celery_stack, async_mode):
+    """非同期実行モードでもタスク名・結果スキーマは同じ"""
+    from celery.result import AsyncResult
+
+    task_ids = [celery_stack.send_task('voicebox.tts', args=[_text(i), 1]).id for i in range(20)]
+    for task_id in task_ids:
+        result = AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+        assert result['success'], result
+        assert set(result) == {'success', 'audio_path', 'audio_format', 'speaker', 'file_size', 'task_id'}
+
+
+def test_async_mode_auto_play_serialized(celery_stack, async_mode, monkeypatch, tmp_path):
+    """同時に完了したタスクの自動再生が重ならないこと"""
+    import celery_worker
+    from celery.result import AsyncResult
+
+    # 再生中は playing ディレクトリを作り、既にあれば重なりとして記録する
+    player = tmp_path / 'player.sh'
+    player.write_text(
+        '#!/bin/sh\n'
+        f'mkdir "{tmp_path}/playing" 2>/dev/null || echo "$1" >> "{tmp_path}/overlaps"\n'
+        f'echo "$1" >> "{tmp_path}/played"\n'
+        'sleep 0.02\n'
+        f'rmdir "{tmp_path}/playing" 2>/dev/null\n'
+        'exit 0\n'
+    )
+    player.chmod(player.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(celery_worker, 'AUTO_PLAY', True)
+    monkeypatch.setattr(celery_worker, 'AUTO_PLAY_COMMAND', str(player))
+
+    task_ids = [celery_stack.send_task('voicebox.tts', args=[f'再生{i}', 1]).id for i in range(8)]
+    for task_id in task_ids:
+        assert AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT)['success']
+
+    assert len((tmp_path / 'played').read_text().split()) == len(task_ids)
+    assert not os.path.exists(tmp_path / 'overlaps')
+
+
+def test_async_mode_task_deadline(celery_stack, async_mode, monkeypatch, stub_engine):
+    """threadsプールでは task_time_limit が効かないため、VOICEVOX呼び出し全体の期限で打ち切られること"""
+    import celery_worker
+    from celery.result import AsyncResult
+
+    monkeypatch.setattr(celery_worker, 'ASYNC_TASK_TIME_LIMIT', 0.3)
+    monkeypatch.setattr(stub_engine, 'query_latency_ms', 200)
+    monkeypatch.setattr(stub_engine, 'latency_ms', 200)
+    start = time.monotonic()
+    task_id = celery_stack.send_task('voicebox.tts', args=[_text(0) + '期限切れ', 1]).id
+    result = AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+    assert not result['success']
+    assert time.monotonic() - start < 2
+
+
+def test_prefork_vs_async(bench, stub_engine, async_mode):
+    """同時処理枠あたりのメモリとスループット"""
+    import celery_worker
+
+    # prefork: 親でモジュールを読み込んでから fork (Celeryのpreforkと同じ共有状態)
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['celery_worker', 'worker_models'])
+    with ctx.Pool(PREFORK_PROCESSES) as pool:
+        pool.map(sync_synthesize, [[_text(i)] for i in range(PREFORK_PROCESSES)])  # ウォームアップ
+        start = time.perf_counter()
+        pool.map(sync_synthesize, [[_text(i)] for i in range(TASKS)], chunksize=1)
+        prefork_throughput = TASKS / (time.perf_counter() - start)
+        prefork_kb = sum(process_memory_kb(process.pid) for process in pool._pool)
+
+    # async: 1プロセス内のスレッド (Celery threadsプールの各スロット) + イベントループ
+    task = NoopTask()
+    before = current_rss_kb()
+    with ThreadPoolExecutor(ASYNC_SLOTS) as executor:
+        list(executor.map(lambda i: celery_worker.synthesize_wav(task, 'bench', _text(i), 1),
+                          range(ASYNC_SLOTS)))  # ウォームアップ (スレッド・接続の確立)
+        start = time.perf_counter()
+        list(executor.map(lambda i: celery_worker.synthesize_wav(task, 'bench', _text(i), 1),
+                          range(TASKS)))
+        async_throughput = TASKS / (time.perf_counter() - start)
+        async_kb = max(current_rss_kb() - before, 0)
+
+    prefork_per_slot = prefork_kb / PREFORK_PROCESSES
+    async_per_slot = async_kb / ASYNC_SLOTS
+    print(f'\nprefork: {PREFORK_PROCESSES} procs {prefork_throughput:.0f} tasks/s '
+          f'{prefork_kb} KB PSS ({prefork_per_slot:.0f} KB/slot)'
+          f'\nasync:   {ASYNC_SLOTS} slots {async_throughput:.0f} tasks/s '
+          f'+{async_kb} KB RSS ({async_per_slot:.0f} KB/slot, process {process_memory_kb()} KB)')
+
+    bench.record('prefork_throughput_tasks_per_s', prefork_throughput, 'tasks/s', higher_is_better=True)
+    bench.record('async_throughput_tasks_per_s', async_throughput, 'tasks/s', higher_is_better=True)
+    bench.record('prefork_memory_kb_per_slot', prefork_per_slot, 'KB')
+    bench.record('async_memory_kb_per_slot', async_per_slot, 'KB')
+
+    assert async_per_slot * 10 < prefork_per_slot
+    bench.check('async_throughput_tasks_per_s', 'async_memory_kb_per_slot')
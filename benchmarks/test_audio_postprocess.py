@@ -0,0 +1,71 @@
+"""
+Audio post-processing benchmarks
+合成済みWAVの後処理 (無音トリム・音量正規化・時間伸縮) のコストと効果の計測
+"""
+import io
+import time
+import wave
+
+import numpy as np
+
+from audio_postprocess import AudioPostProcessor, parse_wav, trim_silence
+from stub_voicevox import build_audio_query, render_wav
+
+TEXT = 'ベンチマーク用のナレーションです。処理時間を計測します。'
+SAMPLE_RATE = 24000
+
+
+def _duration(wav_bytes: bytes) -> float:
+    with wave.open(io.BytesIO(wav_bytes)) as w:
+        return w.getnframes() / w.getframerate()
+
+
+def _leading_silence_ms(wav_bytes: bytes) -> float:
+    info = parse_wav(wav_bytes)
+    samples = np.frombuffer(wav_bytes, dtype='<i2', offset=info.data_offset, count=info.data_size // 2)
+    voiced = np.flatnonzero(np.abs(samples) > 100)
+    return voiced[0] / info.sample_rate * 1000 if len(voiced) else 0.0
+
+
+def test_postprocess_cost(bench):
+    """後処理1回のコスト (トリム + 正規化 / 時間伸縮込み)"""
+    wav_bytes = render_wav(build_audio_query(TEXT, SAMPLE_RATE))
+    processor = AudioPostProcessor(enabled=True, trim=True, normalize=True)
+
+    durations = []
+    for _ in range(100):
+        start = time.perf_counter()
+        processed = processor.process(wav_bytes)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    stretch_durations = []
+    for _ in range(20):
+        start = time.perf_counter()
+        stretched = processor.process(wav_bytes, speed=1.3)
+        stretch_durations.append((time.perf_counter() - start) * 1000)
+
+    # 前後の無音 (pre/postPhonemeLength 0.1秒) がパディング分を残して除去される
+    saved_ms = _leading_silence_ms(wav_bytes) - _leading_silence_ms(processed)
+    assert saved_ms > 50
+    assert abs(_duration(stretched) - _duration(processed) / 1.3) < 0.05
+
+    # CPUのみの処理のため、他プロセスの影響を受けにくい最小値で比較する
+    bench.record('postprocess_min_ms', min(durations), 'ms')
+    bench.record('postprocess_stretch_min_ms', min(stretch_durations), 'ms')
+    bench.record('postprocess_leading_silence_saved_ms', saved_ms, 'ms', higher_is_better=True)
+    bench.check('postprocess_min_ms', 'postprocess_stretch_min_ms')
+
+
+def test_postprocess_zero_copy():
+    """トリムはレスポンスのバッファを参照するビューを返す"""
+    wav_bytes = render_wav(build_audio_query(TEXT, SAMPLE_RATE))
+    info = parse_wav(wav_bytes)
+    samples = np.frombuffer(memoryview(wav_bytes)[info.data_offset:], dtype='<i2')
+
+    trimmed = trim_silence(samples, info.sample_rate)
+    assert len(trimmed) < len(samples)
+    assert np.shares_memory(trimmed, samples)
+
+    # 変更がない場合は元のバイト列をそのまま返す
+    processor = AudioPostProcessor(enabled=True, trim=False, normalize=False, speed=1.0)
+    assert processor.process(wav_bytes) is wav_bytes
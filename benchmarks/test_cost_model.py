@@ -0,0 +1,248 @@
+"""
+Cost model / SJF scheduling benchmarks
+合成コストの見積もり精度と、SJF (+エージング) による短いタスクの待ち時間の計測
+"""
+import random
+import time
+
+from celery.result import AsyncResult
+from celery.signals import task_postrun
+
+from conftest import percentile
+from cost_model import CostModel
+import dispatcher as dispatcher_module
+from dispatcher import DISPATCH_HEADER, SJFDispatcher, notify_done
+from metrics import MetricsCollector
+from worker_models import NoopTask
+
+RESULT_TIMEOUT = 60
+SHORT_TEXT = 'ビルド完了。'
+LONG_TEXT = 'テストを実行しています。' * 10
+
+
+def test_cost_estimate_accuracy(bench, monkeypatch, stub_engine):
+    """長さの異なるテキストの合成時間の見積もり誤差 (学習後)"""
+    import celery_worker
+
+    model = CostModel()
+    monkeypatch.setattr(celery_worker, 'cost_model', model)
+    rng = random.Random(0)
+    texts = [f'{i}番目、' + 'あいうえお漢字' * rng.randint(1, 20) for i in range(100)]
+
+    errors = []
+    for i, text in enumerate(texts):
+        estimated = model.estimate(text, 1)
+        start = time.perf_counter()
+        celery_worker.synthesize_wav(NoopTask(), 'bench', text, 1)
+        actual = (time.perf_counter() - start) * 1000
+        if i >= 40:
+            errors.append(abs(estimated - actual) / actual)
+
+    stats = model.get_stats()
+    print(f"\ncost model: {stats['base_ms']:.1f} ms + {stats['ms_per_mora']:.2f} ms/mora, "
+          f'mean abs error {sum(errors) / len(errors):.1%}')
+
+    bench.record('cost_estimate_mean_abs_error', sum(errors) / len(errors), 'ratio')
+    assert sum(errors) / len(errors) < 0.3
+    bench.check('cost_estimate_mean_abs_error')
+
+
+def _short_task_latency(api_client, monkeypatch, aging_rate: float):
+    """短いタスクと長いタスクを交互に投入し、タスクごとの完了までの時間を返す"""
+    import api_server
+    import celery_worker
+
+    # 合成を直列に処理するエンジン (VOICEVOX 1台) を想定して同時実行1
+    dispatcher = SJFDispatcher(aging_rate=aging_rate, max_inflight=1)
+    dispatcher.attach(api_server.dispatch_task)
+    monkeypatch.setattr(api_server, 'dispatcher', dispatcher)
+    monkeypatch.setattr(celery_worker, 'dispatcher', dispatcher)
+
+    submitted, finished = {}, {}
+
+    def on_postrun(task_id=None, **kwargs):
+        finished[task_id] = time.perf_counter()
+
+    task_postrun.connect(on_postrun, weak=False)
+    try:
+        for i in range(20):
+            for text in (LONG_TEXT, SHORT_TEXT):
+                response = api_client.post('/tts', json={'text': f'{i}{text}', 'speaker': 1})
+                assert response.status_code == 202
+                body = response.get_json()
+                assert body['eta_ms'] > 0 and body['lane'] in ('short', 'long')
+                submitted[body['task_id']] = (text is SHORT_TEXT, time.perf_counter())
+        deadline = time.monotonic() + RESULT_TIMEOUT
+        while not all(task_id in finished for task_id in submitted):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        task_postrun.disconnect(on_postrun)
+        dispatcher.stop()
+
+    short, long = [], []
+    for task_id, (is_short, start) in submitted.items():
+        (short if is_short else long).append((finished[task_id] - start) * 1000)
+    return short, long
+
+
+def test_sjf_short_task_latency(bench, api_client, celery_stack, monkeypatch):
+    """到着順 (FIFO) と SJF+エージングでの短いタスクの完了時間"""
+    from celery.result import AsyncResult
+
+    # 見積もりを学習させておく
+    task_ids = [
+        api_client.post('/tts', json={'text': f'warmup{i}{text}', 'speaker': 1}).get_json()['task_id']
+        for i in range(10) for text in (LONG_TEXT, SHORT_TEXT)
+    ]
+    for task_id in task_ids:
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+
+    fifo_short, fifo_long = _short_task_latency(api_client, monkeypatch, aging_rate=float('inf'))
+    sjf_short, sjf_long = _short_task_latency(api_client, monkeypatch, aging_rate=0.5)
+
+    print(f'\nFIFO: short p95 {percentile(fifo_short, 0.95):.0f} ms, long max {max(fifo_long):.0f} ms'
+          f'\nSJF:  short p95 {percentile(sjf_short, 0.95):.0f} ms, long max {max(sjf_long):.0f} ms')
+
+    bench.record('fifo_short_task_p95_ms', percentile(fifo_short, 0.95), 'ms')
+    bench.record('sjf_short_task_p95_ms', percentile(sjf_short, 0.95), 'ms')
+    bench.record('sjf_long_task_max_ms', max(sjf_long), 'ms')
+
+    assert percentile(sjf_short, 0.95) * 2 < percentile(fifo_short, 0.95)
+    bench.check('sjf_short_task_p95_ms')
+
+
+def test_sjf_reclaims_lost_slots(shared_redis):
+    """task_done が届かない (ワーカーの強制終了など) タスクの枠が期限後に回収されること"""
+    sent = []
+    dispatcher = SJFDispatcher(shared_redis, max_inflight=1, inflight_timeout=0.3)
+    dispatcher.attach(lambda job: sent.append((job['task_id'], time.monotonic())))
+    try:
+        start = time.monotonic()
+        for i in range(3):
+            dispatcher.submit(f'lost-{i}', 'テキスト', 1, cost_ms=100, lane='short')
+        deadline = time.monotonic() + 5
+        while len(sent) < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # 完了通知の届いたタスクの枠はすぐ空く
+        dispatcher.submit('done-0', 'テキスト', 1, cost_ms=100, lane='short')
+        while len(sent) < 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        dispatcher.task_done('done-0')
+        dispatcher.submit('done-1', 'テキスト', 1, cost_ms=100, lane='short')
+        while len(sent) < 5:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        stats = dispatcher.get_stats()
+    finally:
+        dispatcher.stop()
+
+    assert [task_id for task_id, _ in sent] == ['lost-0', 'lost-1', 'lost-2', 'done-0', 'done-1']
+    assert sent[1][1] - start >= 0.3 and sent[2][1] - sent[1][1] >= 0.3
+    assert sent[4][1] - sent[3][1] < 0.3
+    assert stats['reclaimed'] == 3 and stats['inflight'] == 1
+    if shared_redis is not None:
+        assert shared_redis.zrange(dispatcher.inflight_key, 0, -1) == [b'done-1']
+
+
+def test_sjf_done_notified_by_header(redis_client, monkeypatch):
+    """ディスパッチャの設定がないワーカーもヘッダーの名前空間へ完了を通知し、保留がない間は枠の確保を繰り返さないこと"""
+    monkeypatch.setitem(dispatcher_module._notifiers, 'notify', SJFDispatcher(redis_client, namespace='notify'))
+    sent = []
+    dispatcher = SJFDispatcher(redis_client, max_inflight=1, namespace='notify')
+    dispatcher.attach(sent.append)
+    reserve = dispatcher._reserve
+    reserves = []
+
+    def counting_reserve(*args, **kwargs):
+        reserves.append(time.monotonic())
+        return reserve(*args, **kwargs)
+
+    dispatcher._reserve = counting_reserve
+    try:
+        deadline = time.monotonic() + 5
+        for i in range(2):
+            dispatcher.submit(f'job-{i}', 'テキスト', 1, cost_ms=100, lane='short', headers={'traceparent': 'x'})
+        while not sent:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        time.sleep(0.3)
+        assert len(sent) == 1
+        assert sent[0]['headers'] == {'traceparent': 'x', DISPATCH_HEADER: 'notify'}
+
+        # ワーカー側 (ローカルのディスパッチャなし)
+        notify_done('job-0', sent[0]['headers'][DISPATCH_HEADER])
+        while len(sent) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        notify_done('job-1', sent[1]['headers'][DISPATCH_HEADER], local=None)
+
+        idle_since = time.monotonic() + 0.2
+        time.sleep(1.5)
+        assert len([at for at in reserves if at > idle_since]) == 0
+        assert dispatcher.get_stats()['inflight'] == 0
+    finally:
+        dispatcher.stop()
+
+
+def test_estimate_accuracy_in_api_metrics(api_client, celery_stack, monkeypatch):
+    """ワーカーで記録した見積もり精度が API の /metrics に出ること (APIとワーカーは別プロセス)"""
+    import api_server
+    import celery_worker
+
+    model = CostModel()
+    monkeypatch.setattr(api_server, 'cost_model', model)
+    monkeypatch.setattr(celery_worker, 'cost_model', model)
+    # APIプロセスのメトリクスにはワーカーの記録が入らない
+    monkeypatch.setattr(api_server, 'metrics', MetricsCollector())
+
+    assert api_client.get('/metrics').get_json()['stats']['cost_estimate']['mean_abs_error'] is None
+    task_ids = [
+        api_client.post('/tts', json={'text': f'{i}{SHORT_TEXT}', 'speaker': 1}).get_json()['task_id']
+        for i in range(5)
+    ]
+    for task_id in task_ids:
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+
+    estimate = api_client.get('/metrics').get_json()['stats']['cost_estimate']
+    assert estimate['samples'] >= 5
+    assert estimate['mean_abs_error'] >= abs(estimate['bias']) >= 0
+
+
+def test_cost_model_shared_through_redis(redis_client):
+    """ワーカーで学習したモデルと見積もり精度を別インスタンス (APIプロセス) が Redis から読めること"""
+    worker = CostModel(redis_client, refresh_seconds=0, namespace='shared')
+    api = CostModel(redis_client, refresh_seconds=0, namespace='shared')
+    for i in range(60):
+        morae = 10 + i % 20
+        worker.observe('あ' * morae, 1, morae, 50 + 5 * morae)
+        worker.record_accuracy(110, 100)
+
+    assert redis_client.exists(f'{worker.prefix}fit:ms', f'{worker.prefix}fit:accuracy') == 2
+    stats = api.get_stats()
+    assert abs(stats['base_ms'] - 50) < 5 and abs(stats['ms_per_mora'] - 5) < 0.5
+    accuracy = api.accuracy()
+    assert accuracy['samples'] > 10 and abs(accuracy['bias'] - 0.1) < 1e-6
+
+
+def test_backlog_releases_lost_tasks(shared_redis):
+    """着手されないまま消えたタスクの見積もりが期限後にバックログから外れ、二重の減算もしないこと"""
+    model = CostModel(shared_redis, backlog_ttl=0.3, namespace='backlog')
+    assert model.enqueue('lost', 'short', 100) == 100
+    assert model.enqueue('started', 'short', 200) == 300
+    model.dequeue('started')
+    model.dequeue('started')
+    assert model.get_backlog()['short'] == 100
+
+    # 投入に失敗したタスク (API の例外経路)
+    model.enqueue('failed', 'long', 500)
+    model.dequeue('failed')
+    assert model.get_backlog()['long'] == 0
+
+    time.sleep(0.4)
+    assert model.get_backlog() == {'short': 0.0, 'long': 0.0}
+    assert model.enqueue('next', 'short', 50) == 50
+    if shared_redis is not None:
+        assert shared_redis.hkeys(f'{model.prefix}backlog:tasks') == [b'next']
@@ -0,0 +1,233 @@
+"""
+Fair queuing / client quota benchmarks
+大量に投入するクライアントがいる場合の対話的クライアントの待ち時間と、クォータの動作
+"""
+import threading
+import time
+
+from celery.result import AsyncResult
+from celery.signals import task_postrun
+
+from conftest import percentile
+from dispatcher import FairDispatcher, SJFDispatcher
+from rate_limiter import ClientQuota
+from text_normalizer import DedupWindow
+
+RESULT_TIMEOUT = 60
+NOISY_TEXT = 'フックから連続で送られるナレーションです。'
+INTERACTIVE_TEXT = '了解。'
+
+
+def _interactive_latency(api_client, monkeypatch, dispatcher):
+    """noisy クライアントが40件を一度に投入した直後から、interactive クライアントが
+    0.1秒間隔で5件投入し、それぞれの完了までの時間を返す"""
+    import api_server
+    import celery_worker
+
+    dispatcher.attach(api_server.dispatch_task)
+    monkeypatch.setattr(api_server, 'dispatcher', dispatcher)
+    monkeypatch.setattr(celery_worker, 'dispatcher', dispatcher)
+
+    submitted, finished = {}, {}
+
+    def on_postrun(task_id=None, **kwargs):
+        finished[task_id] = time.perf_counter()
+
+    def post(client, text):
+        response = api_client.post('/tts', json={'text': text, 'speaker': 1}, headers={'X-Client-Id': client})
+        assert response.status_code == 202
+        submitted[response.get_json()['task_id']] = (client, time.perf_counter())
+
+    task_postrun.connect(on_postrun, weak=False)
+    try:
+        for i in range(40):
+            post('noisy', f'{i}{NOISY_TEXT}')
+        for i in range(5):
+            post('interactive', f'{i}{INTERACTIVE_TEXT}')
+            time.sleep(0.1)
+        deadline = time.monotonic() + RESULT_TIMEOUT
+        while not all(task_id in finished for task_id in submitted):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        stats = dispatcher.get_stats()
+    finally:
+        task_postrun.disconnect(on_postrun)
+        dispatcher.stop()
+
+    latencies = {'noisy': [], 'interactive': []}
+    for task_id, (client, start) in submitted.items():
+        latencies[client].append((finished[task_id] - start) * 1000)
+    return latencies, stats
+
+
+def test_fair_queuing_interactive_latency(bench, api_client, celery_stack, monkeypatch):
+    """到着順 (FIFO) と DRR での対話的クライアントの完了時間 (同時実行1)"""
+    # 見積もりを学習させておく
+    task_ids = [
+        api_client.post('/tts', json={'text': f'warmup{i}{text}', 'speaker': 1}).get_json()['task_id']
+        for i in range(10) for text in (NOISY_TEXT, INTERACTIVE_TEXT)
+    ]
+    for task_id in task_ids:
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+
+    fifo, _ = _interactive_latency(
+        api_client, monkeypatch, SJFDispatcher(aging_rate=float('inf'), max_inflight=1)
+    )
+    fair, stats = _interactive_latency(
+        api_client, monkeypatch, FairDispatcher(quantum_ms=100, weights={}, max_inflight=1)
+    )
+
+    assert stats['policy'] == 'fair'
+    assert stats['clients']['noisy']['dispatched'] == 40
+    assert stats['clients']['interactive']['wait_p95_ms'] < stats['clients']['noisy']['wait_p95_ms']
+    print(f"\nFIFO: interactive p95 {percentile(fifo['interactive'], 0.95):.0f} ms, "
+          f"noisy max {max(fifo['noisy']):.0f} ms"
+          f"\nDRR:  interactive p95 {percentile(fair['interactive'], 0.95):.0f} ms, "
+          f"noisy max {max(fair['noisy']):.0f} ms")
+
+    bench.record('fifo_interactive_p95_ms', percentile(fifo['interactive'], 0.95), 'ms')
+    bench.record('fair_interactive_p95_ms', percentile(fair['interactive'], 0.95), 'ms')
+    bench.record('fair_noisy_max_ms', max(fair['noisy']), 'ms')
+
+    assert percentile(fair['interactive'], 0.95) * 2 < percentile(fifo['interactive'], 0.95)
+    bench.check('fair_interactive_p95_ms')
+
+
+def test_client_quota(bench, api_client, monkeypatch):
+    """クォータ超過のクライアントのみ 429 になること、と1回の判定のコスト"""
+    import api_server
+
+    quota = ClientQuota(rate=1, capacity=5)
+    monkeypatch.setattr(api_server, 'client_quota', quota)
+
+    statuses = [
+        api_client.post('/tts', json={'text': f'連投{i}', 'speaker': 1}, headers={'X-Client-Id': 'noisy'})
+        for i in range(20)
+    ]
+    assert [r.status_code for r in statuses].count(202) == 5
+    rejected = [r for r in statuses if r.status_code == 429]
+    assert len(rejected) == 15
+    assert int(rejected[0].headers['Retry-After']) >= 1
+    assert rejected[0].get_json()['client'] == 'noisy'
+
+    response = api_client.post('/tts', json={'text': '割り込み', 'speaker': 1}, headers={'X-Client-Id': 'interactive'})
+    assert response.status_code == 202
+    assert api_client.get('/metrics').get_json()['quota']['clients']['noisy']['rejected'] == 15
+
+    calls = 20000
+    durations = []
+    for _ in range(5):
+        bucket = ClientQuota(rate=1e9, capacity=1e9)
+        start = time.perf_counter()
+        for i in range(calls):
+            bucket.try_acquire('client')
+        durations.append((time.perf_counter() - start) / calls * 1e6)
+
+    bench.record('quota_acquire_us', min(durations), 'us')
+    bench.check('quota_acquire_us')
+
+
+def test_quota_rejection_releases_dedup(api_client, celery_stack, monkeypatch):
+    """429 にしたタスクIDが重複排除に残らず、同じテキストの次のリクエストが新規に投入されること"""
+    import api_server
+
+    monkeypatch.setattr(api_server, 'client_quota', ClientQuota(rate=0.01, capacity=1))
+    monkeypatch.setattr(api_server, 'dedup', DedupWindow(60))
+
+    assert api_client.post('/tts', json={'text': '一つ目', 'speaker': 1}, headers={'X-Client-Id': 'a'}).status_code == 202
+    rejected = api_client.post('/tts', json={'text': '二つ目', 'speaker': 1}, headers={'X-Client-Id': 'a'})
+    assert rejected.status_code == 429
+
+    response = api_client.post('/tts', json={'text': '二つ目', 'speaker': 1}, headers={'X-Client-Id': 'b'})
+    assert response.status_code == 202
+    assert 'duplicate' not in response.get_json()
+    result = AsyncResult(response.get_json()['task_id'], app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+    assert result['success']
+
+    # 投入済みのタスクは引き続き重複として返る
+    duplicate = api_client.post('/tts', json={'text': '二つ目', 'speaker': 1}, headers={'X-Client-Id': 'a'})
+    assert duplicate.status_code == 200
+    assert duplicate.get_json()['task_id'] == response.get_json()['task_id']
+
+
+def test_client_quota_bounded(monkeypatch):
+    """クライアントIDを入れ替え続けても受付・拒否数とバケットが上限件数までしか残らないこと"""
+    import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, '_MAX_LOCAL_CLIENTS', 50)
+    quota = ClientQuota(rate=1, capacity=1)
+    for i in range(500):
+        quota.try_acquire('steady')
+        quota.try_acquire(f'rotating-{i}')
+
+    clients = quota.get_stats()['clients']
+    assert len(clients) == 50 and len(quota._buckets) == 50
+    assert clients['steady'] == {'accepted': 1, 'rejected': 499, 'rate': 1, 'burst': 1}
+    assert 'rotating-0' not in clients and clients['rotating-499']['accepted'] == 1
+
+
+def test_fair_dispatch_order(shared_redis):
+    """保留中の noisy 10件と interactive 3件が DRR で交互に投入されること"""
+    gate = threading.Event()
+    sent = []
+    dispatcher = FairDispatcher(shared_redis, quantum_ms=100, weights={}, max_inflight=1)
+
+    def send(job):
+        # 最初のジョブ (blocker) の投入中に残りを登録し、保留キューに溜める
+        gate.wait(5)
+        sent.append(job['task_id'])
+        dispatcher.task_done(job['task_id'])
+
+    dispatcher.attach(send)
+    try:
+        dispatcher.submit('blocker', 'テキスト', 1, cost_ms=100, lane='short', client='blocker')
+        time.sleep(0.1)
+        for i in range(10):
+            dispatcher.submit(f'noisy-{i}', 'テキスト', 1, cost_ms=100, lane='short', client='noisy')
+        for i in range(3):
+            dispatcher.submit(f'interactive-{i}', 'テキスト', 1, cost_ms=100, lane='short', client='interactive')
+        if shared_redis is not None:
+            assert shared_redis.llen(f'{dispatcher.queue_prefix}noisy') == 10
+            assert shared_redis.llen(f'{dispatcher.queue_prefix}interactive') == 3
+        gate.set()
+        deadline = time.monotonic() + 5
+        while len(sent) < 14:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+
+    assert sent[:7] == [
+        'blocker', 'noisy-0', 'interactive-0', 'noisy-1', 'interactive-1', 'noisy-2', 'interactive-2'
+    ]
+    assert sent[7:] == [f'noisy-{i}' for i in range(3, 10)]
+
+
+def test_client_quota_token_bucket(shared_redis):
+    """バースト分だけ受け付けて以降は待ち時間を返し、Redis では別プロセス (別インスタンス) と共有されること"""
+    quota = ClientQuota(rate=1, capacity=3, redis_client=shared_redis, namespace='bucket')
+    other = ClientQuota(rate=1, capacity=3, redis_client=shared_redis, namespace='bucket')
+
+    assert [quota.try_acquire('c') for _ in range(3)] == [0, 0, 0]
+    wait = quota.try_acquire('c')
+    assert 0.5 < wait <= 1.0
+    if shared_redis is None:
+        assert other.try_acquire('c') == 0
+    else:
+        assert shared_redis.exists(f'{quota.prefix}c')
+        assert other.try_acquire('c') > 0
+
+
+def test_dedup_discard_compare_and_delete(shared_redis):
+    """discard は登録した値と一致する場合のみ取り消すこと"""
+    window = DedupWindow(60, shared_redis, namespace='discard')
+
+    assert window.check_and_add('テキスト', 1, 'task-a') is None
+    assert window.check_and_add('テキスト', 1, 'task-b') == 'task-a'
+    if shared_redis is not None:
+        assert shared_redis.keys(f'{window.prefix}*')
+
+    window.discard('テキスト', 1, 'task-b')
+    assert window.check_and_add('テキスト', 1, 'task-c') == 'task-a'
+    window.discard('テキスト', 1, 'task-a')
+    assert window.check_and_add('テキスト', 1, 'task-c') is None
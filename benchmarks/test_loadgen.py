@@ -0,0 +1,86 @@
+"""
+Open-loop load generator benchmarks
+HDRヒストグラムの精度と、オープンループ負荷での飽和スループット・補正後のレイテンシ
+"""
+import json
+import math
+import random
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from loadgen import LatencyHistogram, OpenLoopLoadGenerator, Workload
+
+
+def test_histogram_accuracy(bench):
+    """記録値の分位点の相対誤差 (有効桁3) と1件の記録コスト"""
+    rng = random.Random(0)
+    values = [int(rng.lognormvariate(10, 1.5)) for _ in range(100000)]
+    histogram = LatencyHistogram()
+    # 5回に分けて記録した最小値 (他プロセスの影響を避ける)
+    chunk = len(values) // 5
+    chunks = []
+    for n in range(5):
+        start = time.perf_counter()
+        for value in values[n * chunk:(n + 1) * chunk]:
+            histogram.record(value)
+        chunks.append((time.perf_counter() - start) / chunk * 1e9)
+    record_ns = min(chunks)
+
+    values.sort()
+    for q in (0.5, 0.9, 0.99, 0.999, 1.0):
+        exact = values[max(math.ceil(q * len(values)), 1) - 1]
+        assert abs(histogram.percentile(q) - exact) <= exact * 1e-3
+
+    bench.record('hdr_record_ns', record_ns, 'ns')
+    bench.check('hdr_record_ns')
+
+
+def test_replay_workload(tmp_path):
+    """テキスト / text_length (トレース) / body (バックログ) からの抽出"""
+    path = tmp_path / 'replay.jsonl'
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in (
+            {'text': 'こんにちは', 'speaker': 3},
+            {'name': 'POST /tts', 'attributes': {'text_length': 12, 'speaker': 2}},
+            {'name': 'tts_task', 'attributes': {'task_id': 'x'}},
+            {'request_id': 'user-001', 'title': 't', 'body': '長い説明文です。'},
+        ):
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    workload = Workload.from_file(str(path), speakers=(1,))
+    assert workload.samples[0] == ('こんにちは', 3)
+    assert len(workload.samples[1][0]) == 13 and workload.samples[1][1] == 2
+    assert workload.samples[2] == ('長い説明文です。', None)
+    assert len(workload.samples) == 3
+
+
+def test_open_loop_saturation(bench, celery_stack):
+    """飽和しない到着レートと飽和する到着レートでの補正後/補正なしのレイテンシ"""
+    import api_server
+
+    server = make_server('127.0.0.1', 0, api_server.api, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        generator = OpenLoopLoadGenerator(
+            f'http://127.0.0.1:{server.server_port}', Workload.default(),
+            senders=8, pollers=2, poll_interval=0.01, timeout=30
+        )
+        report = generator.sweep([10, 400], duration=2.0, arrival='poisson', stop_on_saturation=False)
+    finally:
+        server.shutdown()
+
+    light, heavy = report['stages']
+    assert light['errors'] == 0 and light['timed_out'] == 0
+    assert light['completed'] == light['sent']
+    assert report['max_sustainable_rate'] == 10
+    # 送信スレッドが詰まると実送信が予定時刻から遅れ、補正なしの値は待ちを過小評価する
+    assert heavy['send_lag_max_ms'] > 0
+    assert heavy['e2e_ms']['p99_ms'] >= heavy['e2e_uncorrected_ms']['p99_ms']
+
+    bench.record('loadgen_e2e_p99_ms_light', light['e2e_ms']['p99_ms'], 'ms')
+    bench.record('loadgen_saturation_tasks_per_s', report['saturation_throughput'], 'tasks/s',
+                 higher_is_better=True)
+    bench.check('loadgen_saturation_tasks_per_s')
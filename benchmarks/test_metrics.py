@@ -0,0 +1,116 @@
+"""
+MetricsCollector benchmarks
+100万タスク記録時のメモリ・get_stats コストの計測
+"""
+import time
+import tracemalloc
+
+from metrics import MetricsCollector
+
+TASK_COUNT = 1_000_000
+TEXT = 'ベンチマーク用のナレーションです。'
+
+
+def _run_tasks(collector: MetricsCollector, count: int, prefix: str = 't'):
+    for i in range(count):
+        task_id = f'{prefix}{i}'
+        collector.task_start(task_id, TEXT, 1)
+        if i % 50:
+            collector.task_complete(task_id, 48000)
+        else:
+            collector.task_failure(task_id, 'error')
+
+
+def test_metrics_memory_bounded(bench):
+    """100万タスク処理後の保持メモリ (件数によらず一定であること)"""
+    tracemalloc.start()
+    try:
+        collector = MetricsCollector()
+        base = tracemalloc.get_traced_memory()[0]
+
+        # 履歴が埋まった時点と100万件後の保持量を比較
+        _run_tasks(collector, collector.max_history * 2, prefix='warm')
+        warm = tracemalloc.get_traced_memory()[0] - base
+        _run_tasks(collector, TASK_COUNT)
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+
+    stats = collector.get_stats()
+    assert stats['active_tasks'] == 0
+    assert stats['counters']['tasks_started'] == TASK_COUNT + collector.max_history * 2
+
+    bench.record('metrics_retained_kb_after_1m_tasks', retained / 1024, 'KB')
+    assert retained < warm * 1.5 + 64 * 1024, f'retained {retained}B grew from {warm}B'
+    bench.check('metrics_retained_kb_after_1m_tasks')
+
+
+def test_metrics_memory_per_active_task(bench):
+    """実行中タスク1件あたりのメモリ"""
+    count = 10000
+    tracemalloc.start()
+    try:
+        collector = MetricsCollector(max_active=count)
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(count):
+            collector.task_start(f'active{i}', TEXT, 1)
+        per_task = (tracemalloc.get_traced_memory()[0] - base) / count
+    finally:
+        tracemalloc.stop()
+
+    assert collector.get_stats()['active_tasks'] == count
+    bench.record('metrics_bytes_per_active_task', per_task, 'B')
+    bench.check('metrics_bytes_per_active_task')
+
+
+def test_metrics_get_stats_cost(bench):
+    """100万タスク記録後の get_stats / 記録のコスト"""
+    collector = MetricsCollector()
+
+    # 5回に分けて記録し、他プロセスの影響を受けにくい最小値で比較する
+    chunk = TASK_COUNT // 5
+    chunks = []
+    for n in range(5):
+        start = time.perf_counter()
+        _run_tasks(collector, chunk, prefix=f't{n}-')
+        chunks.append((time.perf_counter() - start) / chunk * 1e6)
+    record_us = min(chunks)
+
+    # 実行中タスクが残っている状態で計測
+    for i in range(1000):
+        collector.task_start(f'running{i}', TEXT, 1)
+
+    # 他スレッドの影響を避けるため5回計測した最小値
+    iterations = 1000
+    batches = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            stats = collector.get_stats()
+        batches.append((time.perf_counter() - start) / iterations * 1e6)
+    stats_us = min(batches)
+
+    assert stats['active_tasks'] == 1000
+    assert stats['tasks_last_hour'] == TASK_COUNT
+
+    bench.record('metrics_record_us_per_task', record_us, 'us')
+    bench.record('metrics_get_stats_us', stats_us, 'us')
+    bench.check('metrics_record_us_per_task', 'metrics_get_stats_us')
+
+
+def test_metrics_stale_tasks_expire():
+    """完了が記録されないタスクは期限切れで LOST として計上される"""
+    collector = MetricsCollector(stale_after=60, max_active=100)
+    collector.task_start('crashed', TEXT, 1)
+    collector._tasks['crashed'].start_time -= 120
+
+    stats = collector.get_stats()
+    assert stats['active_tasks'] == 0
+    assert stats['counters']['tasks_lost'] == 1
+
+    # 上限を超えた分は古い順に破棄
+    for i in range(150):
+        collector.task_start(f'burst{i}', TEXT, 1)
+    stats = collector.get_stats()
+    assert stats['active_tasks'] == 100
+    assert stats['counters']['tasks_lost'] == 51
@@ -0,0 +1,97 @@
+"""
+Phrase template benchmarks
+ナビゲーターの定型文をフレーズテンプレートで合成した場合のVOICEVOX負荷の計測
+"""
+import io
+import random
+import time
+import uuid
+import wave
+
+from conftest import percentile
+from phrase_templates import PhraseSynthesizer
+from text_normalizer import normalize_text
+from voice_navigator import VoiceNavigator
+from voicevox_client import VoicevoxClient
+
+NARRATIONS = 300
+
+
+def _narrations(count: int, seed: int = 0):
+    """describe_task_event と同じ定型文 (開始・完了・まとめ読み上げ)"""
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        kind = i % 3
+        if kind == 0:
+            event = {'type': 'task-started', 'uuid': task_id}
+        elif kind == 1:
+            event = {
+                'type': 'task-succeeded',
+                'uuid': task_id,
+                'result': {'success': True, 'file_size': rng.randint(20, 400) * 1024}
+            }
+        else:
+            texts.append(normalize_text(f"{rng.randint(2, 40)}件のタスクが完了しました"))
+            continue
+        # describe_task_event はインスタンス状態を使わない
+        texts.append(normalize_text(VoiceNavigator.describe_task_event(None, event)))
+    return texts
+
+
+def _synthesis_requests(engine) -> int:
+    return engine.requests['/synthesis']
+
+
+def test_phrase_template_voicevox_load(bench, stub_engine):
+    """定型文1件あたりの synthesis 呼び出し回数と合成時間"""
+    client = VoicevoxClient(stub_engine.url)
+    synthesizer = PhraseSynthesizer(client)
+    texts = _narrations(NARRATIONS)
+
+    # 通常合成 (1件 = audio_query + synthesis)
+    before = _synthesis_requests(stub_engine)
+    direct_ms = []
+    for text in texts[:30]:
+        start = time.perf_counter()
+        client.tts(text, 1)
+        direct_ms.append((time.perf_counter() - start) * 1000)
+    direct_requests = (_synthesis_requests(stub_engine) - before) / 30
+
+    # テンプレート合成 (1巡目: 事前合成・断片キャッシュの構築を含む)
+    before = _synthesis_requests(stub_engine)
+    synthesizer.warmup(1)
+    for text in texts:
+        assert synthesizer.render(text, 1) is not None, text
+    cold_requests = (_synthesis_requests(stub_engine) - before) / NARRATIONS
+
+    # 2巡目: 別のタスクID・数値 (キャッシュ構築後の定常状態)
+    before = _synthesis_requests(stub_engine)
+    template_ms = []
+    for text in _narrations(NARRATIONS, seed=1):
+        start = time.perf_counter()
+        wav_bytes = synthesizer.render(text, 1)
+        template_ms.append((time.perf_counter() - start) * 1000)
+        assert wav_bytes is not None, text
+    template_requests = (_synthesis_requests(stub_engine) - before) / NARRATIONS
+
+    with wave.open(io.BytesIO(wav_bytes)) as w:
+        assert w.getnframes() > w.getframerate() * 0.2
+
+    stats = synthesizer.get_stats()
+    assert stats['fallbacks'] == 0
+    assert template_requests * 10 <= direct_requests, (template_requests, direct_requests)
+
+    bench.record('phrase_synth_requests_per_narration_cold', cold_requests, 'req')
+    bench.record('phrase_synth_requests_per_narration', template_requests, 'req')
+    bench.record('phrase_render_p50_ms', percentile(template_ms, 0.5), 'ms')
+    bench.record('phrase_direct_tts_p50_ms', percentile(direct_ms, 0.5), 'ms')
+    bench.check('phrase_synth_requests_per_narration', 'phrase_render_p50_ms')
+
+
+def test_phrase_template_fallback(stub_engine):
+    """テンプレートに一致しない文は None (通常合成)"""
+    synthesizer = PhraseSynthesizer(VoicevoxClient(stub_engine.url))
+    assert synthesizer.render('エージェント監視、開始します', 1) is None
+    assert synthesizer.get_stats()['fallbacks'] == 1
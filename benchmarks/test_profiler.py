@@ -0,0 +1,117 @@
+"""
+Profiler benchmarks
+オンデマンド・サンプリングプロファイラの無効時/有効時のコストと出力の確認
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+from profiler import SamplingProfiler, get_profiler, install_signal_handler, signal_process
+
+RESULT_TIMEOUT = 30
+ADMIN_TOKEN = 'bench-token'
+
+
+def _text(i: int) -> str:
+    return f"プロファイル{i}番目のナレーションです。"
+
+
+def _wait_output(profiler, previous, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while profiler.active or profiler.last_output is previous:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return profiler.last_output
+
+
+def test_profiler_overhead(bench):
+    """無効時のタスクごとのコストと、有効時の1サンプルあたりのコスト"""
+    profiler = SamplingProfiler('bench')
+
+    calls = 100000
+    durations = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(calls):
+            profiler.task_finished()
+        durations.append((time.perf_counter() - start) / calls * 1e9)
+
+    # 待機中のスレッド (ワーカープールの空きスレッド相当) を並べて1サンプルのコストを計測
+    stop = threading.Event()
+    threads = [threading.Thread(target=stop.wait) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    try:
+        sample_durations = []
+        for _ in range(200):
+            start = time.perf_counter()
+            profiler._sample(threading.get_ident(), Counter())
+            sample_durations.append((time.perf_counter() - start) * 1e6)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    bench.record('profiler_disabled_ns_per_task', min(durations), 'ns')
+    bench.record('profiler_sample_us', min(sample_durations), 'us')
+    bench.check('profiler_disabled_ns_per_task', 'profiler_sample_us')
+
+
+def test_profile_api_requests(api_client, celery_stack, monkeypatch):
+    """POST /admin/profile で次のNリクエストをプロファイル"""
+    import api_server
+
+    assert api_client.post('/admin/profile', json={}).status_code == 404  # ADMIN_TOKEN 未設定
+    monkeypatch.setattr(api_server, 'ADMIN_TOKEN', ADMIN_TOKEN)
+    assert api_client.post('/admin/profile', json={}, headers={'X-Admin-Token': 'x'}).status_code == 403
+
+    profiler = get_profiler()
+    previous = profiler.last_output
+    response = api_client.post(
+        '/admin/profile', json={'target': 'api', 'seconds': 30, 'tasks': 50},
+        headers={'X-Admin-Token': ADMIN_TOKEN}
+    )
+    assert response.status_code == 202, response.get_json()
+    for i in range(50):
+        api_client.post('/tts', json={'text': _text(i), 'speaker': 1})
+
+    output = _wait_output(profiler, previous)
+    with open(output['collapsed'], encoding='utf-8') as f:
+        collapsed = f.read()
+    assert 'create_tts_task (api_server.py' in collapsed
+
+    status = api_client.get('/admin/profile', headers={'X-Admin-Token': ADMIN_TOKEN}).get_json()
+    assert os.path.basename(output['table']) in status['files']
+
+
+def test_profile_worker_tasks(celery_stack):
+    """制御コマンドで次のNタスクをプロファイル (threadsプールは同一プロセス)"""
+    from celery.result import AsyncResult
+
+    profiler = get_profiler()
+    previous = profiler.last_output
+    replies = celery_stack.control.broadcast(
+        'voicebox_profile', arguments={'seconds': 30, 'tasks': 20}, reply=True, timeout=1.0
+    )
+    assert replies and all('ok' in reply for r in replies for reply in r.values()), replies
+
+    task_ids = [celery_stack.send_task('voicebox.tts', args=[_text(i), 1]).id for i in range(20)]
+    for task_id in task_ids:
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+
+    output = _wait_output(profiler, previous)
+    with open(output['table'], encoding='utf-8') as f:
+        table = f.read()
+    assert 'tts_task (celery_worker.py' in table
+    assert 'synthesize_wav (celery_worker.py' in table
+
+
+def test_profile_signal():
+    """シグナル (パラメータファイル付き) でプロファイリング開始"""
+    install_signal_handler()
+    profiler = get_profiler()
+    previous = profiler.last_output
+    signal_process(os.getpid(), seconds=0.2)
+    output = _wait_output(profiler, previous)
+    assert os.path.exists(output['collapsed'])
@@ -0,0 +1,38 @@
+"""
+Result serializer tests
+圧縮シリアライザーの往復と、切り替え前の JSON の結果の読み込み
+"""
+import json
+
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+from serializers import CONTENT_TYPE, SERIALIZER_NAME, loads, register_compact_serializer
+
+RESULT = {
+    'status': 'SUCCESS',
+    'result': {'success': True, 'audio_path': '/tmp/ab/cd/音声.wav', 'speaker': 1, 'file_size': 1234},
+    'traceback': None,
+    'children': [],
+    'date_done': '2026-01-01T00:00:00',
+    'task_id': 'a3c1d0a6-0000-4000-8000-000000000000',
+}
+
+
+def test_compact_round_trip():
+    register_compact_serializer()
+    content_type, encoding, payload = kombu_dumps(RESULT, serializer=SERIALIZER_NAME)
+    assert content_type == CONTENT_TYPE
+    assert len(payload) < len(json.dumps(RESULT).encode())
+    assert kombu_loads(payload, content_type, encoding) == RESULT
+
+
+def test_legacy_json_result():
+    """RESULT_SERIALIZER=json で保存された結果を voicebox-compact のバックエンドで読めること"""
+    register_compact_serializer()
+    _, _, payload = kombu_dumps(RESULT, serializer='json')
+    assert loads(payload) == RESULT
+    assert loads(payload.encode() if isinstance(payload, str) else payload) == RESULT
+    assert kombu_loads(payload, CONTENT_TYPE, 'binary') == RESULT
+    for legacy in ('[1, 2]', '"done"', 'null', ' {"a": 1}'):
+        assert loads(legacy) == json.loads(legacy)
+        assert loads(legacy.encode()) == json.loads(legacy)
@@ -0,0 +1,111 @@
+"""
+Retention manager tests
+複数プロセスで共有するインデックスに対する保持ポリシーと、シャーディング導入前のファイルの取り込み
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from retention import RESULT_KEY_PREFIX, RetentionManager
+from serializers import dumps as compact_dumps
+from storage import AudioStorage
+
+WAV = b'RIFF' + b'\0' * 1020
+
+
+def test_retention_shared_across_processes(tmp_path):
+    """ワーカーごとに別のマネージャー (別接続) でも全体のファイル数・容量が上限を超えないこと"""
+    index_path = str(tmp_path / 'index.sqlite3')
+    managers = [
+        RetentionManager(
+            storage=AudioStorage(root=str(tmp_path), storage_format='wav', index_path=index_path),
+            max_bytes=40 * len(WAV), max_age_seconds=0, max_files=30
+        )
+        for _ in range(4)
+    ]
+    for manager in managers:
+        manager.load()
+
+    def worker(index, manager):
+        for i in range(50):
+            manager.track(manager.storage.save(f'w{index}-{i}', WAV))
+
+    threads = [threading.Thread(target=worker, args=item) for item in enumerate(managers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = managers[0].get_stats()
+    assert stats['files'] == 30 and stats['total_bytes'] == 30 * len(WAV)
+    assert sum(manager.files_evicted for manager in managers) == 4 * 50 - 30
+    assert len([f for _, _, files in os.walk(tmp_path) for f in files if f.startswith('task_')]) == 30
+
+
+def test_retention_imports_legacy_files(tmp_path):
+    """OUTPUT_DIR 直下の旧形式のファイルが取り込まれ、古い順に削除されること"""
+    for i in range(3):
+        path = tmp_path / f'task_legacy{i}.wav'
+        path.write_bytes(WAV)
+        os.utime(path, (1000 + i, 1000 + i))
+    (tmp_path / 'notes.txt').write_text('not audio')
+
+    storage = AudioStorage(root=str(tmp_path), storage_format='wav', index_path=str(tmp_path / 'index.sqlite3'))
+    manager = RetentionManager(storage=storage, max_bytes=0, max_age_seconds=0, max_files=2)
+    assert manager.load() == 3
+    assert manager.load() == 0
+    assert storage.lookup('legacy0', touch=False).created == 1000
+
+    manager.track(storage.save('new', WAV))
+    assert manager.files_evicted == 2
+    assert not (tmp_path / 'task_legacy0.wav').exists() and not (tmp_path / 'task_legacy1.wav').exists()
+    assert (tmp_path / 'task_legacy2.wav').exists()
+    assert manager.get_stats()['files'] == 2
+
+
+def test_retention_counts_linked_audio_once(tmp_path):
+    """single-flight のハードリンクは合計サイズに1回だけ数え、最後のリンクを消したときに減ること"""
+    storage = AudioStorage(root=str(tmp_path), storage_format='wav', index_path=str(tmp_path / 'index.sqlite3'))
+    storage.save('leader', WAV)
+    for i in range(3):
+        storage.link(f'follower{i}', 'leader')
+    assert storage.stats() == {'files': 4, 'total_bytes': len(WAV)}
+
+    manager = RetentionManager(storage=storage, max_bytes=len(WAV), max_age_seconds=0, max_files=0)
+    manager.track(storage.save('other', WAV))
+    # リンクが残っている間は容量が減らないため、リーダーとフォロワーがすべて削除される
+    assert manager.files_evicted == 4
+    assert storage.stats() == {'files': 1, 'total_bytes': len(WAV)}
+    assert storage.lookup('other') is not None
+
+
+def test_retention_result_keys(tmp_path, redis_client):
+    """結果キーは削除した音声のタスクと保持期間を過ぎたタスクの分だけ消し、実行中・完了直後の結果は残すこと"""
+    now = datetime.now(timezone.utc)
+
+    def meta(status, done):
+        return {'status': status, 'result': None, 'task_id': 'x',
+                'date_done': done.replace(tzinfo=None).isoformat() if done else None}
+
+    results = {
+        'old-json': json.dumps(meta('SUCCESS', now - timedelta(days=8))),
+        'old-compact': compact_dumps(meta('SUCCESS', now - timedelta(days=8))),
+        'recent': json.dumps(meta('SUCCESS', now - timedelta(seconds=5))),
+        'running': json.dumps(meta('STARTED', None)),
+        'unreadable': b'\xff\x00',
+        'evicted': json.dumps(meta('SUCCESS', now)),
+        'kept': json.dumps(meta('SUCCESS', now)),
+    }
+    for task_id, value in results.items():
+        redis_client.set(f'{RESULT_KEY_PREFIX}{task_id}', value)
+
+    storage = AudioStorage(root=str(tmp_path), storage_format='wav', index_path=str(tmp_path / 'index.sqlite3'))
+    manager = RetentionManager(storage=storage, redis_client=redis_client, max_bytes=0, max_files=1)
+    manager.track(storage.save('evicted', WAV))
+    manager.track(storage.save('kept', WAV))
+    assert not redis_client.exists(f'{RESULT_KEY_PREFIX}evicted')
+
+    assert manager.expire_results() == 2
+    remaining = sorted(key.decode()[len(RESULT_KEY_PREFIX):] for key in redis_client.keys(f'{RESULT_KEY_PREFIX}*'))
+    assert remaining == ['kept', 'recent', 'running', 'unreadable']
@@ -0,0 +1,118 @@
+"""
+Single-flight benchmarks
+同一テキストの同時リクエストをまとめた場合のVOICEVOX負荷の計測
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+RESULT_TIMEOUT = 30
+BURST = 24
+
+
+def test_single_flight_burst(bench, stub_engine, celery_stack):
+    """同じテキストを同時に投入した場合の synthesis 呼び出し回数"""
+    from celery.result import AsyncResult
+
+    text = 'エージェント監視、開始します。シングルフライトの計測です。'
+    before = stub_engine.requests['/synthesis']
+    task_ids = [
+        celery_stack.send_task('voicebox.tts', args=[text, 1]).id
+        for _ in range(BURST)
+    ]
+    results = [
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+        for task_id in task_ids
+    ]
+    syntheses = stub_engine.requests['/synthesis'] - before
+
+    # 全タスクが自分のタスクIDで音声を参照できる
+    assert all(result['success'] for result in results)
+    assert len({result['audio_path'] for result in results}) == BURST
+    assert all(os.path.exists(result['audio_path']) for result in results)
+
+    bench.record('single_flight_synth_per_burst', syntheses, 'req')
+    assert syntheses < BURST / 2, syntheses
+    bench.check('single_flight_synth_per_burst')
+
+
+def test_single_flight_leader_failure(shared_redis):
+    """リーダーの失敗時は待機中のフォロワーが引き継ぐ"""
+    flight = SingleFlight(shared_redis, wait_seconds=5)
+    started = threading.Event()
+    calls = []
+
+    def failing_leader():
+        started.set()
+        time.sleep(0.05)
+        raise RuntimeError('synthesis failed')
+
+    def follower_fn():
+        calls.append('follower')
+        return {'task_id': 'follower'}
+
+    outcome = {}
+
+    def follower():
+        started.wait()
+        outcome['result'] = flight.run('key', follower_fn)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        flight.run('key', failing_leader)
+    thread.join(5)
+
+    assert outcome['result'] == ({'task_id': 'follower'}, True)
+    assert calls == ['follower']
+    assert flight.get_stats()['takeovers'] == 1
+
+
+def test_single_flight_lease_expiry(redis_client):
+    """リーダーがクラッシュ (リースを延長しないまま消失) した場合はリース期限切れで引き継ぐ"""
+    client = redis_client
+    flight = SingleFlight(client, lease_seconds=0.3, wait_seconds=5, namespace='bench')
+    key = f'lease-expiry-{time.time()}'
+
+    # クラッシュしたリーダーのリースを再現
+    client.set(f'{flight.prefix}lease:{key}', 'crashed', px=300)
+
+    start = time.monotonic()
+    result, leader = flight.run(key, lambda: {'task_id': 'takeover'})
+    assert leader and result == {'task_id': 'takeover'}
+    assert 0.2 < time.monotonic() - start < 2
+    assert flight.get_stats()['takeovers'] == 1
+
+
+def test_single_flight_lease_extended(redis_client):
+    """リース期間より長い合成でもハートビートで延長され、フォロワーは引き継がずに結果を待つ"""
+    flight = SingleFlight(redis_client, lease_seconds=0.3, wait_seconds=5, namespace='bench')
+    started = threading.Event()
+    calls = []
+
+    def slow_leader():
+        calls.append('leader')
+        started.set()
+        time.sleep(1.0)
+        return {'task_id': 'leader'}
+
+    outcome = {}
+
+    def follower():
+        started.wait()
+        outcome['result'] = flight.run('slow', lambda: calls.append('follower') or {'task_id': 'follower'})
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    assert flight.run('slow', slow_leader) == ({'task_id': 'leader'}, True)
+    thread.join(5)
+
+    assert outcome['result'] == ({'task_id': 'leader'}, False)
+    assert calls == ['leader'] and flight.get_stats()['takeovers'] == 0
+    # リースは解放され、結果だけが残る
+    assert not redis_client.exists(f'{flight.prefix}lease:slow')
+    assert redis_client.exists(f'{flight.prefix}result:slow')
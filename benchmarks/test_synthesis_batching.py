@@ -0,0 +1,148 @@
+"""
+Synthesis micro-batching benchmarks
+短いテキストが高レートで届く場合の synthesis 単発と multi_synthesis まとめ送りのスループット
+"""
+import threading
+import time
+
+from celery.result import AsyncResult
+
+from conftest import percentile
+from stub_voicevox import StubVoicevoxEngine
+from synthesis_batcher import SynthesisBatcher
+from voicevox_client import VoicevoxClient, VoicevoxError
+
+RESULT_TIMEOUT = 30
+THREADS = 16
+REQUESTS_PER_THREAD = 12
+SHORT_TEXTS = ['了解。', 'はい。', '完了です。', '次へ。', 'OK。', '開始。']
+
+
+def _run(synthesize, queries):
+    """THREADS 本のスレッドから同時に合成し、(スループット, レイテンシ[ms], WAV) を返す"""
+    latencies, wavs = [], {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS + 1)
+
+    def worker(index):
+        barrier.wait()
+        for i in range(REQUESTS_PER_THREAD):
+            key = (index * REQUESTS_PER_THREAD + i) % len(queries)
+            start = time.perf_counter()
+            wav = synthesize(queries[key])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                wavs.setdefault(key, set()).add(wav)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), latencies, wavs
+
+
+def test_synthesis_batching_throughput(bench):
+    """合成を同時1件ずつ処理するエンジンでの、単発送信とまとめ送りのスループット"""
+    engine = StubVoicevoxEngine(latency_ms=20, jitter_ms=0, engine_slots=1).start()
+    client = VoicevoxClient(engine.url, max_idle=THREADS)
+    try:
+        queries = [client.audio_query(text, 1) for text in SHORT_TEXTS]
+        batcher = SynthesisBatcher(client.synthesis, client.multi_synthesis, window_ms=10, max_batch=8)
+
+        single_rate, single_latencies, single_wavs = _run(lambda q: client.synthesis(q, 1), queries)
+        batched_rate, batched_latencies, batched_wavs = _run(lambda q: batcher.synthesize(q, 1)[0], queries)
+        stats = batcher.get_stats()
+    finally:
+        client.close()
+        engine.stop()
+
+    # まとめ送りでも各タスクに自分のクエリのWAVが返る
+    assert all(len(wavs) == 1 for wavs in batched_wavs.values())
+    assert batched_wavs == single_wavs
+    assert engine.requests['/multi_synthesis'] == stats['batches'] > 0
+    print(f"\nsingle:  {single_rate:.0f} syntheses/s, p95 {percentile(single_latencies, 0.95):.0f} ms"
+          f"\nbatched: {batched_rate:.0f} syntheses/s, p95 {percentile(batched_latencies, 0.95):.0f} ms "
+          f"(mean batch {stats['mean_batch_size']:.1f})")
+
+    bench.record('synthesis_single_per_s', single_rate, 'syntheses/s', higher_is_better=True)
+    bench.record('synthesis_batched_per_s', batched_rate, 'syntheses/s', higher_is_better=True)
+    bench.record('synthesis_batched_p95_ms', percentile(batched_latencies, 0.95), 'ms')
+
+    assert batched_rate > single_rate * 1.5
+    bench.check('synthesis_batched_per_s')
+
+
+def test_synthesis_batching_fallback():
+    """multi_synthesis 非対応 (404) のエンジンでは1件ずつ送り、422 はそのバッチだけ1件ずつ送り直す"""
+    calls = []
+
+    def synthesize(query, speaker):
+        if query['bad']:
+            raise VoicevoxError('invalid query', 422)
+        return f"wav{query['id']}".encode()
+
+    def unsupported(queries, speaker):
+        calls.append(len(queries))
+        raise VoicevoxError('not found', 404)
+
+    def invalid(queries, speaker):
+        calls.append(len(queries))
+        raise VoicevoxError('unprocessable', 422)
+
+    def run_concurrently(batcher, queries):
+        results = {}
+
+        def worker(query):
+            try:
+                results[query['id']] = batcher.synthesize(query, 1)[0]
+            except VoicevoxError as e:
+                results[query['id']] = e.status
+
+        threads = [threading.Thread(target=worker, args=(query,)) for query in queries]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    batcher = SynthesisBatcher(synthesize, unsupported, window_ms=50, max_batch=4)
+    queries = [{'id': i, 'bad': False} for i in range(4)]
+    assert run_concurrently(batcher, queries) == {i: f'wav{i}'.encode() for i in range(4)}
+    assert run_concurrently(batcher, queries) == {i: f'wav{i}'.encode() for i in range(4)}
+    assert calls == [4] and not batcher.get_stats()['supported']
+
+    calls.clear()
+    batcher = SynthesisBatcher(synthesize, invalid, window_ms=50, max_batch=3)
+    queries = [{'id': 0, 'bad': False}, {'id': 1, 'bad': True}, {'id': 2, 'bad': False}]
+    assert run_concurrently(batcher, queries) == {0: b'wav0', 1: 422, 2: b'wav2'}
+    assert calls == [3] and batcher.get_stats()['supported']
+
+
+def test_worker_synthesis_batching(api_client, celery_stack, stub_engine, monkeypatch):
+    """ワーカー (threadsプール) の同時タスクが multi_synthesis にまとまり、各タスクが完了すること"""
+    import celery_worker
+
+    client = VoicevoxClient()
+    batcher = SynthesisBatcher(client.synthesis, client.multi_synthesis, window_ms=20, max_batch=8)
+    monkeypatch.setattr(celery_worker, 'synthesis_batcher', batcher)
+
+    before = stub_engine.requests['/multi_synthesis']
+    task_ids = [
+        api_client.post('/tts', json={'text': f'{i}番、{SHORT_TEXTS[i % len(SHORT_TEXTS)]}', 'speaker': 1})
+        .get_json()['task_id']
+        for i in range(32)
+    ]
+    results = [
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+        for task_id in task_ids
+    ]
+    client.close()
+
+    assert all(result['success'] for result in results), results
+    stats = batcher.get_stats()
+    assert stats['batches'] > 0 and stats['batched_items'] + stats['singles'] == len(task_ids)
+    assert stub_engine.requests['/multi_synthesis'] - before == stats['batches']
@@ -0,0 +1,120 @@
+"""
+Tracing benchmarks
+POST /tts → Celery → VOICEVOX のトレース伝搬の確認と、スパン記録のコスト
+"""
+import json
+import logging
+import os
+import time
+
+from celery.result import AsyncResult
+
+import tracing
+from tracing import JsonlSpanExporter, Tracer, summarize
+
+RESULT_TIMEOUT = 30
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_trace_propagation(bench, api_client, celery_stack):
+    """APIとワーカーのスパンが1つのトレースにつながり、ログ行に trace_id が付くこと"""
+    import celery_worker
+
+    capture = _Capture()
+    worker_logger = celery_worker.task_logger.base_logger.logger
+    worker_logger.addHandler(capture)
+    try:
+        task_ids = [
+            api_client.post('/tts', json={'text': f'トレース{i}番目のナレーションです。', 'speaker': 1})
+            .get_json()['task_id']
+            for i in range(20)
+        ]
+        for task_id in task_ids:
+            AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.005)
+    finally:
+        worker_logger.removeHandler(capture)
+
+    path = os.environ['TRACE_EXPORT_PATH']
+    with open(path, encoding='utf-8') as f:
+        spans = [json.loads(line) for line in f]
+
+    traces = {}
+    for span in spans:
+        traces.setdefault(span['trace_id'], {})[span['name']] = span
+    by_task = {
+        trace['POST /tts']['attributes']['task_id']: trace
+        for trace in traces.values() if 'POST /tts' in trace
+    }
+
+    for task_id in task_ids:
+        trace = by_task[task_id]
+        api_span, task_span = trace['POST /tts'], trace['tts_task']
+        assert trace['queue.wait']['parent_id'] == api_span['span_id']
+        assert task_span['parent_id'] == api_span['span_id']
+        for name in ('voicevox.audio_query', 'voicevox.synthesis', 'audio.postprocess'):
+            assert trace[name]['parent_id'] == task_span['span_id']
+        assert trace['storage.save']['parent_id'] == task_span['span_id']
+
+    logged = [json.loads(message) for message in capture.messages]
+    assert logged and all(entry.get('trace_id') in traces for entry in logged)
+
+    summary = summarize(path)['requests']
+    print(f"\nqueue wait p50 {summary['queue_wait']['p50_ms']:.1f} ms, "
+          f"service p50 {summary['service']['p50_ms']:.1f} ms ({summary['count']} requests)")
+    assert summary['count'] >= len(task_ids)
+
+
+def test_tracing_overhead(bench, tmp_path):
+    """スパン1つあたりのコスト (JSONLへの出力込み) と無効時のコスト"""
+    enabled = Tracer(JsonlSpanExporter(str(tmp_path / 'traces.jsonl')), enabled=True, sample_rate=1.0)
+    disabled = Tracer(JsonlSpanExporter(str(tmp_path / 'disabled.jsonl')), enabled=False)
+
+    def per_span(tracer, calls):
+        durations = []
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(calls):
+                with tracer.span('bench', task_id='bench'):
+                    pass
+            durations.append((time.perf_counter() - start) / calls)
+        return min(durations)
+
+    enabled_us = per_span(enabled, 2000) * 1e6
+    disabled_ns = per_span(disabled, 20000) * 1e9
+    assert not os.path.exists(tmp_path / 'disabled.jsonl')
+    # 同じ実行内の比較: 無効時は記録時の 1/10 未満
+    assert disabled_ns < enabled_us * 1000 / 10
+
+    bench.record('trace_span_us', enabled_us, 'us')
+    bench.record('trace_disabled_ns_per_span', disabled_ns, 'ns')
+    bench.check('trace_span_us', 'trace_disabled_ns_per_span')
+
+
+def test_trace_file_rotation(tmp_path, monkeypatch):
+    """上限を超えたトレースファイルがローテーションされ、古いものが残り続けないこと"""
+    monkeypatch.setattr(tracing, '_ROTATE_CHECK_SECONDS', 0)
+    path = str(tmp_path / 'traces.jsonl')
+    # 同じファイルに書く2つのプロセスを想定
+    exporters = [JsonlSpanExporter(path, max_bytes=4096, backup_count=2) for _ in range(2)]
+    tracers = [Tracer(exporter, enabled=True, sample_rate=1.0) for exporter in exporters]
+
+    for i in range(300):
+        with tracers[i % 2].span('bench', task_id=f'task{i}'):
+            pass
+
+    names = sorted(os.listdir(tmp_path))
+    assert names == ['traces.jsonl', 'traces.jsonl.1', 'traces.jsonl.2', 'traces.jsonl.lock']
+    for name in names[:3]:
+        size = os.path.getsize(tmp_path / name)
+        assert 0 < size < 4096 * 2
+        with open(tmp_path / name, encoding='utf-8') as f:
+            assert all(json.loads(line)['name'] == 'bench' for line in f)
+    assert summarize(path)['spans']['bench']['count'] > 0
@@ -0,0 +1,87 @@
+"""
+TTS pipeline benchmarks
+POST /tts → Celery → ワーカー → VOICEVOX (スタブ) の計測
+"""
+import time
+
+from conftest import current_rss_kb, percentile
+
+RESULT_TIMEOUT = 30
+
+
+def _text(i: int) -> str:
+    return f"ベンチマーク{i}番目のナレーションです。処理時間を計測します。"
+
+
+def _wait(app, task_ids):
+    from celery.result import AsyncResult
+
+    for task_id in task_ids:
+        result = AsyncResult(task_id, app=app).get(timeout=RESULT_TIMEOUT, interval=0.005)
+        assert result['success'], result
+
+
+def test_enqueue_latency(bench, api_client, celery_stack):
+    """POST /tts の応答時間 (タスク登録のみ)"""
+    durations = []
+    task_ids = []
+    for i in range(200):
+        start = time.perf_counter()
+        response = api_client.post('/tts', json={'text': _text(i), 'speaker': 1})
+        durations.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 202
+        task_ids.append(response.get_json()['task_id'])
+    _wait(celery_stack, task_ids)
+
+    bench.record('enqueue_latency_p50_ms', percentile(durations, 0.5), 'ms')
+    bench.record('enqueue_latency_p99_ms', percentile(durations, 0.99), 'ms')
+    bench.check('enqueue_latency_p50_ms', 'enqueue_latency_p99_ms')
+
+
+def test_end_to_end_latency(bench, api_client, celery_stack):
+    """登録から結果取得までの時間 (1件ずつ、待ち行列なし)"""
+    from celery.result import AsyncResult
+
+    durations = []
+    for i in range(30):
+        start = time.perf_counter()
+        response = api_client.post('/tts', json={'text': _text(i), 'speaker': 1})
+        task_id = response.get_json()['task_id']
+        AsyncResult(task_id, app=celery_stack).get(timeout=RESULT_TIMEOUT, interval=0.002)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    bench.record('e2e_latency_p50_ms', percentile(durations, 0.5), 'ms')
+    bench.record('e2e_latency_p99_ms', percentile(durations, 0.99), 'ms')
+    bench.check('e2e_latency_p50_ms', 'e2e_latency_p99_ms')
+
+
+def test_throughput(bench, celery_stack):
+    """一括投入したタスクの処理スループット"""
+    count = 200
+    start = time.perf_counter()
+    task_ids = [
+        celery_stack.send_task('voicebox.tts', args=[_text(i), 1]).id
+        for i in range(count)
+    ]
+    _wait(celery_stack, task_ids)
+    elapsed = time.perf_counter() - start
+
+    bench.record('throughput_tasks_per_s', count / elapsed, 'tasks/s', higher_is_better=True)
+    bench.check('throughput_tasks_per_s')
+
+
+def test_rss_growth(bench, celery_stack):
+    """タスク処理によるRSS増加 (ウォームアップ後、1000タスクあたり)"""
+    count = 500
+    _wait(celery_stack, [celery_stack.send_task('voicebox.tts', args=[_text(i), 1]).id for i in range(50)])
+
+    before = current_rss_kb()
+    for offset in range(0, count, 100):
+        _wait(celery_stack, [
+            celery_stack.send_task('voicebox.tts', args=[_text(offset + i), 1]).id
+            for i in range(100)
+        ])
+    growth_kb = max(current_rss_kb() - before, 0)
+
+    bench.record('rss_growth_kb_per_1k_tasks', growth_kb * 1000 / count, 'KB')
+    bench.check('rss_growth_kb_per_1k_tasks')
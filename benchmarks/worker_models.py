@@ -0,0 +1,42 @@
+"""
+Worker execution model helpers for benchmarks
+prefork (処理中1件 = 1プロセス) を再現する子プロセス側の処理
+
+子プロセスから import されるため conftest に依存しない。
+"""
+import os
+
+
+class NoopTask:
+    """update_state を無視するタスク (synthesize_wav 用)"""
+
+    def update_state(self, **kwargs):
+        pass
+
+
+def sync_synthesize(texts) -> int:
+    """preforkワーカーと同じ同期HTTP (urllib) で合成"""
+    import celery_worker
+
+    task = NoopTask()
+    for text in texts:
+        celery_worker.synthesize_wav(task, 'bench', text, 1)
+    return len(texts)
+
+
+def process_memory_kb(pid: int = None) -> int:
+    """プロセスの実メモリ (KB)
+
+    fork で共有しているページを按分した PSS を優先し、取れなければ RSS。
+    """
+    pid = pid or os.getpid()
+    for path, field in ((f'/proc/{pid}/smaps_rollup', 'Pss:'), (f'/proc/{pid}/status', 'VmRSS:')):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return 0
+
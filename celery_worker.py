@@ -3,31 +3,75 @@ Celery Worker for VoiceBox TTS
 音声生成タスクを非同期実行するワーカー
 """
 import json
-import os
 import subprocess
+import threading
 import time
 import urllib.parse
 import urllib.request
+from contextlib import nullcontext
 from celery import Celery
+from celery.signals import worker_process_init
+from celery.worker.control import control_command, ok, nok
+from kombu import Queue
 from config import (
     CELERY_BROKER_URL,
     CELERY_RESULT_BACKEND,
     VOICEVOX_API_URL,
     DEFAULT_SPEAKER,
-    OUTPUT_DIR,
     AUTO_PLAY,
     AUTO_PLAY_COMMAND,
-    SPEED_SCALE
+    SPEED_SCALE,
+    RESULT_SERIALIZER,
+    RESULT_INCLUDE_TEXT,
+    RESULT_EXTENDED,
+    WORKER_EXECUTION_MODE,
+    ASYNC_TASK_TIME_LIMIT,
+    ASYNC_WORKER_CONCURRENCY,
+    TTS_LANES,
+    TTS_SHORT_QUEUE,
+    TTS_LONG_QUEUE,
+    PROFILE_SECONDS
 )
 
 # Import monitoring modules
 from logger import get_task_logger
 from metrics import get_metrics_collector, get_performance_monitor
+from storage import StoredAudio, get_audio_storage
+from audio_postprocess import get_audio_postprocessor
+from single_flight import get_single_flight
+from async_runtime import get_async_runtime
+from synthesis_batcher import get_synthesis_batcher
+from cost_model import SHORT_LANE, LONG_LANE, count_morae, get_cost_model
+from dispatcher import DISPATCH_HEADER, get_dispatcher, notify_done
+from profiler import get_profiler, install_signal_handler, signal_process
+from tracing import current_span, get_tracer
+from text_normalizer import text_key
+from retention import get_retention_manager
+from serializers import SERIALIZER_NAME, register_compact_serializer
 
 # Initialize logger and metrics
 task_logger = get_task_logger()
 metrics = get_metrics_collector()
 perf_monitor = get_performance_monitor()
+storage = get_audio_storage()
+postprocessor = get_audio_postprocessor()
+single_flight = get_single_flight()
+async_runtime = get_async_runtime() if WORKER_EXECUTION_MODE == 'async' else None
+synthesis_batcher = get_synthesis_batcher()
+cost_model = get_cost_model()
+dispatcher = get_dispatcher()
+profiler = get_profiler()
+tracer = get_tracer()
+install_signal_handler()
+
+# 自動再生はプロセス内で1件ずつ (threadsプール / 非同期実行モードで再生が重ならないように)
+playback_lock = threading.Lock()
+
+# レーン → キュー (TTS_LANES=false の場合は既定キュー)
+LANE_QUEUES = {SHORT_LANE: TTS_SHORT_QUEUE, LONG_LANE: TTS_LONG_QUEUE} if TTS_LANES else {}
+
+# Compact result serializer (msgpack + zstd/zlib)
+register_compact_serializer()
 
 # Celery app initialization
 app = Celery(
@@ -39,7 +83,8 @@ app = Celery(
 app.conf.update(
     task_serializer='json',
     accept_content=['json'],
-    result_serializer='json',
+    result_serializer=RESULT_SERIALIZER,
+    result_accept_content=['json', SERIALIZER_NAME],
     timezone='Asia/Tokyo',
     enable_utc=True,
     # Task settings
@@ -48,26 +93,145 @@ app.conf.update(
     task_soft_time_limit=100,  # 100秒 (短縮)
     # Result backend settings (メモリ節約)
     result_expires=3600,  # 1時間後に結果を削除
-    result_extended=True,
+    result_extended=RESULT_EXTENDED,  # args/kwargs(入力テキスト)の二重保存を避ける
 )
 
+# short/long レーン: -Q 未指定のワーカーは全キューを処理し、
+# -Q tts.short で短いタスク専用のワーカーを起動できる
+if TTS_LANES:
+    app.conf.task_queues = (
+        Queue(app.conf.task_default_queue),
+        Queue(TTS_SHORT_QUEUE),
+        Queue(TTS_LONG_QUEUE),
+    )
+
+# 非同期実行モード: 1プロセスの threads プールで多数のタスクを同時に処理
+# (CLIの --pool / --concurrency 指定が優先)
+if async_runtime is not None:
+    app.conf.update(
+        worker_pool='threads',
+        worker_concurrency=ASYNC_WORKER_CONCURRENCY,
+    )
+
+
+def record_cost(text: str, speaker: int, query: dict, synthesis_ms: float, cost_ms: float = None):
+    """合成の実測値でコストモデルを更新し、見積もり精度を記録"""
+    if cost_ms is None:
+        cost_ms = cost_model.estimate(text, speaker)
+    cost_model.observe(text, speaker, count_morae(query), synthesis_ms)
+    cost_model.record_accuracy(cost_ms, synthesis_ms)
+
+
+def synthesize_wav(task, task_id: str, text: str, speaker: int, cost_ms: float = None) -> bytes:
+    """VOICEVOX API (audio_query + synthesis) で音声を生成し、後処理したWAVを返す
+
+    cost_ms: 投入時の見積もり (見積もり精度の記録用、省略時はここで見積もる)
+    """
+    # Update task status
+    task_logger.log_task_progress(task_id, 'Querying audio parameters')
+    task.update_state(state='PROGRESS', meta={'status': 'Querying audio parameters'})
+
+    # audio_query API call
+    start = time.perf_counter()
+    with tracer.span('voicevox.audio_query', speaker=speaker, text_length=len(text)):
+        if async_runtime is not None:
+            query = async_runtime.run(async_runtime.voicevox.audio_query(text, speaker), timeout=10)
+        else:
+            query_url = f'{VOICEVOX_API_URL}/audio_query?speaker={speaker}&text=' + urllib.parse.quote(text)
+            query_req = urllib.request.Request(query_url, method='POST')
+
+            with urllib.request.urlopen(query_req, timeout=10) as r:  # 短縮: 30秒→10秒
+                query = json.load(r)
+    synthesis_ms = (time.perf_counter() - start) * 1000
+
+    # Set speed scale for faster speech
+    query['speedScale'] = SPEED_SCALE
+
+    # Update task status
+    task_logger.log_task_progress(task_id, 'Synthesizing audio')
+    task.update_state(state='PROGRESS', meta={'status': 'Synthesizing audio'})
+
+    # synthesis API call
+    start = time.perf_counter()
+    with tracer.span('voicevox.synthesis', speaker=speaker) as span:
+        if synthesis_batcher is not None:
+            # 同一話者の同時リクエストと multi_synthesis 1回にまとめる
+            wav_bytes, batch_size = synthesis_batcher.synthesize(query, speaker)
+            if batch_size > 1:
+                metrics.increment('syntheses_batched')
+            if span is not None:
+                span.set(batch_size=batch_size)
+        elif async_runtime is not None:
+            wav_bytes = async_runtime.run(async_runtime.voicevox.synthesis(query, speaker), timeout=20)
+        else:
+            synth_url = f'{VOICEVOX_API_URL}/synthesis?speaker={speaker}'
+            synth_req = urllib.request.Request(
+                synth_url,
+                data=json.dumps(query).encode(),
+                headers={'Content-Type': 'application/json'},
+                method='POST'
+            )
+
+            with urllib.request.urlopen(synth_req, timeout=20) as r:  # 短縮: 60秒→20秒
+                wav_bytes = r.read()
+        if span is not None:
+            span.set(wav_bytes=len(wav_bytes))
+    synthesis_ms += (time.perf_counter() - start) * 1000
+
+    # Cost model (モーラ数・合成時間の観測)
+    record_cost(text, speaker, query, synthesis_ms, cost_ms)
+
+    # Post-process (無音トリム・音量正規化・話速変更)
+    with tracer.span('audio.postprocess'):
+        return postprocessor.process(wav_bytes)
+
+
+def synthesize_and_store(task, task_id: str, text: str, speaker: int, cost_ms: float = None) -> StoredAudio:
+    """音声を生成して保存 (同一テキストの同時合成はシングルフライトで1回にまとめる)"""
+    def lead() -> dict:
+        # Encode & save (sharded directory + index)
+        wav_bytes = synthesize_wav(task, task_id, text, speaker, cost_ms)
+        with tracer.span('storage.save'):
+            return storage.save(task_id, wav_bytes).to_dict()
+
+    if single_flight is None:
+        return StoredAudio(**lead())
+
+    shared, leader = single_flight.run(text_key(text, speaker), lead)
+    if leader:
+        return StoredAudio(**shared)
+
+    # フォロワー: リーダーの音声を自分のタスクIDでも参照できるよう登録
+    stored = storage.link(task_id, shared['task_id'])
+    if stored is None:
+        # リーダーの音声が保持ポリシーで削除済み → 自分で合成
+        return StoredAudio(**lead())
+
+    metrics.increment('syntheses_collapsed')
+    task_logger.log_task_progress(task_id, f"Reused audio from {shared['task_id']}")
+    return stored
+
 
 @app.task(bind=True, name='voicebox.tts', acks_late=True)
-def tts_task(self, text: str, speaker: int = None):
+def tts_task(self, text: str, speaker: int = None, cost_ms: float = None, lane: str = None):
     """
     VOICEVOX APIで音声生成を行うタスク
 
     Args:
         text: 読み上げテキスト
         speaker: 話者ID (デフォルト: DEFAULT_SPEAKER)
+        cost_ms: 投入時の合成コストの見積もり (POST /tts が設定)
+        lane: 投入時のレーン (short | long)
 
     Returns:
         dict: {
             'success': bool,
             'audio_path': str,
+            'audio_format': str,  # wav | flac | opus
             'speaker': int,
-            'text': str,
-            'duration': float  # seconds
+            'file_size': int,
+            'task_id': str,
+            'text': str  # RESULT_INCLUDE_TEXT=true の場合のみ
         }
     """
     if speaker is None:
@@ -75,94 +239,122 @@ def tts_task(self, text: str, speaker: int = None):
 
     task_id = self.request.id
 
-    # Log task start
-    task_logger.log_task_start(task_id, text, speaker)
-    metrics.task_start(task_id, text, speaker)
-
-    self.update_state(state='PROGRESS', meta={'status': 'Initializing'})
+    # キュー待ち (POST /tts での投入 → 着手) とタスク本体のスパン (APIのスパンの子)
+    traceparent = self.request.get('traceparent')
+    enqueued_at = self.request.get('enqueued_at')
+    if enqueued_at is not None:
+        tracer.record('queue.wait', float(enqueued_at), time.time(), traceparent, task_id=task_id, lane=lane)
 
-    try:
-        # Update task status
-        task_logger.log_task_progress(task_id, 'Querying audio parameters')
-        self.update_state(state='PROGRESS', meta={'status': 'Querying audio parameters'})
+    with tracer.span('tts_task', traceparent, task_id=task_id, speaker=speaker, lane=lane, cost_ms=cost_ms):
+        # ETA用のバックログから着手したタスクを除く
+        if cost_ms is not None and lane is not None:
+            cost_model.dequeue(task_id)
 
-        # audio_query API call
-        query_url = f'{VOICEVOX_API_URL}/audio_query?speaker={speaker}&text=' + urllib.parse.quote(text)
-        query_req = urllib.request.Request(query_url, method='POST')
+        # Log task start
+        task_logger.log_task_start(task_id, text, speaker)
+        metrics.task_start(task_id, text, speaker)
 
-        with urllib.request.urlopen(query_req, timeout=10) as r:  # 短縮: 30秒→10秒
-            query = json.load(r)
+        self.update_state(state='PROGRESS', meta={'status': 'Initializing'})
 
-        # Set speed scale for faster speech
-        query['speedScale'] = SPEED_SCALE
+        try:
+            # threadsプール (非同期実行モード) では task_time_limit が効かないため、VOICEVOX呼び出しに期限を設ける
+            with async_runtime.deadline(ASYNC_TASK_TIME_LIMIT) if async_runtime is not None else nullcontext():
+                stored = synthesize_and_store(self, task_id, text, speaker, cost_ms)
+            output_path = stored.path
+            file_size = stored.size
 
-        # Update task status
-        task_logger.log_task_progress(task_id, 'Synthesizing audio')
-        self.update_state(state='PROGRESS', meta={'status': 'Synthesizing audio'})
-
-        # synthesis API call
-        synth_url = f'{VOICEVOX_API_URL}/synthesis?speaker={speaker}'
-        synth_req = urllib.request.Request(
-            synth_url,
-            data=json.dumps(query).encode(),
-            headers={'Content-Type': 'application/json'},
-            method='POST'
-        )
-
-        output_path = f'{OUTPUT_DIR}/task_{self.request.id}.wav'
-
-        with urllib.request.urlopen(synth_req, timeout=20) as r:  # 短縮: 60秒→20秒
-            with open(output_path, 'wb') as f:
-                f.write(r.read())
-
-        # Get file size
-        file_size = os.path.getsize(output_path)
-
-        # Auto-play audio if enabled
-        if AUTO_PLAY:
+            # Retention policy (古いファイル・結果キーを逐次削除)
             try:
-                subprocess.run(
-                    [AUTO_PLAY_COMMAND, output_path],
-                    check=True,
-                    capture_output=True,
-                    timeout=60
-                )
-                task_logger.log_task_progress(task_id, f'Audio played with {AUTO_PLAY_COMMAND}')
-            except Exception as play_error:
-                task_logger.log_task_failure(task_id, f'Audio playback failed: {play_error}')
-
-        # Log task success
-        metrics.task_complete(task_id, file_size)
-        task_logger.log_task_success(task_id, file_size, 0)
-
-        return {
-            'success': True,
-            'audio_path': output_path,
-            'speaker': speaker,
-            'text': text,
-            'file_size': file_size,
-            'task_id': self.request.id
-        }
+                get_retention_manager().track(stored)
+            except Exception as retention_error:
+                task_logger.log_task_progress(task_id, f'Retention skipped: {retention_error}')
+
+            # Auto-play audio if enabled
+            if AUTO_PLAY:
+                try:
+                    with playback_lock:
+                        subprocess.run(
+                            [AUTO_PLAY_COMMAND, output_path],
+                            check=True,
+                            capture_output=True,
+                            timeout=60
+                        )
+                    task_logger.log_task_progress(task_id, f'Audio played with {AUTO_PLAY_COMMAND}')
+                except Exception as play_error:
+                    task_logger.log_task_failure(task_id, f'Audio playback failed: {play_error}')
+
+            # Log task success
+            metrics.task_complete(task_id, file_size)
+            task_logger.log_task_success(task_id, file_size, 0)
+
+            result = {
+                'success': True,
+                'audio_path': output_path,
+                'audio_format': stored.format,
+                'speaker': speaker,
+                'file_size': file_size,
+                'task_id': self.request.id
+            }
+            if RESULT_INCLUDE_TEXT:
+                result['text'] = text
+            return result
+
+        except Exception as e:
+            error_msg = str(e)
+            span = current_span()
+            if span is not None:
+                span.error = error_msg
+
+            # Log task failure
+            metrics.task_failure(task_id, error_msg)
+            task_logger.log_task_failure(task_id, error_msg)
+            perf_monitor.record_error('TaskError', error_msg, {
+                'task_id': task_id,
+                'speaker': speaker,
+                'text_length': len(text)
+            })
+
+            result = {
+                'success': False,
+                'error': error_msg,
+                'speaker': speaker,
+                'task_id': self.request.id
+            }
+            if RESULT_INCLUDE_TEXT:
+                result['text'] = text
+            return result
+
+        finally:
+            # ディスパッチャ経由のタスクなら枠の空きを通知 (ワーカーの設定ではなくヘッダーで判断)
+            dispatch_namespace = self.request.get(DISPATCH_HEADER)
+            if dispatch_namespace is not None:
+                notify_done(task_id, dispatch_namespace, dispatcher)
+            profiler.task_finished()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """prefork の子プロセスでもシグナルでプロファイリングを開始できるようにする"""
+    install_signal_handler()
+
+
+@control_command(
+    args=[('seconds', float), ('tasks', int)],
+    signature='[seconds] [tasks=0]',
+)
+def voicebox_profile(state, seconds=PROFILE_SECONDS, tasks=0, **kwargs):
+    """サンプリングプロファイラを開始 (seconds 秒間、または次の tasks 件のタスク)
 
-    except Exception as e:
-        error_msg = str(e)
-
-        # Log task failure
-        metrics.task_failure(task_id, error_msg)
-        task_logger.log_task_failure(task_id, error_msg)
-        perf_monitor.record_error('TaskError', error_msg, {
-            'task_id': task_id,
-            'speaker': speaker,
-            'text_length': len(text)
-        })
-
-        return {
-            'success': False,
-            'error': error_msg,
-            'speaker': speaker,
-            'text': text,
-            'task_id': self.request.id
-        }
+    prefork ではタスクは子プロセスで実行されるため、各子プロセスにシグナルで転送する。
+    """
+    processes = state.consumer.pool.info.get('processes')
+    if processes:
+        for pid in processes:
+            signal_process(pid, seconds, tasks)
+        return ok(f'profiling {len(processes)} pool processes')
+    if profiler.start(seconds, tasks):
+        return ok(f'profiling pid {profiler.status()["pid"]}')
+    return nok('profiler is already running')
 
 
 @app.task(name='voicebox.health')
@@ -1,78 +1,78 @@
 #!/bin/bash
 # Claude Code Narration Hook - PostToolUse
 # Narrates Claude responses using VOICEVOX
-
-SAY_SCRIPT="$HOME/.claude/skills/voicebox-narrator/say.sh"
-SPEAKER=${SPEAKER:-1}  # Default: ずんだもん (あまあま)
+#
+# フック入力をそのまま常駐ナレーションデーモン (narration_daemon.py) に転送する。
+# JSON解析・正規化・重複排除・音声合成・再生はデーモン側で行うため、
+# このスクリプトは bash の組み込み機能のみで動作し、プロセスを起動しない。
+# (bash は Unix domain socket を開けないため、デーモンのループバックTCPに書き込む)
+# TCP接続は最初の1行にデーモンが起動時に書き出したトークンを送る。
+# トークンファイルの既定値はデーモン (config.py) と同じく $OUTPUT_DIR/narrator.token。
+
+SPEAKER=${SPEAKER:-1}  # Default: ずんだもん (あまあま) ※デーモン起動時のみ使用
 LOG_FILE="/tmp/claude-narrate.log"
+VOICEBOX_TTS_DIR="${VOICEBOX_TTS_DIR:-$HOME/dev/voicebox-tts}"  # narration_daemon.py の場所
+NARRATOR_TCP_PORT=${NARRATOR_TCP_PORT:-50300}
+OUTPUT_DIR="${OUTPUT_DIR:-$HOME/voicebox}"  # デーモンと同じ既定値
+NARRATOR_TOKEN_FILE="${NARRATOR_TOKEN_FILE:-$OUTPUT_DIR/narrator.token}"
+START_STAMP="/tmp/claude-narrate.start"  # 最後にデーモンの起動を試みた時刻
+START_INTERVAL=10  # デーモンの起動を試みる最小間隔 (秒)
 
 # Logging for debug
 log() {
-    echo "[$(date '+%H:%M:%S')] $1" >> "$LOG_FILE"
+    printf '[%(%H:%M:%S)T] %s\n' -1 "$1" >> "$LOG_FILE"
 }
 
-# Ensure worker is running
-if ! pgrep -f "voicebox-narrator/worker.sh" > /dev/null; then
-    log "Starting voicebox worker..."
-    "$HOME/.claude/skills/voicebox-narrator/worker.sh" > /dev/null 2>&1 &
-    sleep 0.3
-fi
+# Send payload to the narration daemon
+# 戻り値: 0 = 送信済み, 1 = 接続できない (未起動), 2 = 接続できるがトークンファイルがない
+send_to_daemon() {
+    local token
+    if ! read -r token < "$NARRATOR_TOKEN_FILE" 2>/dev/null; then
+        token=""
+    fi
+    # 2>/dev/null は接続失敗のメッセージだけに効かせる (exec に直接付けるとシェル全体に残る)
+    { exec 3<>"/dev/tcp/127.0.0.1/$NARRATOR_TCP_PORT"; } 2>/dev/null || return 1
+    if [ -z "$token" ]; then
+        exec 3>&-
+        return 2
+    fi
+    printf '%s\n%s' "$token" "$INPUT" >&3
+    exec 3>&-
+}
 
 # Read input from stdin (Claude Code hook system)
-INPUT=$(cat)
-
-log "Hook input received"
-
-# Extract message content from JSON
-MESSAGE=$(echo "$INPUT" | python3 -c "
-import sys
-import json
-
-try:
-    data = json.load(sys.stdin)
-
-    # Try different fields for message content
-    content = (
-        data.get('content', '') or
-        data.get('message', '') or
-        data.get('response', '') or
-        data.get('result', '') or
-        ''
-    )
+IFS= read -r -d '' INPUT
 
-    # Handle result object
-    if not content and isinstance(data.get('result'), dict):
-        content = data['result'].get('content', '')
-
-    # Handle output field
-    if not content:
-        content = data.get('output', '')
-
-    print(content)
-except Exception as e:
-    sys.stderr.write(str(e))
-    print('')
-" 2<<< "$INPUT")
-
-# Log for debug
-log "Message length: ${#MESSAGE}"
-
-# Skip if no content or too short
-if [ -z "$MESSAGE" ]; then
-    log "No content to narrate"
+if [ -z "$INPUT" ]; then
     exit 0
 fi
 
-# Clean control characters and truncate
-CLEANED=$(echo "$MESSAGE" | sed 's/[[:cntrl:]]/ /g' | sed 's/  */ /g' | sed 's/^ *//;s/ *$//' | head -c 200)
-
-if [ ${#CLEANED} -lt 10 ]; then
-    log "Message too short: ${#CLEANED} chars"
+send_to_daemon
+case $? in
+    0) exit 0 ;;
+    2)
+        # 起動済みのデーモンが別の場所にトークンを書いている (再起動しても解決しない)
+        log "Narration daemon is running but $NARRATOR_TOKEN_FILE is missing (check OUTPUT_DIR / NARRATOR_TOKEN_FILE)"
+        exit 0
+        ;;
+esac
+
+# Daemon not running: start it (at most once per START_INTERVAL) and retry once
+printf -v now '%(%s)T' -1
+read -r last_start < "$START_STAMP" 2>/dev/null
+[[ $last_start =~ ^[0-9]+$ ]] || last_start=0
+if (( now - last_start < START_INTERVAL )); then
+    log "Narration daemon unavailable (start attempted $((now - last_start))s ago)"
     exit 0
 fi
+printf '%s\n' "$now" > "$START_STAMP"
+
+log "Starting narration daemon..."
+(cd "$VOICEBOX_TTS_DIR" && nohup python3 narration_daemon.py "$SPEAKER" >> "$LOG_FILE" 2>&1 &)
+sleep 0.5
 
-# Send to voicebox for narration
-log "Narrating: ${CLEANED:0:50}..."
-"$SAY_SCRIPT" "$CLEANED" "$SPEAKER" 2>/dev/null &
+if ! send_to_daemon; then
+    log "Narration daemon unavailable"
+fi
 
 exit 0
@@ -11,6 +11,20 @@ DEFAULT_SPEAKER = int(os.getenv("DEFAULT_SPEAKER", "1"))
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 
+# Worker execution mode
+# sync:  preforkプール (処理中1件 = 1プロセス)
+# async: 1プロセスのthreadsプール + イベントループでVOICEVOXへのHTTPを多重化
+WORKER_EXECUTION_MODE = os.getenv("WORKER_EXECUTION_MODE", "sync")
+ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "200"))  # 同時に処理するタスク数
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "64"))  # VOICEVOXへの同時リクエスト上限
+ASYNC_TASK_TIME_LIMIT = float(os.getenv("ASYNC_TASK_TIME_LIMIT", "100"))  # タスク1件のVOICEVOX呼び出し全体の期限 (threadsプールでは task_time_limit が効かない)
+
+# Synthesis micro-batching (同一話者の synthesis を multi_synthesis 1回にまとめる)
+# 1プロセスで複数タスクを同時に処理する場合 (threadsプール / 非同期実行モード) のみ効果がある
+SYNTHESIS_BATCHING = os.getenv("SYNTHESIS_BATCHING", "false").lower() == "true"
+SYNTHESIS_BATCH_WINDOW_MS = float(os.getenv("SYNTHESIS_BATCH_WINDOW_MS", "10"))  # 最初の1件から送信までの最大待ち時間
+SYNTHESIS_BATCH_MAX = int(os.getenv("SYNTHESIS_BATCH_MAX", "8"))  # 1回にまとめる最大件数 (揃ったら即送信)
+
 # Output settings
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", os.path.expanduser("~/voicebox"))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -28,3 +42,113 @@ AUTO_PLAY_COMMAND = os.getenv("AUTO_PLAY_COMMAND", "afplay")  # afplay, ffplay,
 
 # Audio synthesis settings
 SPEED_SCALE = float(os.getenv("SPEED_SCALE", "1.3"))  # 1.0 = normal, 1.3 = faster
+
+# Storage settings
+STORAGE_FORMAT = os.getenv("STORAGE_FORMAT", "wav")  # wav, flac, opus
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", "2"))  # 0 = フラット配置
+STORAGE_INDEX_PATH = os.getenv("STORAGE_INDEX_PATH", os.path.join(OUTPUT_DIR, "index.sqlite3"))
+AUDIO_ENCODER_COMMAND = os.getenv("AUDIO_ENCODER_COMMAND", "ffmpeg")  # flac/opus エンコード用
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "32k")
+
+# Retention settings (0 = 無効)
+RETENTION_MAX_BYTES = int(os.getenv("RETENTION_MAX_BYTES", str(512 * 1024 * 1024)))
+RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "7"))
+RETENTION_MAX_FILES = int(os.getenv("RETENTION_MAX_FILES", "100"))
+RETENTION_UNLINK_BATCH = int(os.getenv("RETENTION_UNLINK_BATCH", "500"))
+
+# Audio post-processing settings (NumPy が必要、なければ無効)
+AUDIO_POSTPROCESS = os.getenv("AUDIO_POSTPROCESS", "false").lower() == "true"  # 既定は無効 (VOICEVOXの出力をそのまま保存)
+AUDIO_TRIM_SILENCE = os.getenv("AUDIO_TRIM_SILENCE", "true").lower() == "true"  # 前後の無音を除去
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", "-50"))  # 無音とみなすレベル (dBFS)
+AUDIO_SILENCE_PAD_MS = float(os.getenv("AUDIO_SILENCE_PAD_MS", "30"))  # トリム後に残す無音
+AUDIO_NORMALIZE_LOUDNESS = os.getenv("AUDIO_NORMALIZE_LOUDNESS", "true").lower() == "true"  # スピーカー間の音量を揃える
+AUDIO_TARGET_DBFS = float(os.getenv("AUDIO_TARGET_DBFS", "-20"))  # 有音部分の目標RMS
+AUDIO_TIME_STRETCH = float(os.getenv("AUDIO_TIME_STRETCH", "1.0"))  # 合成後に話速を変える倍率 (1.0 = 無効)
+
+# Single-flight settings (同一テキストの同時合成をワーカー間でまとめる)
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "10"))  # リーダーのリース (ハートビートで延長)
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "60"))  # フォロワーの最大待機時間
+
+# Cost model / scheduling settings (合成コストの見積もり・レーン・SJF)
+COST_MODEL_DECAY = float(os.getenv("COST_MODEL_DECAY", "0.995"))  # 観測ごとの減衰率 (有効サンプル数 ≈ 1/(1-decay))
+COST_MODEL_REFRESH_SECONDS = float(os.getenv("COST_MODEL_REFRESH_SECONDS", "5"))  # APIがRedisからモデルを読み直す間隔
+COST_PRIOR_BASE_MS = float(os.getenv("COST_PRIOR_BASE_MS", "200"))  # 観測がない間の見積もり (固定分)
+COST_PRIOR_MS_PER_MORA = float(os.getenv("COST_PRIOR_MS_PER_MORA", "40"))  # 観測がない間の見積もり (1モーラあたり)
+ETA_PARALLELISM = int(os.getenv("ETA_PARALLELISM", "1"))  # ETA計算に使う同時合成数
+COST_BACKLOG_TTL_SECONDS = float(os.getenv("COST_BACKLOG_TTL_SECONDS", "600"))  # 着手されないタスクをETA用のバックログから外すまでの時間 (消失・取り消し)
+TTS_LANES = os.getenv("TTS_LANES", "true").lower() == "true"  # 見積もりで short/long キューに振り分け
+COST_SHORT_LANE_MS = float(os.getenv("COST_SHORT_LANE_MS", "2000"))  # これ以下の見積もりを short レーンへ
+TTS_SHORT_QUEUE = os.getenv("TTS_SHORT_QUEUE", "tts.short")
+TTS_LONG_QUEUE = os.getenv("TTS_LONG_QUEUE", "tts.long")
+SJF_SCHEDULING = os.getenv("SJF_SCHEDULING", "false").lower() == "true"  # 見積もりの小さい順にCeleryへ投入
+SJF_AGING_RATE = float(os.getenv("SJF_AGING_RATE", "0.5"))  # 待ち1秒あたりに相殺する見積もりコスト (秒)
+SJF_MAX_INFLIGHT = int(os.getenv("SJF_MAX_INFLIGHT", "4"))  # ディスパッチ済み未完了タスクの上限
+SJF_INFLIGHT_TIMEOUT_SECONDS = float(os.getenv("SJF_INFLIGHT_TIMEOUT_SECONDS", "180"))  # 完了通知のない枠を回収するまでの時間 (ワーカーの強制終了・クラッシュ)
+
+# Client quota / fair queuing settings (POST /tts のクライアント単位の制限と公平なディスパッチ)
+def _mapping(value: str) -> dict:
+    """"名前=値,名前=値" 形式の環境変数を辞書に変換"""
+    return dict(
+        (key.strip(), item.strip()) for key, _, item in
+        (pair.partition('=') for pair in value.split(',')) if key.strip() and item.strip()
+    )
+
+
+API_KEYS = _mapping(os.getenv("API_KEYS", ""))  # "キー=クライアント名,..." (設定時は X-API-Key でクライアントを識別)
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "X-Client-Id")  # API_KEYS 未設定時のクライアント識別ヘッダー
+CLIENT_QUOTA_RATE = float(os.getenv("CLIENT_QUOTA_RATE", "0"))  # クライアントごとのリクエスト/秒 (0 = 無制限)
+CLIENT_QUOTA_BURST = float(os.getenv("CLIENT_QUOTA_BURST", "20"))  # クライアントごとのバースト許容数
+CLIENT_QUOTAS = _mapping(os.getenv("CLIENT_QUOTAS", ""))  # クライアントごとの上書き "名前=rate:burst,..."
+FAIR_QUEUING = os.getenv("FAIR_QUEUING", "false").lower() == "true"  # クライアント間の重み付き公平キュー (DRR) でCeleryへ投入
+FAIR_QUANTUM_MS = float(os.getenv("FAIR_QUANTUM_MS", "1000"))  # 1巡で重み1あたりに割り当てる見積もりコスト
+CLIENT_WEIGHTS = {k: float(v) for k, v in _mapping(os.getenv("CLIENT_WEIGHTS", "")).items()}  # "名前=重み,..." (既定 1)
+
+# Profiling settings (オンデマンドのサンプリングプロファイラ)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # /admin エンドポイントのトークン (空 = 無効)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # collapsed スタック・関数テーブルの出力先
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # サンプリング間隔
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))  # 既定のプロファイリング時間 (シグナル時など)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))  # プロファイリング時間の上限
+PROFILE_SIGNAL = os.getenv("PROFILE_SIGNAL", "SIGUSR2")  # プロファイリングを開始するシグナル (空 = 無効)
+
+# Tracing settings (POST /tts → Celery → VOICEVOX のリクエスト単位のトレース)
+TRACING = os.getenv("TRACING", "false").lower() == "true"  # スパンの記録・ログ行への trace_id 付与 (必要なデプロイで有効化)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "logs/traces.jsonl")  # スパンの出力先 (JSONL)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))  # 記録するトレースの割合 (0.0〜1.0)
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))  # 超えたら .1, .2, ... にローテーション (0 = 無制限)
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "3"))  # 残すローテーション済みファイル数
+
+# Result backend settings
+RESULT_SERIALIZER = os.getenv("RESULT_SERIALIZER", "json")  # json, voicebox-compact (msgpack+zstd/zlib)
+RESULT_INCLUDE_TEXT = os.getenv("RESULT_INCLUDE_TEXT", "false").lower() == "true"  # 結果に入力テキストを含める
+RESULT_EXTENDED = os.getenv("RESULT_EXTENDED", "false").lower() == "true"  # args/kwargsを結果に保存
+
+# Text normalization / dedup settings
+NARRATION_MAX_CHARS = int(os.getenv("NARRATION_MAX_CHARS", "200"))  # 読み上げテキストの最大文字数
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "5"))  # POST /tts の重複排除ウィンドウ (0 = 無効)
+NAVIGATOR_DEDUP_TTL_SECONDS = float(os.getenv("NAVIGATOR_DEDUP_TTL_SECONDS", "30"))
+
+# Voice Navigator settings
+NAVIGATOR_QUEUE_SIZE = int(os.getenv("NAVIGATOR_QUEUE_SIZE", "32"))  # 読み上げ待ちの上限
+NAVIGATOR_SYNTH_WORKERS = int(os.getenv("NAVIGATOR_SYNTH_WORKERS", "2"))  # 音声合成スレッド数
+NAVIGATOR_RATE = float(os.getenv("NAVIGATOR_RATE", "0.5"))  # 読み上げ回数/秒
+NAVIGATOR_BURST = float(os.getenv("NAVIGATOR_BURST", "3"))  # バースト許容数
+NAVIGATOR_COALESCE_SECONDS = float(os.getenv("NAVIGATOR_COALESCE_SECONDS", "2.0"))  # 同種イベントのまとめ時間 (0 = 無効)
+NAVIGATOR_PHRASE_TEMPLATES = os.getenv("NAVIGATOR_PHRASE_TEMPLATES", "true").lower() == "true"  # 定型文を断片の連結で合成
+
+# Phrase template settings
+PHRASE_CROSSFADE_MS = float(os.getenv("PHRASE_CROSSFADE_MS", "8"))  # 断片の境界のクロスフェード長
+PHRASE_CACHE_SIZE = int(os.getenv("PHRASE_CACHE_SIZE", "1024"))  # キャッシュする断片数 (スピーカーごとの固定フレーズ・文字・数詞)
+
+# Narration daemon settings
+NARRATOR_SOCKET = os.getenv("NARRATOR_SOCKET", "/tmp/voicebox-narrator.sock")
+NARRATOR_TCP_PORT = int(os.getenv("NARRATOR_TCP_PORT", "50300"))  # bash /dev/tcp 用 (0 = 無効)
+NARRATOR_TOKEN_FILE = os.getenv("NARRATOR_TOKEN_FILE", os.path.join(OUTPUT_DIR, "narrator.token"))  # TCP接続の認証トークン (0600)
+NARRATOR_READ_TIMEOUT_SECONDS = float(os.getenv("NARRATOR_READ_TIMEOUT_SECONDS", "5"))  # 接続ごとの受信のタイムアウト (書き込まずに保持する接続を切る, 0 = 無制限)
+NARRATION_MIN_CHARS = int(os.getenv("NARRATION_MIN_CHARS", "10"))  # これより短いメッセージは読み上げない
+
+# Metrics settings
+METRICS_MAX_HISTORY = int(os.getenv("METRICS_MAX_HISTORY", "1000"))  # 完了タスク履歴の保持件数
+METRICS_MAX_ACTIVE = int(os.getenv("METRICS_MAX_ACTIVE", "10000"))  # 実行中として追跡するタスクの上限
+METRICS_STALE_SECONDS = float(os.getenv("METRICS_STALE_SECONDS", "300"))  # 完了が記録されないタスクをLOSTとみなす時間
@@ -0,0 +1,412 @@
+"""
+Synthesis Cost Model for VoiceBox TTS
+合成コスト (VOICEVOXの処理時間) のオンライン推定
+
+ワーカーは合成のたびに (モーラ数, テキスト, 話者, 合成時間) を観測し、
+減衰付きの単回帰を2つ更新する。
+- テキスト → モーラ数: 文字種ごとの概算モーラ数 (かな1・漢字2など) を実測のモーラ数で補正
+- モーラ数 → 合成時間: 話者ごと (サンプルが少ない話者は全話者共通のモデル)
+
+API は audio_query 前のテキストだけで見積もるため、この2段で推定する。
+見積もりは POST /tts の ETA、short/long レーンの振り分け、
+SJFディスパッチャ (dispatcher.py) の優先度に使う。
+
+統計量は Redis のハッシュで共有する (ワーカーが更新し、APIは一定間隔で読み直す)。
+見積もり精度 (投入時の見積もりと実測の相対誤差) も同じく共有し、APIの /metrics で参照する。
+Redis を使わない (ブローカーが redis:// 以外の) 場合はプロセス内のモデルのみ。
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import redis
+
+from config import (
+    CELERY_BROKER_URL,
+    COST_BACKLOG_TTL_SECONDS,
+    COST_MODEL_DECAY,
+    COST_MODEL_REFRESH_SECONDS,
+    COST_PRIOR_BASE_MS,
+    COST_PRIOR_MS_PER_MORA,
+    COST_SHORT_LANE_MS,
+    ETA_PARALLELISM
+)
+
+SHORT_LANE = 'short'
+LONG_LANE = 'long'
+
+# 回帰を使い始めるまでのサンプル数 (減衰後の重み)
+_MIN_WEIGHT = 3.0
+
+# 前の音と1モーラになる小書きかな
+_SMALL_KANA = set('ぁぃぅぇぉゃゅょゎァィゥェォャュョヮ')
+
+# 減衰付きの加算 (複数ワーカーからの同時更新をアトミックにする)
+_UPDATE_SCRIPT = """
+local fields = {'w', 'sx', 'sy', 'sxx', 'sxy'}
+for i, field in ipairs(fields) do
+    local value = tonumber(redis.call('hget', KEYS[1], field) or '0')
+    redis.call('hset', KEYS[1], field, tostring(value * tonumber(ARGV[1]) + tonumber(ARGV[i + 1])))
+end
+return 1
+"""
+
+# バックログの加算・減算 (タスクごとに記録し、期限切れのタスクの分を戻す)
+# KEYS: レーンごとの合計, タスクごとの 'レーン コスト', タスクごとの期限
+# ARGV: 'add' / 'remove' / 'expire', 現在時刻, タスクID, レーン, コスト, 期限
+_BACKLOG_SCRIPT = """
+local function drop(task_id)
+    local entry = redis.call('hget', KEYS[2], task_id)
+    redis.call('zrem', KEYS[3], task_id)
+    if not entry then
+        return
+    end
+    redis.call('hdel', KEYS[2], task_id)
+    local lane, cost = string.match(entry, '^(%S+) (%S+)$')
+    if tonumber(redis.call('hincrbyfloat', KEYS[1], lane, -tonumber(cost))) < 0 then
+        redis.call('hset', KEYS[1], lane, 0)
+    end
+end
+for _, task_id in ipairs(redis.call('zrangebyscore', KEYS[3], '-inf', ARGV[2], 'LIMIT', 0, 100)) do
+    drop(task_id)
+end
+if ARGV[1] == 'add' then
+    if redis.call('hexists', KEYS[2], ARGV[3]) == 0 then
+        redis.call('hset', KEYS[2], ARGV[3], ARGV[4] .. ' ' .. ARGV[5])
+        redis.call('hincrbyfloat', KEYS[1], ARGV[4], ARGV[5])
+    end
+    redis.call('zadd', KEYS[3], ARGV[6], ARGV[3])
+    return redis.call('hget', KEYS[1], ARGV[4])
+end
+if ARGV[1] == 'remove' then
+    drop(ARGV[3])
+end
+if redis.call('zcard', KEYS[3]) == 0 then
+    -- 未着手のタスクがなければ合計を0に戻す (浮動小数点の誤差・記録前の加算分)
+    redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def count_morae(query: dict) -> int:
+    """audio_query のモーラ数 (accent_phrases のモーラ + 句間のポーズ)"""
+    morae = 0
+    for phrase in query.get('accent_phrases') or ():
+        morae += len(phrase.get('moras') or ())
+        if phrase.get('pause_mora'):
+            morae += 1
+    return morae
+
+
+def text_morae(text: str) -> int:
+    """テキストからの概算モーラ数 (audio_query 前の見積もり用、NFKC正規化済みのテキスト)"""
+    morae = 0
+    for char in text:
+        code = ord(char)
+        if char in _SMALL_KANA or char == '・':
+            continue
+        if 0x3041 <= code <= 0x30FF:
+            # ひらがな・カタカナ・長音
+            morae += 1
+        elif 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+            # 漢字 (音読みの多くは2モーラ)
+            morae += 2
+        elif char.isalnum():
+            # 英数字 (「エー」「ニ」などの読み)
+            morae += 2
+    return morae
+
+
+class _Fit:
+    """減衰付き単回帰 y = a + b x の十分統計量"""
+
+    __slots__ = ('w', 'sx', 'sy', 'sxx', 'sxy')
+
+    def __init__(self, values=(0.0, 0.0, 0.0, 0.0, 0.0)):
+        self.w, self.sx, self.sy, self.sxx, self.sxy = (float(v) for v in values)
+
+    @classmethod
+    def from_redis(cls, fields: dict) -> '_Fit':
+        return cls(float(fields.get(name.encode(), 0)) for name in cls.__slots__)
+
+    def update(self, x: float, y: float, decay: float):
+        self.w = self.w * decay + 1
+        self.sx = self.sx * decay + x
+        self.sy = self.sy * decay + y
+        self.sxx = self.sxx * decay + x * x
+        self.sxy = self.sxy * decay + x * y
+
+    def coefficients(self, prior_a: float, prior_b: float) -> Tuple[float, float]:
+        """(切片, 傾き)  サンプル不足の間は事前値、x が一定なら傾きのみ事前値"""
+        if self.w < _MIN_WEIGHT:
+            return prior_a, prior_b
+
+        mean_x = self.sx / self.w
+        mean_y = self.sy / self.w
+        var_x = self.sxx / self.w - mean_x * mean_x
+        if var_x > 1e-6 * max(mean_x * mean_x, 1.0):
+            slope = max((self.sxy / self.w - mean_x * mean_y) / var_x, 0.0)
+        else:
+            slope = prior_b
+        return mean_y - slope * mean_x, slope
+
+    def predict(self, x: float, prior_a: float, prior_b: float) -> float:
+        a, b = self.coefficients(prior_a, prior_b)
+        return max(a + b * x, 0.0)
+
+
+class CostModel:
+    """合成コストモデル
+
+    Args:
+        redis_client: 共有に使うRedis (None ならプロセス内のみ)
+        decay: 観測ごとの減衰率 (有効サンプル数 ≈ 1 / (1 - decay))
+        refresh_seconds: Redisからモデル・バックログを読み直す間隔
+        short_lane_ms: これ以下の見積もりを short レーンに振り分ける
+        parallelism: ETA計算に使う同時合成数
+        namespace: キーの名前空間
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        decay: float = COST_MODEL_DECAY,
+        refresh_seconds: float = COST_MODEL_REFRESH_SECONDS,
+        short_lane_ms: float = COST_SHORT_LANE_MS,
+        parallelism: int = ETA_PARALLELISM,
+        prior_base_ms: float = COST_PRIOR_BASE_MS,
+        prior_ms_per_mora: float = COST_PRIOR_MS_PER_MORA,
+        backlog_ttl: float = COST_BACKLOG_TTL_SECONDS,
+        namespace: str = 'tts'
+    ):
+        self.redis_client = redis_client
+        self.decay = decay
+        self.refresh_seconds = refresh_seconds
+        self.short_lane_ms = short_lane_ms
+        self.parallelism = max(parallelism, 1)
+        self.prior_base_ms = prior_base_ms
+        self.prior_ms_per_mora = prior_ms_per_mora
+        self.backlog_ttl = backlog_ttl
+        self.prefix = f'voicebox:cost:{namespace}:'
+
+        self._lock = threading.Lock()
+        # 'morae' (テキスト → モーラ数), 'ms' (全話者), 'ms:<speaker>' (話者ごと)
+        self._fits: Dict[str, _Fit] = {}
+        self._fetched: Dict[str, float] = {}
+        self._backlog: Dict[str, float] = {SHORT_LANE: 0.0, LONG_LANE: 0.0}
+        # 未着手タスクの (レーン, コスト) と、期限の古い順の (期限, タスクID)
+        self._backlog_tasks: Dict[str, Tuple[str, float]] = {}
+        self._backlog_expiry: Deque[Tuple[float, str]] = deque()
+
+        if redis_client is not None:
+            self._update = redis_client.register_script(_UPDATE_SCRIPT)
+            self._backlog_script = redis_client.register_script(_BACKLOG_SCRIPT)
+
+    # ------------------------------------------------------------------
+    # モデル
+    # ------------------------------------------------------------------
+
+    def _fit(self, name: str) -> _Fit:
+        if self.redis_client is not None:
+            now = time.monotonic()
+            if now - self._fetched.get(name, float('-inf')) >= self.refresh_seconds:
+                self._fetched[name] = now
+                try:
+                    fields = self.redis_client.hgetall(f'{self.prefix}fit:{name}')
+                except redis.RedisError:
+                    fields = None
+                if fields:
+                    fit = _Fit.from_redis(fields)
+                    with self._lock:
+                        self._fits[name] = fit
+                    return fit
+
+        with self._lock:
+            fit = self._fits.get(name)
+            if fit is None:
+                fit = self._fits[name] = _Fit()
+            return fit
+
+    def observe(self, text: str, speaker: int, morae: int, synthesis_ms: float):
+        """合成の実測値でモデルを更新
+
+        Args:
+            text: 正規化済みテキスト
+            speaker: 話者ID
+            morae: audio_query のモーラ数 (count_morae)
+            synthesis_ms: audio_query + synthesis の所要時間
+        """
+        samples = (
+            ('morae', text_morae(text), morae),
+            ('ms', morae, synthesis_ms),
+            (f'ms:{speaker}', morae, synthesis_ms),
+        )
+        with self._lock:
+            for name, x, y in samples:
+                fit = self._fits.get(name)
+                if fit is None:
+                    fit = self._fits[name] = _Fit()
+                fit.update(x, y, self.decay)
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for name, x, y in samples:
+                    self._update(
+                        keys=[f'{self.prefix}fit:{name}'],
+                        args=[self.decay, 1, x, y, x * x, x * y],
+                        client=pipe
+                    )
+                pipe.execute()
+            except redis.RedisError:
+                pass  # プロセス内のモデルのみ更新
+
+    def record_accuracy(self, estimated_ms: float, actual_ms: float):
+        """投入時の見積もりと実測の相対誤差を記録 (減衰付きの平均、ワーカー側)"""
+        if actual_ms <= 0:
+            return
+        error = (estimated_ms - actual_ms) / actual_ms
+        # 'accuracy' の x = |誤差|, y = 誤差 (平均は sx / w, sy / w)
+        with self._lock:
+            fit = self._fits.get('accuracy')
+            if fit is None:
+                fit = self._fits['accuracy'] = _Fit()
+            fit.update(abs(error), error, self.decay)
+
+        if self.redis_client is not None:
+            try:
+                self._update(
+                    keys=[f'{self.prefix}fit:accuracy'],
+                    args=[self.decay, 1, abs(error), error, error * error, abs(error) * error]
+                )
+            except redis.RedisError:
+                pass
+
+    def accuracy(self) -> dict:
+        """見積もり精度 (全ワーカーの減衰付き平均)"""
+        fit = self._fit('accuracy')
+        if fit.w <= 0:
+            return {'samples': 0.0, 'mean_abs_error': None, 'bias': None}
+        return {
+            'samples': round(fit.w, 1),
+            'mean_abs_error': fit.sx / fit.w,
+            'bias': fit.sy / fit.w,
+        }
+
+    def estimate_morae(self, text: str) -> float:
+        """テキストのモーラ数の見積もり"""
+        return self._fit('morae').predict(text_morae(text), 0.0, 1.0)
+
+    def estimate(self, text: str, speaker: int) -> float:
+        """合成時間の見積もり (ms)"""
+        morae = self.estimate_morae(text)
+        fit = self._fit(f'ms:{speaker}')
+        if fit.w < _MIN_WEIGHT:
+            fit = self._fit('ms')
+        return fit.predict(morae, self.prior_base_ms, self.prior_ms_per_mora)
+
+    def lane(self, cost_ms: float) -> str:
+        """見積もりコストからレーンを決定"""
+        return SHORT_LANE if cost_ms <= self.short_lane_ms else LONG_LANE
+
+    # ------------------------------------------------------------------
+    # バックログ (ETA用の未着手タスクの見積もり合計)
+    # ------------------------------------------------------------------
+
+    def _backlog_keys(self):
+        return [f'{self.prefix}backlog', f'{self.prefix}backlog:tasks', f'{self.prefix}backlog:expiry']
+
+    def _drop_local(self, task_id: str):
+        entry = self._backlog_tasks.pop(task_id, None)
+        if entry is not None:
+            lane, cost_ms = entry
+            self._backlog[lane] = max(self._backlog.get(lane, 0.0) - cost_ms, 0.0)
+
+    def _expire_local(self, now: float):
+        while self._backlog_expiry and self._backlog_expiry[0][0] <= now:
+            _, task_id = self._backlog_expiry.popleft()
+            self._drop_local(task_id)
+        if not self._backlog_tasks:
+            for lane in self._backlog:
+                self._backlog[lane] = 0.0
+
+    def enqueue(self, task_id: str, lane: str, cost_ms: float) -> float:
+        """レーンのバックログに加算し、ETA (ms) を返す
+
+        ETA = 先行タスクの見積もり合計 / 同時合成数 + 自分の見積もり
+        backlog_ttl 秒以内に着手されないタスク (消失・取り消しなど) の分は自動的に減算される。
+        """
+        now = time.time()
+        backlog = None
+        if self.redis_client is not None:
+            try:
+                backlog = float(self._backlog_script(
+                    keys=self._backlog_keys(),
+                    args=['add', now, task_id, lane, cost_ms, now + self.backlog_ttl]
+                ))
+            except redis.RedisError:
+                pass
+        if backlog is None:
+            with self._lock:
+                self._expire_local(now)
+                if task_id not in self._backlog_tasks:
+                    self._backlog_tasks[task_id] = (lane, cost_ms)
+                    self._backlog[lane] = self._backlog.get(lane, 0.0) + cost_ms
+                    self._backlog_expiry.append((now + self.backlog_ttl, task_id))
+                backlog = self._backlog[lane]
+        return max(backlog - cost_ms, 0.0) / self.parallelism + cost_ms
+
+    def dequeue(self, task_id: str):
+        """タスクの着手時 (または投入の失敗時) にバックログから減算 (同じタスクの2回目以降は何もしない)"""
+        if self.redis_client is not None:
+            try:
+                self._backlog_script(keys=self._backlog_keys(), args=['remove', time.time(), task_id, '', 0, 0])
+                return
+            except redis.RedisError:
+                pass
+        with self._lock:
+            self._drop_local(task_id)
+            self._expire_local(time.time())
+
+    def get_backlog(self) -> Dict[str, float]:
+        """レーンごとのバックログ (ms)"""
+        if self.redis_client is not None:
+            try:
+                self._backlog_script(keys=self._backlog_keys(), args=['expire', time.time(), '', '', 0, 0])
+                fields = self.redis_client.hgetall(f'{self.prefix}backlog')
+                backlog = {SHORT_LANE: 0.0, LONG_LANE: 0.0}
+                backlog.update({k.decode(): max(float(v), 0.0) for k, v in fields.items()})
+                return backlog
+            except redis.RedisError:
+                pass
+        with self._lock:
+            self._expire_local(time.time())
+            return dict(self._backlog)
+
+    def get_stats(self) -> dict:
+        """統計情報取得"""
+        base_ms, ms_per_mora = self._fit('ms').coefficients(self.prior_base_ms, self.prior_ms_per_mora)
+        morae_fit = self._fit('morae')
+        return {
+            'samples': round(morae_fit.w, 1),
+            'base_ms': base_ms,
+            'ms_per_mora': ms_per_mora,
+            'morae_per_estimated_mora': morae_fit.coefficients(0.0, 1.0)[1],
+            'short_lane_ms': self.short_lane_ms,
+            'backlog_ms': self.get_backlog(),
+        }
+
+
+# グローバルインスタンス
+_cost_model: Optional[CostModel] = None
+
+
+def get_cost_model() -> CostModel:
+    global _cost_model
+    if _cost_model is None:
+        _cost_model = CostModel(
+            redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None
+        )
+    return _cost_model
@@ -0,0 +1,647 @@
+"""
+SJF / Fair Dispatcher for VoiceBox TTS
+保留キューからCeleryへ投入する順序の制御
+- SJFDispatcher: 見積もりコストの小さいタスクから順に投入 (Shortest Job First + エージング)
+- FairDispatcher: クライアントごとのキューから重み付き公平キュー (Deficit Round Robin) で投入
+
+SJF_SCHEDULING=true の場合、POST /tts はタスクを直接Celeryに送らず保留キューに登録する。
+ディスパッチャはディスパッチ済みの未完了タスクを SJF_MAX_INFLIGHT 件までに保ち、
+スコアの小さい順にCeleryへ送る。ブローカーのキューには最大 SJF_MAX_INFLIGHT 件しか
+積まれないため、到着順ではなく保留キューの順序で処理される。
+
+    スコア = 登録時刻 + 見積もりコスト(秒) / SJF_AGING_RATE
+
+待ち時間1秒ごとに見積もりコスト SJF_AGING_RATE 秒分ずつ優先度が上がるのと同じ順序になる。
+短いタスクは長いタスクを追い越せるが、コスト C のタスクが追い越され続けるのは
+最大 C / SJF_AGING_RATE 秒までなので、長いタスクも飢餓状態にならない。
+
+ディスパッチャはAPIサーバープロセス内のスレッドで動き、最初の登録時に起動する。
+投入したタスクのメッセージヘッダーには名前空間 (DISPATCH_HEADER) が付き、ワーカーは
+自分の設定 (SJF_SCHEDULING / FAIR_QUEUING) に関係なくタスク終了時に notify_done で通知し、
+空いた枠に次のタスクが投入される。
+保留がない間は登録の通知 (起床通知リスト) を待ち、枠の確保・解放は繰り返さない。
+保留キューは Redis の ZSET (複数のAPIプロセスで共有)、
+Redis を使わない場合やRedisエラー時はプロセス内のヒープ。
+
+未完了タスクも Redis の ZSET (タスクID → 期限) で全APIプロセスが共有し、枠の確保は
+Luaスクリプトで上限の確認と登録を1回で行う (Redis を使わない場合はプロセス内)。
+時間制限による強制終了・OOM・ワーカーのクラッシュで task_done が届かなかったタスクの枠は、
+投入から SJF_INFLIGHT_TIMEOUT_SECONDS 経過後に回収する。
+
+FAIR_QUEUING=true の場合はクライアント (POST /tts の X-API-Key / X-Client-Id) ごとのリストに
+登録し、DRRで順に取り出す。各クライアントには1巡ごとに FAIR_QUANTUM_MS × 重み
+(CLIENT_WEIGHTS) の見積もりコスト分の枠が割り当てられるため、大量に投入するクライアントが
+いても他のクライアントの待ち時間は自分の前に並ぶ自分のタスク分に抑えられる。
+クライアント内は到着順。
+
+どちらのディスパッチャもクライアントごとの保留数と待ち時間 (登録 → 投入) を集計する。
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque, OrderedDict
+from typing import Callable, Deque, Dict, List, Optional
+
+import redis
+
+from config import (
+    CELERY_BROKER_URL,
+    SJF_SCHEDULING,
+    SJF_AGING_RATE,
+    SJF_MAX_INFLIGHT,
+    SJF_INFLIGHT_TIMEOUT_SECONDS,
+    FAIR_QUEUING,
+    FAIR_QUANTUM_MS,
+    CLIENT_WEIGHTS
+)
+
+# ブロッキング待機の上限 (秒)  停止要求・枠の空きの確認間隔
+_POLL_SECONDS = 0.5
+
+# ディスパッチャ経由で投入したタスクのメッセージヘッダー (値はディスパッチャの名前空間)
+DISPATCH_HEADER = 'voicebox_dispatch'
+
+# ワーカーからの完了通知リスト (枠の空き待ちの起床用) の上限 (ディスパッチャ停止中に溜まらないように)
+_DONE_MAX = 10000
+
+# 未完了タスクの枠の確保 (期限切れの枠を回収してから、上限未満なら登録)
+# KEYS: 未完了タスクの ZSET (メンバー → 期限)
+# ARGV: 現在時刻, 期限, 上限, メンバー
+# 戻り値: {確保できたら 1, 回収した枠の数}
+_RESERVE_SCRIPT = """
+local reclaimed = redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if redis.call('zcard', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('zadd', KEYS[1], ARGV[2], ARGV[4])
+    return {1, reclaimed}
+end
+return {0, reclaimed}
+"""
+
+# クライアント識別子が付いていないジョブ
+DEFAULT_CLIENT = 'default'
+
+# クライアントごとに保持する待ち時間のサンプル数・集計するクライアント数の上限
+_WAIT_SAMPLES = 200
+_MAX_CLIENTS = 1000
+
+# DRR: 1回の取り出しで巡回するクライアント数の上限 (超えた場合は次のループで続きから)
+_MAX_VISITS = 1000
+
+# DRR のジョブ登録 (クライアントのリストに追加し、新しいクライアントなら巡回リストの末尾へ)
+# KEYS: クライアントのリスト, アクティブなクライアントの集合, 巡回リスト, 起床通知リスト
+_FAIR_PUSH_SCRIPT = """
+redis.call('rpush', KEYS[1], ARGV[2])
+if redis.call('sadd', KEYS[2], ARGV[1]) == 1 then
+    redis.call('rpush', KEYS[3], ARGV[1])
+end
+redis.call('rpush', KEYS[4], 1)
+redis.call('ltrim', KEYS[4], -100, -1)
+return 1
+"""
+
+# DRR の取り出し (巡回リストの先頭のクライアントから、見積もりコストが残り枠に収まれば取り出し、
+# 収まらなければ枠を加算して末尾へ回す)
+# KEYS: 巡回リスト, アクティブなクライアントの集合, 残り枠のハッシュ
+# ARGV: クライアントのリストのキー接頭辞, クォンタム, 重み (JSON), 巡回数の上限
+# クライアントのリストのキーはクライアント名から組み立てる (単一のRedisを前提)
+_FAIR_POP_SCRIPT = """
+local quantum = tonumber(ARGV[2])
+local weights = cjson.decode(ARGV[3])
+for i = 1, tonumber(ARGV[4]) do
+    local client = redis.call('lindex', KEYS[1], 0)
+    if not client then
+        return false
+    end
+    local queue = ARGV[1] .. client
+    local head = redis.call('lindex', queue, 0)
+    if not head then
+        redis.call('lpop', KEYS[1])
+        redis.call('srem', KEYS[2], client)
+        redis.call('hdel', KEYS[3], client)
+    else
+        local deficit = tonumber(redis.call('hget', KEYS[3], client) or '0')
+        local cost = tonumber(cjson.decode(head)['cost_ms']) or 0
+        if cost <= deficit then
+            redis.call('lpop', queue)
+            if redis.call('llen', queue) == 0 then
+                redis.call('lpop', KEYS[1])
+                redis.call('srem', KEYS[2], client)
+                redis.call('hdel', KEYS[3], client)
+            else
+                redis.call('hset', KEYS[3], client, tostring(deficit - cost))
+            end
+            return head
+        end
+        redis.call('hset', KEYS[3], client, tostring(deficit + quantum * (tonumber(weights[client]) or 1)))
+        redis.call('rpush', KEYS[1], redis.call('lpop', KEYS[1]))
+    end
+end
+return ''
+"""
+
+
+class SJFDispatcher:
+    """SJFディスパッチャ
+
+    Args:
+        redis_client: 保留キューに使うRedis (None ならプロセス内のみ)
+        aging_rate: 待ち1秒あたりに相殺する見積もりコスト (秒)、inf で到着順
+        max_inflight: ディスパッチ済み未完了タスクの上限
+        namespace: キーの名前空間
+        inflight_timeout: 完了通知のない未完了タスクの枠を回収するまでの時間 (秒)
+    """
+
+    policy = 'sjf'
+
+    def __init__(
+        self,
+        redis_client=None,
+        aging_rate: float = SJF_AGING_RATE,
+        max_inflight: int = SJF_MAX_INFLIGHT,
+        namespace: str = 'tts',
+        inflight_timeout: float = SJF_INFLIGHT_TIMEOUT_SECONDS
+    ):
+        self.redis_client = redis_client
+        self.aging_rate = aging_rate
+        self.max_inflight = max(max_inflight, 1)
+        self.inflight_timeout = inflight_timeout
+        self.namespace = namespace
+        self.prefix = f'voicebox:dispatch:{namespace}:'
+        self.pending_key = f'{self.prefix}pending'
+        self.inflight_key = f'{self.prefix}inflight'
+        self.done_key = f'{self.prefix}done'
+        self.wake_key = f'{self.prefix}wake'
+        if redis_client is not None:
+            self._reserve = redis_client.register_script(_RESERVE_SCRIPT)
+
+        self._send: Optional[Callable[[dict], None]] = None
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._inflight: Dict[str, float] = {}  # タスクID (確保中は枠のトークン) → 期限 (Redisを使わない場合)
+        self._pid: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # 統計カウンター
+        self.submitted = 0
+        self.dispatched = 0
+        self.reclaimed = 0
+        # クライアント → (投入数, 待ち時間 ms のサンプル)
+        self._waits: 'OrderedDict[str, list]' = OrderedDict()
+
+    def attach(self, send: Callable[[dict], None]):
+        """Celeryへの投入処理を設定 (APIサーバー側のみ)
+
+        send はジョブ (task_id, text, speaker, cost_ms, lane, client, headers) を受け取り send_task する。
+        """
+        self._send = send
+
+    def _score(self, cost_ms: float) -> float:
+        return time.time() + cost_ms / 1000 / self.aging_rate
+
+    def submit(
+        self,
+        task_id: str,
+        text: str,
+        speaker: Optional[int],
+        cost_ms: float,
+        lane: str,
+        client: str = DEFAULT_CLIENT,
+        headers: Optional[dict] = None
+    ):
+        """保留キューに登録 (headers はCeleryメッセージヘッダー: トレース情報など)"""
+        job = {
+            'task_id': task_id, 'text': text, 'speaker': speaker, 'cost_ms': cost_ms, 'lane': lane,
+            'client': client, 'submitted_at': time.time(),
+            'headers': dict(headers or {}, **{DISPATCH_HEADER: self.namespace})
+        }
+        self._ensure_started()
+        self._push(job)
+
+        with self._cond:
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def _push(self, job: dict):
+        score = self._score(job['cost_ms'])
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.zadd(self.pending_key, {json.dumps(job, ensure_ascii=False): score})
+                pipe.rpush(self.wake_key, 1)
+                pipe.ltrim(self.wake_key, -100, -1)
+                pipe.execute()
+                return
+            except redis.RedisError:
+                pass
+        with self._cond:
+            heapq.heappush(self._heap, (score, next(self._seq), job))
+
+    def _requeue(self, job: dict):
+        """投入に失敗したジョブをプロセス内の保留キューに戻す (self._cond 保持中)"""
+        heapq.heappush(self._heap, (self._score(job['cost_ms']), next(self._seq), job))
+
+    def task_done(self, task_id: str):
+        """タスク終了の通知 (ワーカー側、このディスパッチャが送ったタスク以外は無視される)"""
+        with self._cond:
+            if self._inflight.pop(task_id, None) is not None:
+                self._cond.notify_all()
+                return
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.zrem(self.inflight_key, task_id)
+                pipe.rpush(self.done_key, task_id)
+                pipe.ltrim(self.done_key, -_DONE_MAX, -1)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+
+    # ------------------------------------------------------------------
+    # ディスパッチループ
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid != pid:
+                # fork後の子プロセスでは親のスレッド・未完了タスクを引き継がない
+                self._inflight = {}
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='voicebox-sjf', daemon=True)
+                self._thread.start()
+                self._pid = pid
+
+    def _run(self):
+        # 起動時は登録の通知がなくても保留キューを確認する (停止中に登録されたジョブ)
+        idle = False
+        while not self._stop.is_set():
+            try:
+                if idle and not self._wait_for_job():
+                    continue
+                slot = self._acquire_slot()
+                if slot is None:
+                    continue
+                job = self._pop_job()
+                if job is None:
+                    self._release_slot(slot)
+                    idle = True
+                    continue
+                idle = False
+                self._bind_slot(slot, job['task_id'])
+                with self._cond:
+                    self.dispatched += 1
+                try:
+                    self._send(job)
+                except Exception:
+                    # 投入に失敗したタスクは保留キューに戻す
+                    self._release_slot(job['task_id'])
+                    with self._cond:
+                        self.dispatched -= 1
+                        self._requeue(job)
+                    self._stop.wait(_POLL_SECONDS)
+                    continue
+                self._record_wait(job)
+            except redis.RedisError:
+                self._stop.wait(_POLL_SECONDS)
+
+    def _has_local_jobs(self) -> bool:
+        """プロセス内の保留キューにジョブがあるか (self._cond 保持中)"""
+        return bool(self._heap)
+
+    def _wait_for_job(self) -> bool:
+        """保留がない間の待機 (登録の通知があれば True)"""
+        with self._cond:
+            if self._has_local_jobs():
+                return True
+            if self.redis_client is None:
+                self._cond.wait(_POLL_SECONDS)
+                return self._has_local_jobs()
+        return self.redis_client.blpop(self.wake_key, timeout=_POLL_SECONDS) is not None
+
+    def _acquire_slot(self) -> Optional[str]:
+        """未完了タスクの枠を確保し、枠のトークンを返す (上限に達していれば待って None)
+
+        ジョブを取り出す前に枠を確保するため、空き待ちの間に登録されたジョブも順序どおりに投入される。
+        """
+        token = f'slot:{uuid.uuid4().hex}'
+        now = time.time()
+        if self.redis_client is not None:
+            reserved, reclaimed = self._reserve(
+                keys=[self.inflight_key],
+                args=[now, now + self.inflight_timeout, self.max_inflight, token]
+            )
+            if reclaimed:
+                with self._cond:
+                    self.reclaimed += reclaimed
+            if reserved:
+                return token
+            # 完了通知 (どのAPIプロセスが受け取っても、空いた枠は共有の ZSET で確保し直す)
+            self.redis_client.blpop(self.done_key, timeout=_POLL_SECONDS)
+            return None
+
+        with self._cond:
+            while not self._stop.is_set():
+                now = time.time()
+                expired = [task_id for task_id, deadline in self._inflight.items() if deadline <= now]
+                for task_id in expired:
+                    del self._inflight[task_id]
+                self.reclaimed += len(expired)
+                if len(self._inflight) < self.max_inflight:
+                    self._inflight[token] = now + self.inflight_timeout
+                    return token
+                self._cond.wait(_POLL_SECONDS)
+            return None
+
+    def _bind_slot(self, token: str, task_id: str):
+        """確保した枠をタスクIDに付け替える (期限は投入時刻から)"""
+        deadline = time.time() + self.inflight_timeout
+        if self.redis_client is not None:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.zrem(self.inflight_key, token)
+            pipe.zadd(self.inflight_key, {task_id: deadline})
+            pipe.execute()
+            return
+        with self._cond:
+            self._inflight.pop(token, None)
+            self._inflight[task_id] = deadline
+
+    def _release_slot(self, member: str):
+        """枠を解放 (ジョブがなかった・投入に失敗した場合)"""
+        if self.redis_client is not None:
+            self.redis_client.zrem(self.inflight_key, member)
+            return
+        with self._cond:
+            self._inflight.pop(member, None)
+            self._cond.notify_all()
+
+    def inflight(self) -> int:
+        """ディスパッチ済み未完了タスク数 (Redisを使う場合は全APIプロセスの合計)"""
+        if self.redis_client is not None:
+            try:
+                return self.redis_client.zcard(self.inflight_key)
+            except redis.RedisError:
+                pass
+        with self._cond:
+            return len(self._inflight)
+
+    def _pop_job(self) -> Optional[dict]:
+        """スコア最小のジョブを取り出す (なければ None)"""
+        with self._cond:
+            # Redisエラー時に登録されたジョブ・投入失敗のジョブ
+            if self._heap:
+                return heapq.heappop(self._heap)[2]
+            if self.redis_client is None:
+                return None
+
+        item = self.redis_client.zpopmin(self.pending_key)
+        return json.loads(item[0][0]) if item else None
+
+    def stop(self):
+        """ディスパッチループを停止 (保留中のジョブは残る)"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(_POLL_SECONDS * 4)
+        self._pid = None
+
+    def _record_wait(self, job: dict):
+        """登録 → 投入の待ち時間をクライアントごとに記録"""
+        client = job.get('client') or DEFAULT_CLIENT
+        wait_ms = (time.time() - job.get('submitted_at', time.time())) * 1000
+        with self._cond:
+            entry = self._waits.get(client)
+            if entry is None:
+                entry = self._waits[client] = [0, deque(maxlen=_WAIT_SAMPLES)]
+                if len(self._waits) > _MAX_CLIENTS:
+                    self._waits.popitem(last=False)
+            else:
+                self._waits.move_to_end(client)
+            entry[0] += 1
+            entry[1].append(wait_ms)
+
+    def client_depths(self) -> Dict[str, int]:
+        """クライアントごとの保留中のジョブ数 (SJFではプロセス内の保留分のみ)"""
+        depths: Dict[str, int] = {}
+        with self._cond:
+            for _, _, job in self._heap:
+                client = job.get('client') or DEFAULT_CLIENT
+                depths[client] = depths.get(client, 0) + 1
+        return depths
+
+    def client_stats(self) -> Dict[str, dict]:
+        """クライアントごとの保留数・投入数・待ち時間 (このプロセスで投入した分)"""
+        depths = self.client_depths()
+        with self._cond:
+            waits = {client: (count, sorted(samples)) for client, (count, samples) in self._waits.items()}
+        stats = {}
+        for client in sorted(set(depths) | set(waits)):
+            count, samples = waits.get(client, (0, []))
+            stats[client] = {
+                'pending': depths.get(client, 0),
+                'dispatched': count,
+                'wait_p50_ms': samples[len(samples) // 2] if samples else None,
+                'wait_p95_ms': samples[min(int(len(samples) * 0.95), len(samples) - 1)] if samples else None,
+                'wait_max_ms': samples[-1] if samples else None,
+            }
+        return stats
+
+    def depth(self) -> int:
+        """保留中のジョブ数"""
+        with self._cond:
+            depth = len(self._heap)
+        if self.redis_client is not None:
+            try:
+                depth += self.redis_client.zcard(self.pending_key)
+            except redis.RedisError:
+                pass
+        return depth
+
+    def get_stats(self) -> Dict:
+        """統計情報取得"""
+        depth = self.depth()
+        inflight = self.inflight()
+        clients = self.client_stats()
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'pending': depth,
+                'inflight': inflight,
+                'max_inflight': self.max_inflight,
+                'submitted': self.submitted,
+                'dispatched': self.dispatched,
+                'reclaimed': self.reclaimed,
+                'clients': clients,
+            }
+
+
+class FairDispatcher(SJFDispatcher):
+    """重み付き公平キュー (Deficit Round Robin) のディスパッチャ
+
+    未完了タスク数の制御・完了通知はSJFディスパッチャと共通で、保留キューの構造のみ異なる。
+
+    Args:
+        redis_client: 保留キューに使うRedis (None ならプロセス内のみ)
+        quantum_ms: 1巡で重み1あたりに割り当てる見積もりコスト
+        weights: クライアントごとの重み (既定 1)
+        max_inflight: ディスパッチ済み未完了タスクの上限
+        namespace: キーの名前空間
+    """
+
+    policy = 'fair'
+
+    def __init__(
+        self,
+        redis_client=None,
+        quantum_ms: float = FAIR_QUANTUM_MS,
+        weights: Optional[Dict[str, float]] = None,
+        max_inflight: int = SJF_MAX_INFLIGHT,
+        namespace: str = 'tts',
+        inflight_timeout: float = SJF_INFLIGHT_TIMEOUT_SECONDS
+    ):
+        super().__init__(redis_client, float('inf'), max_inflight, namespace, inflight_timeout)
+        self.quantum_ms = max(quantum_ms, 1.0)
+        self.weights = {client: max(weight, 0.01) for client, weight in (
+            CLIENT_WEIGHTS if weights is None else weights
+        ).items()}
+        self.queue_prefix = f'{self.prefix}client:'
+        self.ring_key = f'{self.prefix}clients'
+        self.active_key = f'{self.prefix}active'
+        self.deficit_key = f'{self.prefix}deficit'
+
+        # プロセス内の保留キュー (Redisエラー時・投入失敗のジョブ)
+        self._queues: Dict[str, Deque[dict]] = {}
+        self._ring: Deque[str] = deque()
+        self._deficit: Dict[str, float] = {}
+
+        if redis_client is not None:
+            self._push_script = redis_client.register_script(_FAIR_PUSH_SCRIPT)
+            self._pop_script = redis_client.register_script(_FAIR_POP_SCRIPT)
+
+    def _push(self, job: dict):
+        client = job['client']
+        if self.redis_client is not None:
+            try:
+                self._push_script(
+                    keys=[f'{self.queue_prefix}{client}', self.active_key, self.ring_key, self.wake_key],
+                    args=[client, json.dumps(job, ensure_ascii=False)]
+                )
+                return
+            except redis.RedisError:
+                pass
+        with self._cond:
+            self._enqueue_local(job)
+
+    def _requeue(self, job: dict):
+        self._enqueue_local(job, front=True)
+
+    def _has_local_jobs(self) -> bool:
+        return bool(self._ring)
+
+    def _enqueue_local(self, job: dict, front: bool = False):
+        """プロセス内のクライアントのキューに追加 (self._cond 保持中)"""
+        client = job['client']
+        queue = self._queues.get(client)
+        if queue is None:
+            queue = self._queues[client] = deque()
+            self._ring.append(client)
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+
+    def _pop_local(self) -> Optional[dict]:
+        """プロセス内のキューからDRRで取り出す (self._cond 保持中)"""
+        while self._ring:
+            client = self._ring[0]
+            queue = self._queues[client]
+            deficit = self._deficit.get(client, 0.0)
+            cost = queue[0]['cost_ms']
+            if cost <= deficit:
+                job = queue.popleft()
+                if queue:
+                    self._deficit[client] = deficit - cost
+                else:
+                    # 空になったクライアントは巡回から外し、残り枠も捨てる
+                    self._ring.popleft()
+                    del self._queues[client]
+                    self._deficit.pop(client, None)
+                return job
+            self._deficit[client] = deficit + self.quantum_ms * self.weights.get(client, 1.0)
+            self._ring.rotate(-1)
+        return None
+
+    def _pop_job(self) -> Optional[dict]:
+        with self._cond:
+            job = self._pop_local()
+            if job is not None or self.redis_client is None:
+                return job
+
+        item = self._pop_script(
+            keys=[self.ring_key, self.active_key, self.deficit_key],
+            args=[self.queue_prefix, self.quantum_ms, json.dumps(self.weights), _MAX_VISITS]
+        )
+        return json.loads(item) if item else None
+
+    def client_depths(self) -> Dict[str, int]:
+        with self._cond:
+            depths = {client: len(queue) for client, queue in self._queues.items()}
+        if self.redis_client is not None:
+            try:
+                clients = sorted(member.decode() for member in self.redis_client.smembers(self.active_key))
+                pipe = self.redis_client.pipeline(transaction=False)
+                for client in clients:
+                    pipe.llen(f'{self.queue_prefix}{client}')
+                for client, length in zip(clients, pipe.execute()):
+                    if length:
+                        depths[client] = depths.get(client, 0) + length
+            except redis.RedisError:
+                pass
+        return depths
+
+    def depth(self) -> int:
+        return sum(self.client_depths().values())
+
+
+# グローバルインスタンス
+_dispatcher: Optional[SJFDispatcher] = None
+
+
+def get_dispatcher() -> Optional[SJFDispatcher]:
+    """ディスパッチャ (FAIR_QUEUING=true なら公平キュー、SJF_SCHEDULING=true ならSJF、どちらでもなければ None)"""
+    global _dispatcher
+    if _dispatcher is None and (FAIR_QUEUING or SJF_SCHEDULING):
+        redis_client = redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None
+        _dispatcher = FairDispatcher(redis_client) if FAIR_QUEUING else SJFDispatcher(redis_client)
+    return _dispatcher
+
+
+# 名前空間 → 完了通知用のディスパッチャ (ワーカー側、ディスパッチループは起動しない)
+_notifiers: Dict[str, SJFDispatcher] = {}
+_notifiers_lock = threading.Lock()
+
+
+def notify_done(task_id: str, namespace: str, local: Optional[SJFDispatcher] = None):
+    """ディスパッチャ経由で投入されたタスクの終了通知 (ワーカー側)
+
+    ワーカーのディスパッチャ設定に関係なく、メッセージヘッダーの名前空間の完了通知リストに送る。
+    local が同じ名前空間ならそれを使う (APIとワーカーが同じプロセスの場合のプロセス内の枠)。
+    """
+    if local is not None and local.namespace == namespace:
+        local.task_done(task_id)
+        return
+    with _notifiers_lock:
+        notifier = _notifiers.get(namespace)
+        if notifier is None:
+            redis_client = redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None
+            notifier = _notifiers[namespace] = SJFDispatcher(redis_client, namespace=namespace)
+    notifier.task_done(task_id)
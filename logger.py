@@ -9,6 +9,8 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+from tracing import log_context
+
 
 class StructuredLogger:
     """構造化ロガー - JSON形式でログ出力"""
@@ -40,6 +42,7 @@ class StructuredLogger:
             'level': level,
             'logger': self.name,
             'message': message,
+            **log_context(),  # トレース中なら trace_id / span_id
             **kwargs
         }
 
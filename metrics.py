@@ -4,32 +4,55 @@ Metrics Collection Module for VoiceBox TTS
 """
 import time
 import threading
-from collections import defaultdict, deque
-from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta
-from pathlib import Path
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, timezone
 from typing import Dict, List, Optional, Deque
 
+from config import METRICS_MAX_HISTORY, METRICS_MAX_ACTIVE, METRICS_STALE_SECONDS
+
+# 直近1時間の集計に使う分単位バケット数
+_WINDOW_MINUTES = 60
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    # 従来どおりタイムゾーンなしのUTC表記 (utcfromtimestamp は非推奨)
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None).isoformat()
+
 
-@dataclass
 class TaskMetric:
-    """タスクメトリクス"""
-    task_id: str
-    status: str
-    start_time: datetime
-    end_time: Optional[datetime] = None
-    duration_ms: Optional[float] = None
-    file_size: Optional[int] = None
-    speaker: Optional[int] = None
-    text_length: int = 0
-    error: Optional[str] = None
+    """タスクメトリクス (__slots__ で1件あたりのメモリを削減)"""
+
+    __slots__ = (
+        'task_id', 'status', 'start_time', 'end_time', 'duration_ms',
+        'file_size', 'speaker', 'text_length', 'error'
+    )
+
+    def __init__(
+        self,
+        task_id: str,
+        status: str,
+        start_time: float,
+        speaker: Optional[int] = None,
+        text_length: int = 0
+    ):
+        self.task_id = task_id
+        self.status = status
+        self.start_time = start_time  # UNIX時刻 (秒)
+        self.end_time: Optional[float] = None
+        self.duration_ms: Optional[float] = None
+        self.file_size: Optional[int] = None
+        self.speaker = speaker
+        self.text_length = text_length
+        self.error: Optional[str] = None
 
     def to_dict(self):
         return {
             'task_id': self.task_id,
             'status': self.status,
-            'start_time': self.start_time.isoformat(),
-            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'start_time': _isoformat(self.start_time),
+            'end_time': _isoformat(self.end_time),
             'duration_ms': self.duration_ms,
             'file_size': self.file_size,
             'speaker': self.speaker,
@@ -39,79 +62,124 @@ class TaskMetric:
 
 
 class MetricsCollector:
-    """メトリクス収集クラス"""
-
-    def __init__(self, max_history: int = 1000):
+    """メトリクス収集クラス
+
+    - 実行中タスクのみ保持し、完了・失敗したタスクは履歴 (有界) へ移す
+    - 完了・失敗が記録されないまま stale_after 秒を超えたタスクは LOST として期限切れ
+    - 直近1時間のタスク数は分単位のリングバッファで集計 (get_stats は O(1))
+    """
+
+    def __init__(
+        self,
+        max_history: int = METRICS_MAX_HISTORY,
+        max_active: int = METRICS_MAX_ACTIVE,
+        stale_after: float = METRICS_STALE_SECONDS
+    ):
         self.max_history = max_history
+        self.max_active = max_active
+        self.stale_after = stale_after
         self._lock = threading.Lock()
 
-        # タスク履歴
-        self._tasks: Dict[str, TaskMetric] = {}
+        # 実行中タスク (開始順)
+        self._tasks: "OrderedDict[str, TaskMetric]" = OrderedDict()
+        # 完了・失敗タスク履歴
         self._task_history: Deque[TaskMetric] = deque(maxlen=max_history)
 
         # 統計カウンター
         self._counters = defaultdict(int)
 
         # パフォーマンスメトリクス
-        self._durations: List[float] = []
         self._max_duration_samples = 100
+        self._durations: Deque[float] = deque(maxlen=self._max_duration_samples)
+
+        # 分単位バケット (minute番号, 完了・失敗数)
+        self._bucket_minutes = [-1] * _WINDOW_MINUTES
+        self._bucket_counts = [0] * _WINDOW_MINUTES
+
+    def _expire_stale_locked(self, now: float):
+        """期限切れの実行中タスクを LOST として破棄 (開始順なので先頭から)"""
+        cutoff = now - self.stale_after
+        while self._tasks:
+            task_id, metric = next(iter(self._tasks.items()))
+            if metric.start_time >= cutoff and len(self._tasks) <= self.max_active:
+                break
+            del self._tasks[task_id]
+            metric.status = 'LOST'
+            self._counters['tasks_lost'] += 1
+
+    def _count_finished_locked(self, now: float):
+        minute = int(now // 60)
+        index = minute % _WINDOW_MINUTES
+        if self._bucket_minutes[index] != minute:
+            self._bucket_minutes[index] = minute
+            self._bucket_counts[index] = 0
+        self._bucket_counts[index] += 1
+
+    def _finish_locked(self, task_id: str, status: str) -> Optional[TaskMetric]:
+        metric = self._tasks.pop(task_id, None)
+        if metric is None:
+            return None
+
+        now = time.time()
+        metric.status = status
+        metric.end_time = now
+        metric.duration_ms = (now - metric.start_time) * 1000
+        self._task_history.append(metric)
+        self._count_finished_locked(now)
+        return metric
 
     def task_start(self, task_id: str, text: str, speaker: int):
         """タスク開始記録"""
         with self._lock:
-            metric = TaskMetric(
+            now = time.time()
+            self._tasks[task_id] = TaskMetric(
                 task_id=task_id,
                 status='STARTED',
-                start_time=datetime.utcnow(),
+                start_time=now,
                 speaker=speaker,
                 text_length=len(text)
             )
-            self._tasks[task_id] = metric
             self._counters['tasks_started'] += 1
+            self._expire_stale_locked(now)
 
     def task_complete(self, task_id: str, file_size: int):
         """タスク完了記録"""
         with self._lock:
-            if task_id not in self._tasks:
+            metric = self._finish_locked(task_id, 'SUCCESS')
+            if metric is None:
                 return
 
-            metric = self._tasks[task_id]
-            metric.status = 'SUCCESS'
-            metric.end_time = datetime.utcnow()
-            metric.duration_ms = (metric.end_time - metric.start_time).total_seconds() * 1000
             metric.file_size = file_size
-
-            self._task_history.append(metric)
             self._durations.append(metric.duration_ms)
-            if len(self._durations) > self._max_duration_samples:
-                self._durations.pop(0)
-
             self._counters['tasks_completed'] += 1
             self._counters['total_audio_bytes'] += file_size
 
     def task_failure(self, task_id: str, error: str):
         """タスク失敗記録"""
         with self._lock:
-            if task_id not in self._tasks:
+            metric = self._finish_locked(task_id, 'FAILURE')
+            if metric is None:
                 return
 
-            metric = self._tasks[task_id]
-            metric.status = 'FAILURE'
-            metric.end_time = datetime.utcnow()
-            metric.duration_ms = (metric.end_time - metric.start_time).total_seconds() * 1000
             metric.error = error
-
-            self._task_history.append(metric)
             self._counters['tasks_failed'] += 1
 
+    def increment(self, name: str, value: int = 1):
+        """任意カウンターの加算"""
+        with self._lock:
+            self._counters[name] += value
+
     def get_stats(self) -> Dict:
         """統計情報取得"""
         with self._lock:
+            now = time.time()
+            self._expire_stale_locked(now)
+
             completed = self._counters['tasks_completed']
             failed = self._counters['tasks_failed']
             total = completed + failed
 
-            # パーセンタイル計算
+            # パーセンタイル計算 (直近100件)
             p50 = p95 = p99 = None
             if self._durations:
                 sorted_durations = sorted(self._durations)
@@ -120,12 +188,12 @@ class MetricsCollector:
                 p95 = sorted_durations[int(n * 0.95)]
                 p99 = sorted_durations[int(n * 0.99)]
 
-            # 直近1時間のタスク数
-            hour_ago = datetime.utcnow() - timedelta(hours=1)
-            recent_tasks = [
-                m for m in self._task_history
-                if m.start_time >= hour_ago
-            ]
+            # 直近1時間のタスク数 (分単位バケットの合計)
+            oldest_minute = int(now // 60) - _WINDOW_MINUTES
+            tasks_last_hour = sum(
+                count for minute, count in zip(self._bucket_minutes, self._bucket_counts)
+                if minute > oldest_minute
+            )
 
             return {
                 'counters': dict(self._counters),
@@ -135,8 +203,8 @@ class MetricsCollector:
                     'p95': p95,
                     'p99': p99,
                 },
-                'tasks_last_hour': len(recent_tasks),
-                'active_tasks': len([t for t in self._tasks.values() if t.status == 'STARTED'])
+                'tasks_last_hour': tasks_last_hour,
+                'active_tasks': len(self._tasks)
             }
 
     def get_recent_tasks(self, limit: int = 10) -> List[Dict]:
@@ -146,15 +214,15 @@ class MetricsCollector:
             return [m.to_dict() for m in reversed(recent)]
 
     def cleanup_old_tasks(self, hours: int = 24):
-        """古いタスクをクリーンアップ"""
+        """完了が記録されないまま残った古いタスクをクリーンアップ"""
         with self._lock:
-            cutoff = datetime.utcnow() - timedelta(hours=hours)
-            to_remove = [
-                task_id for task_id, metric in self._tasks.items()
-                if metric.end_time and metric.end_time < cutoff
-            ]
-            for task_id in to_remove:
+            cutoff = time.time() - hours * 3600
+            while self._tasks:
+                task_id, metric = next(iter(self._tasks.items()))
+                if metric.start_time >= cutoff:
+                    break
                 del self._tasks[task_id]
+                self._counters['tasks_lost'] += 1
 
 
 class PerformanceMonitor:
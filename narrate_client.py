@@ -0,0 +1,68 @@
+"""
+Narration Client for VoiceBox TTS
+ナレーションデーモンへの送信クライアント
+
+Usage:
+    echo '{"content": "..."}' | python3 narrate_client.py
+    python3 narrate_client.py --bench 1000   # 送信コストの計測
+"""
+import socket
+import sys
+import time
+
+from config import NARRATOR_SOCKET
+
+
+def send(payload: bytes, socket_path: str = NARRATOR_SOCKET, timeout: float = 0.5) -> bool:
+    """デーモンにペイロードを送信 (書き込んで閉じるだけ、応答は待たない)
+
+    Returns:
+        送信できた場合True (デーモン未起動ならFalse)
+    """
+    deadline = time.monotonic() + timeout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        while True:
+            try:
+                sock.connect(socket_path)
+                break
+            except BlockingIOError:
+                # 待ち受けキューが満杯 (EAGAIN): 空くまで再試行
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.0005)
+        sock.sendall(payload)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def bench(count: int, socket_path: str = NARRATOR_SOCKET):
+    """送信1回あたりのコスト (connect + write + close) を計測
+
+    デーモン側では10文字未満のため読み上げずに破棄される。
+    """
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        if not send(b'{"content": ""}', socket_path):
+            print(f'Narration daemon is not running: {socket_path}')
+            return
+        durations.append((time.perf_counter() - start) * 1000)
+
+    durations.sort()
+    n = len(durations)
+    print(f'count={n} '
+          f'p50={durations[int(n * 0.5)]:.3f}ms '
+          f'p99={durations[min(int(n * 0.99), n - 1)]:.3f}ms '
+          f'max={durations[-1]:.3f}ms')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--bench':
+        bench(int(sys.argv[2]))
+    elif not send(sys.stdin.buffer.read()):
+        sys.exit(1)
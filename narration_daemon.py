@@ -0,0 +1,258 @@
+"""
+Narration Daemon for VoiceBox TTS
+Claude Codeフック用の常駐ナレーションデーモン
+
+フックのたびに python3 / sed / pgrep / say.sh を起動する代わりに、
+常駐プロセスがソケットでフック入力を受け取り、正規化・重複排除・
+音声合成 (keep-alive接続) ・再生を VoiceNavigator のパイプラインで行う。
+
+- Unix domain socket (NARRATOR_SOCKET): narrate_client.py などから利用
+- ループバックTCP (NARRATOR_TCP_PORT): bash の /dev/tcp から fork なしで書き込む用
+
+プロトコル: 接続してフック入力 (JSON またはプレーンテキスト) を書き込み、閉じるだけ。
+Unix domain socket はパーミッション 0600 で本人のみ接続できる。ループバックTCPは
+他のローカルユーザーも接続できるため、起動ごとに生成して NARRATOR_TOKEN_FILE (0600) に
+書き出したトークンを最初の1行で送った接続だけを受け付ける。
+NARRATOR_READ_TIMEOUT_SECONDS 以内に書き込みが終わらない接続は読み上げずに切断する。
+"""
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import threading
+from typing import Optional
+
+from config import (
+    NARRATOR_SOCKET,
+    NARRATOR_TCP_PORT,
+    NARRATOR_TOKEN_FILE,
+    NARRATOR_READ_TIMEOUT_SECONDS,
+    NARRATION_MIN_CHARS,
+    NARRATION_MAX_CHARS
+)
+from text_normalizer import normalize_text
+from voice_navigator import VoiceNavigator, PRIORITY_SYSTEM
+
+# 1メッセージの最大サイズ
+MAX_PAYLOAD_BYTES = 1024 * 1024
+
+
+def extract_hook_message(payload: str) -> str:
+    """フック入力からナレーション対象のテキストを取り出す
+
+    JSONでなければプレーンテキストとして扱う。
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return payload
+
+    if not isinstance(data, dict):
+        return str(data)
+
+    # Try different fields for message content
+    content = (
+        data.get('content', '') or
+        data.get('message', '') or
+        data.get('response', '') or
+        data.get('result', '') or
+        ''
+    )
+
+    # Handle result object
+    if isinstance(content, dict):
+        content = content.get('content', '')
+
+    # Handle output field
+    if not content:
+        content = data.get('output', '')
+
+    return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+
+class _PayloadHandler(socketserver.StreamRequestHandler):
+    """接続ごとの受信処理 (EOFまで読んでデーモンに渡す)"""
+
+    # 接続を開いたまま書き込まないクライアントでハンドラーのスレッドが溜まらないように
+    timeout = NARRATOR_READ_TIMEOUT_SECONDS or None
+
+    def handle(self):
+        token = getattr(self.server, 'token', None)
+        try:
+            if token is not None:
+                line = self.rfile.readline(256).rstrip(b'\r\n')
+                if not hmac.compare_digest(line, token):
+                    self.server.daemon_ref.reject()
+                    return
+            payload = self.rfile.read(MAX_PAYLOAD_BYTES)
+        except socket.timeout:
+            self.server.daemon_ref.timeout()
+            return
+        if payload:
+            self.server.daemon_ref.handle_payload(payload)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128  # フックの連続発火でも connect が失敗しないように
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class NarrationDaemon:
+    """常駐ナレーションデーモン"""
+
+    def __init__(
+        self,
+        socket_path: str = NARRATOR_SOCKET,
+        tcp_port: int = NARRATOR_TCP_PORT,
+        speaker: int = None,
+        navigator: VoiceNavigator = None,
+        token_file: str = NARRATOR_TOKEN_FILE
+    ):
+        self.socket_path = socket_path
+        self.tcp_port = tcp_port
+        self.token_file = token_file
+        self.navigator = navigator or VoiceNavigator(speaker=speaker, verbose=True)
+        self._servers = []
+        self._stopped = threading.Event()
+
+        # 統計カウンター (ハンドラーのスレッドから更新)
+        self._lock = threading.Lock()
+        self.received = 0
+        self.narrated = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reject(self):
+        """トークンが一致しないTCP接続を破棄"""
+        self._count('rejected')
+
+    def timeout(self):
+        """書き込みが時間内に終わらなかった接続を破棄"""
+        self._count('timed_out')
+
+    def handle_payload(self, payload: bytes) -> bool:
+        """フック入力を処理
+
+        Returns:
+            読み上げキューに追加された場合True
+        """
+        self._count('received')
+        text = normalize_text(
+            extract_hook_message(payload.decode('utf-8', errors='replace')),
+            max_length=NARRATION_MAX_CHARS
+        )
+        if len(text) < NARRATION_MIN_CHARS:
+            self._count('skipped')
+            return False
+
+        if self.navigator.speak(text, PRIORITY_SYSTEM):
+            self._count('narrated')
+            return True
+        self._count('skipped')
+        return False
+
+    def _bind_unix(self) -> Optional[_UnixServer]:
+        if not self.socket_path:
+            return None
+
+        # 前回の残骸 (接続できないソケットファイル) は削除
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError(f'Narration daemon already running: {self.socket_path}')
+            finally:
+                probe.close()
+
+        # bind 時点で 0600 にする (bind 後の chmod までの間に他のユーザーが接続できないように)
+        umask = os.umask(0o177)
+        try:
+            return _UnixServer(self.socket_path, _PayloadHandler)
+        finally:
+            os.umask(umask)
+
+    def _write_token(self) -> bytes:
+        """接続用トークンを生成し、本人のみ読めるファイルに書き出す"""
+        token = secrets.token_hex(16)
+        os.makedirs(os.path.dirname(self.token_file) or '.', exist_ok=True)
+        fd = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+            os.write(fd, f'{token}\n'.encode())
+        finally:
+            os.close(fd)
+        return token.encode()
+
+    def _bind_tcp(self) -> Optional[_TCPServer]:
+        if not self.tcp_port:
+            return None
+        server = _TCPServer(('127.0.0.1', self.tcp_port), _PayloadHandler)
+        server.token = self._write_token()
+        return server
+
+    def serve_forever(self):
+        """ソケット待ち受けを開始 (stop() まで戻らない)"""
+        for server in (self._bind_unix(), self._bind_tcp()):
+            if server is None:
+                continue
+            server.daemon_ref = self
+            self._servers.append(server)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # VOICEVOX接続のウォームアップ (起動直後の初回読み上げを速くする)
+        try:
+            self.navigator.voicevox.warmup(self.navigator.synth_workers)
+        except Exception as e:
+            self.navigator.log(f"⚠️ VOICEVOX接続確認失敗: {e}")
+
+        self.navigator.log(
+            f"🔌 ナレーションデーモン待ち受け開始 (socket={self.socket_path}, tcp={self.tcp_port or '-'}, "
+            f"token={self.token_file if self.tcp_port else '-'})"
+        )
+        self._stopped.wait()
+
+    def stop(self):
+        """待ち受けを停止し、残りの読み上げを終えてから終了"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.tcp_port and os.path.exists(self.token_file):
+            os.unlink(self.token_file)
+        self.navigator.shutdown_pipeline()
+        self._stopped.set()
+
+
+if __name__ == '__main__':
+    import sys
+
+    # スピーカー指定（オプション）
+    speaker = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    daemon = NarrationDaemon(speaker=speaker)
+
+    def _handle_signal(signum, frame):
+        threading.Thread(target=daemon.stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    daemon.serve_forever()
@@ -0,0 +1,376 @@
+"""
+Phrase Templates for VoiceBox TTS
+定型ナレーションの音声つなぎ合わせ (フレーズテンプレート)
+
+「タスク{uuid}、開始しました」のような定型文は、固定部分をスピーカーごとに
+一度だけ合成してキャッシュし、可変部分 (タスクID・数値) だけを
+文字・数詞単位のキャッシュから組み立て、短いクロスフェードでPCMを連結する。
+テンプレートに一致しない文は None を返し、呼び出し側が通常の合成を行う。
+
+    タスク | a | b | 1 | 2 | … | (無音) | 開始しました
+    ~~~~~~   ~~~~~~~~~~~~~~~~   ~~~~~~   ~~~~~~~~~~~~
+    固定      文字キャッシュ       句読点    固定
+
+断片は prePhonemeLength / postPhonemeLength = 0 で合成するため、
+断片の境界はモーラ境界になる。
+"""
+import io
+import re
+import sys
+import threading
+import wave
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from config import PHRASE_CROSSFADE_MS, PHRASE_CACHE_SIZE
+from voicevox_client import VoicevoxClient
+
+# 句読点は合成せず無音に置き換える (秒)
+PAUSE_SECONDS = {'、': 0.15, '。': 0.3}
+
+# 文頭・文末の無音 (VOICEVOXの prePhonemeLength / postPhonemeLength 既定値)
+EDGE_SILENCE_SECONDS = 0.1
+
+# 数詞
+_DIGITS = '〇一二三四五六七八九'
+_PLACES = ((1000, '千'), (100, '百'), (10, '十'))
+_GROUPS = ('', '万', '億', '兆')
+MAX_NUMBER = 10 ** 16 - 1
+
+_SLOT_RE = re.compile(r'\{(\w+)\}')
+_PAUSE_RE = re.compile('([' + ''.join(PAUSE_SECONDS) + '])')
+
+# スロット種別ごとの正規表現
+_SLOT_PATTERNS = {
+    'chars': r'[0-9A-Za-z]+',
+    'number': r'\d+',
+}
+
+
+def number_units(value: int, counter: str = '') -> List[str]:
+    """数値を合成単位 (位ごとの数詞) に分解
+
+    連濁・促音化 (三百 → さんびゃく、六百 → ろっぴゃく、一件 → いっけん) を
+    正しく読ませるため、数字と位、最後の単位と助数詞はまとめて1単位にする。
+
+    >>> number_units(1234)
+    ['千', '二百', '三十', '四']
+    >>> number_units(30000, '件')
+    ['三万件']
+    """
+    if value == 0:
+        return ['ゼロ' + counter]
+
+    units = []
+    for index in range(len(_GROUPS) - 1, -1, -1):
+        group = value // 10 ** (4 * index) % 10000
+        if not group:
+            continue
+
+        group_units = []
+        for place, name in _PLACES:
+            digit = group // place % 10
+            if digit:
+                group_units.append(('' if digit == 1 else _DIGITS[digit]) + name)
+        if group % 10:
+            group_units.append(_DIGITS[group % 10])
+        group_units[-1] += _GROUPS[index]
+        units.extend(group_units)
+
+    units[-1] += counter
+    return units
+
+
+class _Slot:
+    """可変部分"""
+
+    __slots__ = ('name', 'kind', 'counter')
+
+    def __init__(self, name: str, kind: str, counter: str = ''):
+        self.name = name
+        self.kind = kind
+        self.counter = counter
+
+
+class _Pause:
+    """句読点の無音"""
+
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+
+# テンプレートの構成要素 (固定フレーズは文字列)
+Segment = Union[str, _Slot, _Pause]
+
+
+class PhraseTemplate:
+    """フレーズテンプレート
+
+    Args:
+        template: "タスク{uuid}、開始しました" 形式の定型文
+        **slots: スロット名 → 種別
+            'chars'       英数字を1文字ずつ読む (タスクIDなど)
+            'number'      整数を数詞で読む
+            'number:件'   助数詞付きの整数 (テンプレート側の直後の助数詞と一緒に合成)
+    """
+
+    def __init__(self, template: str, **slots: str):
+        self.template = template
+        self.segments: List[Segment] = []
+
+        pattern = []
+        position = 0
+        for match in _SLOT_RE.finditer(template):
+            literal = template[position:match.start()]
+            position = match.end()
+
+            name = match.group(1)
+            kind, _, counter = slots[name].partition(':')
+            if counter:
+                # 助数詞は直後の固定部分から取り除き、数詞と一緒に合成する
+                rest = template[position:]
+                if not rest.startswith(counter):
+                    raise ValueError(f'counter {counter!r} must follow {{{name}}} in {template!r}')
+                position += len(counter)
+
+            self._add_literal(literal)
+            self.segments.append(_Slot(name, kind, counter))
+            pattern.append(re.escape(literal))
+            pattern.append(f'(?P<{name}>{_SLOT_PATTERNS[kind]})' + re.escape(counter))
+
+        literal = template[position:]
+        self._add_literal(literal)
+        pattern.append(re.escape(literal))
+        self.regex = re.compile(''.join(pattern) + '$')
+
+    def _add_literal(self, literal: str):
+        for part in _PAUSE_RE.split(literal):
+            if not part:
+                continue
+            if part in PAUSE_SECONDS:
+                self.segments.append(_Pause(PAUSE_SECONDS[part]))
+            else:
+                self.segments.append(part)
+
+    @property
+    def fixed_phrases(self) -> List[str]:
+        """事前合成する固定フレーズ"""
+        return [segment for segment in self.segments if isinstance(segment, str)]
+
+    def match(self, text: str) -> Optional[Dict[str, str]]:
+        match = self.regex.match(text)
+        return match.groupdict() if match else None
+
+    def units(self, values: Dict[str, str]) -> Optional[List[Union[str, _Pause]]]:
+        """合成単位の列に展開 (数値が範囲外なら None)"""
+        units: List[Union[str, _Pause]] = []
+        for segment in self.segments:
+            if not isinstance(segment, _Slot):
+                units.append(segment)
+                continue
+
+            value = values[segment.name]
+            if segment.kind == 'chars':
+                units.extend(value.lower())
+            else:
+                number = int(value)
+                if number > MAX_NUMBER:
+                    return None
+                units.extend(number_units(number, segment.counter))
+        return units
+
+
+# VoiceNavigator.describe_task_event / COALESCE_TEMPLATES の定型文 (normalize_text 後)
+NAVIGATOR_TEMPLATES = (
+    PhraseTemplate('タスク{uuid}、開始しました', uuid='chars'),
+    PhraseTemplate('タスク{uuid}、完了しました', uuid='chars'),
+    PhraseTemplate('タスク{uuid}、完了しました。ファイルサイズ{size}キロバイト', uuid='chars', size='number'),
+    PhraseTemplate('{count}件のタスクを受信しました', count='number:件'),
+    PhraseTemplate('{count}件のタスクを開始しました', count='number:件'),
+    PhraseTemplate('{count}件のタスクが完了しました', count='number:件'),
+    PhraseTemplate('{count}件のタスクでエラーが発生しました', count='number:件'),
+)
+
+
+def _read_pcm(wav_bytes: bytes) -> Tuple[Tuple[int, int, int], array]:
+    """WAVから (チャンネル数, サンプル幅, サンプルレート) と16bit PCMを取り出す"""
+    with wave.open(io.BytesIO(wav_bytes), 'rb') as w:
+        params = (w.getnchannels(), w.getsampwidth(), w.getframerate())
+        frames = w.readframes(w.getnframes())
+    if params[1] != 2:
+        raise ValueError(f'unsupported sample width: {params[1]}')
+
+    pcm = array('h')
+    pcm.frombytes(frames)
+    if sys.byteorder == 'big':
+        pcm.byteswap()
+    return params, pcm
+
+
+def _write_wav(params: Tuple[int, int, int], pcm: array) -> bytes:
+    if sys.byteorder == 'big':
+        pcm = array('h', pcm)
+        pcm.byteswap()
+
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(params[0])
+        w.setsampwidth(params[1])
+        w.setframerate(params[2])
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def splice(pieces: List[Union[array, int]], crossfade: int) -> array:
+    """PCM断片を連結 (音声同士の境界は crossfade サンプルの線形クロスフェード)
+
+    Args:
+        pieces: PCM (array('h')) または無音のサンプル数 (int)
+        crossfade: クロスフェード長 (サンプル数)
+    """
+    out = array('h')
+    previous_voiced = False
+    for piece in pieces:
+        if isinstance(piece, int):
+            out.extend(array('h', bytes(2 * piece)))
+            previous_voiced = False
+            continue
+
+        overlap = min(crossfade, len(out), len(piece)) if previous_voiced else 0
+        base = len(out) - overlap
+        for i in range(overlap):
+            weight = (i + 1) / (overlap + 1)
+            out[base + i] = int(out[base + i] * (1 - weight) + piece[i] * weight)
+        out.extend(piece[overlap:] if overlap else piece)
+        previous_voiced = True
+    return out
+
+
+class PhraseSynthesizer:
+    """フレーズテンプレートによる音声合成
+
+    断片 (固定フレーズ・文字・数詞) は (スピーカー, テキスト) ごとにLRUキャッシュする。
+    スレッドセーフ (同じ断片の同時合成は重複しても結果は同じ)。
+    """
+
+    def __init__(
+        self,
+        voicevox: VoicevoxClient,
+        templates=NAVIGATOR_TEMPLATES,
+        crossfade_ms: float = PHRASE_CROSSFADE_MS,
+        cache_size: int = PHRASE_CACHE_SIZE
+    ):
+        self.voicevox = voicevox
+        self.templates = tuple(templates)
+        self.crossfade_ms = crossfade_ms
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[int, str], Tuple[Tuple[int, int, int], array]]" = OrderedDict()
+
+        # 統計カウンター
+        self.rendered = 0
+        self.fallbacks = 0
+        self.fragment_hits = 0
+        self.fragment_synths = 0
+
+    def _fragment(self, text: str, speaker: int) -> Tuple[Tuple[int, int, int], array]:
+        """断片のPCMを取得 (キャッシュになければ前後の無音なしで合成)"""
+        key = (speaker, text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.fragment_hits += 1
+                return cached
+
+        query = self.voicevox.audio_query(text, speaker)
+        query['prePhonemeLength'] = 0.0
+        query['postPhonemeLength'] = 0.0
+        fragment = _read_pcm(self.voicevox.synthesis(query, speaker))
+
+        with self._lock:
+            self.fragment_synths += 1
+            self._cache[key] = fragment
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return fragment
+
+    def warmup(self, speaker: int):
+        """全テンプレートの固定フレーズを事前合成"""
+        for template in self.templates:
+            for phrase in template.fixed_phrases:
+                self._fragment(phrase, speaker)
+
+    def render(self, text: str, speaker: int) -> Optional[bytes]:
+        """テンプレートに一致すれば断片を連結したWAVを返す (一致しなければ None)"""
+        for template in self.templates:
+            values = template.match(text)
+            if values is None:
+                continue
+            units = template.units(values)
+            if units is None:
+                break
+
+            pieces: List[Union[array, int]] = []
+            params = None
+            for unit in units:
+                if isinstance(unit, _Pause):
+                    pieces.append(unit)
+                    continue
+                fragment_params, pcm = self._fragment(unit, speaker)
+                if params is None:
+                    params = fragment_params
+                elif fragment_params != params:
+                    break  # 断片の形式が揃わない場合は通常合成
+                pieces.append(pcm)
+            else:
+                if params is None:
+                    break
+                channels, _, rate = params
+                edge = int(EDGE_SILENCE_SECONDS * rate) * channels
+                samples = [
+                    int(piece.seconds * rate) * channels if isinstance(piece, _Pause) else piece
+                    for piece in pieces
+                ]
+                crossfade = int(self.crossfade_ms / 1000 * rate) * channels
+                pcm = splice([edge] + samples + [edge], crossfade)
+                with self._lock:
+                    self.rendered += 1
+                return _write_wav(params, pcm)
+            break
+
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def get_stats(self) -> dict:
+        """統計情報取得"""
+        with self._lock:
+            return {
+                'rendered': self.rendered,
+                'fallbacks': self.fallbacks,
+                'fragment_hits': self.fragment_hits,
+                'fragment_synths': self.fragment_synths,
+                'cached_fragments': len(self._cache),
+            }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Phrase template synthesis')
+    parser.add_argument('text', help='読み上げテキスト (テンプレートに一致するもの)')
+    parser.add_argument('--speaker', type=int, default=1)
+    parser.add_argument('--output', default='phrase.wav')
+    args = parser.parse_args()
+
+    synthesizer = PhraseSynthesizer(VoicevoxClient())
+    wav_bytes = synthesizer.render(args.text, args.speaker)
+    if wav_bytes is None:
+        sys.exit('No template matched')
+    with open(args.output, 'wb') as f:
+        f.write(wav_bytes)
+    print(f'{args.output}: {len(wav_bytes)} bytes {synthesizer.get_stats()}')
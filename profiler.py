@@ -0,0 +1,297 @@
+"""
+Sampling Profiler for VoiceBox TTS
+稼働中のワーカー・APIプロセスのオンデマンド・サンプリングプロファイラ
+
+再起動せずに、指定秒数または次のNタスクの間だけ全スレッドのスタックを
+一定間隔 (PROFILE_INTERVAL_MS) で sys._current_frames() から採取し、
+終了時に PROFILE_DIR へ以下を書き出す。
+- <name>-<pid>-<時刻>.collapsed  折りたたみスタック (flamegraph.pl / speedscope 用)
+- <name>-<pid>-<時刻>.txt        関数ごとのサンプル数 (self / total)
+
+無効時はサンプリング用のスレッドが存在せず、タスクごとのコストは属性1つの参照のみ。
+待機中のスレッド (プールの空きスレッド・ブローカーのイベントループなど) を除くため、
+既定ではこのリポジトリのコードを含むスタックのみ集計する。
+
+起動方法:
+- APIサーバー:  POST /admin/profile (X-Admin-Token)
+- ワーカー:     celery -A celery_worker control voicebox_profile [seconds] [tasks]
+                (prefork の場合は各子プロセスにシグナルで転送)
+- 任意のプロセス: kill -USR2 <pid>  (PROFILE_SECONDS 秒)
+
+Usage:
+    python profiler.py --seconds 10 narrate_client.py "テスト"
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SECONDS, PROFILE_MAX_SECONDS, PROFILE_SIGNAL
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SamplingProfiler:
+    """サンプリングプロファイラ (プロセスごとに1つ)
+
+    Args:
+        name: 出力ファイル名の接頭辞 (celery / api_server など)
+        output_dir: 出力ディレクトリ
+        interval_ms: サンプリング間隔
+        app_only: このリポジトリのコードを含むスタックのみ集計する
+    """
+
+    def __init__(
+        self,
+        name: str = 'process',
+        output_dir: str = PROFILE_DIR,
+        interval_ms: float = PROFILE_INTERVAL_MS,
+        app_only: bool = True
+    ):
+        self.name = name
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000
+        self.app_only = app_only
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # 残りタスク数 (0 = タスク数で止めない)、無効時の判定にも使う
+        self._tasks_left = 0
+        self._started_at: Optional[float] = None
+        self._deadline: Optional[float] = None
+        self._labels: Dict[object, str] = {}
+        self.last_output: Optional[Dict[str, str]] = None
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self, seconds: Optional[float] = PROFILE_SECONDS, tasks: int = 0) -> bool:
+        """プロファイリング開始
+
+        Args:
+            seconds: 最大秒数 (PROFILE_MAX_SECONDS で制限)
+            tasks: 次のNタスクの完了で終了 (0 = 秒数のみ)
+
+        Returns:
+            開始した場合 True (実行中の場合 False)
+        """
+        seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stop.clear()
+            self._tasks_left = max(tasks, 0)
+            self._started_at = time.time()
+            self._deadline = time.monotonic() + seconds
+            self._thread = threading.Thread(target=self._run, name='voicebox-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, wait: bool = True) -> Optional[Dict[str, str]]:
+        """プロファイリングを終了し、出力ファイルのパスを返す"""
+        thread = self._thread
+        if thread is None:
+            return self.last_output
+        self._stop.set()
+        if wait and thread is not threading.current_thread():
+            thread.join()
+        return self.last_output
+
+    def task_finished(self):
+        """タスク完了の通知 (タスク数指定時のみカウント)"""
+        if not self._tasks_left:
+            return
+        with self._lock:
+            if self._tasks_left:
+                self._tasks_left -= 1
+                if not self._tasks_left:
+                    self._stop.set()
+
+    def status(self) -> dict:
+        """実行状態"""
+        with self._lock:
+            return {
+                'active': self._thread is not None,
+                'pid': os.getpid(),
+                'started_at': self._started_at if self._thread is not None else None,
+                'remaining_seconds': max(self._deadline - time.monotonic(), 0) if self._thread else None,
+                'remaining_tasks': self._tasks_left or None,
+                'last_output': self.last_output,
+            }
+
+    # ------------------------------------------------------------------
+    # サンプリング
+    # ------------------------------------------------------------------
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            if path.startswith(_REPO_DIR):
+                path = os.path.relpath(path, _REPO_DIR)
+            else:
+                path = os.path.basename(path)
+            # collapsed 形式の区切り文字を含めない
+            label = f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+            self._labels[code] = label
+        return label
+
+    def _sample(self, own: int, stacks: Counter) -> int:
+        """全スレッドのスタックを1回採取し、集計対象外のスレッド数を返す"""
+        skipped = 0
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            codes = []
+            in_app = not self.app_only
+            while frame is not None:
+                code = frame.f_code
+                codes.append(code)
+                if not in_app and code.co_filename.startswith(_REPO_DIR) and code.co_filename != __file__:
+                    in_app = True
+                frame = frame.f_back
+            if in_app:
+                codes.reverse()
+                stacks[tuple(codes)] += 1
+            else:
+                skipped += 1
+        return skipped
+
+    def _run(self):
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = skipped = 0
+        try:
+            while not self._stop.is_set() and time.monotonic() < self._deadline:
+                skipped += self._sample(own, stacks)
+                samples += 1
+                self._stop.wait(self.interval)
+            self.last_output = self._write(stacks, samples, skipped)
+        finally:
+            with self._lock:
+                self._thread = None
+                self._tasks_left = 0
+
+    # ------------------------------------------------------------------
+    # 出力
+    # ------------------------------------------------------------------
+
+    def _function_table(self, stacks: Counter) -> List[Tuple[str, int, int]]:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for codes, count in stacks.items():
+            self_counts[codes[-1]] += count
+            for code in set(codes):
+                total_counts[code] += count
+        rows = [(self._label(code), self_counts[code], total) for code, total in total_counts.items()]
+        rows.sort(key=lambda row: (row[1], row[2]), reverse=True)
+        return rows
+
+    def _write(self, stacks: Counter, samples: int, skipped: int) -> Dict[str, str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started_at))
+        base = os.path.join(self.output_dir, f'{self.name}-{os.getpid()}-{stamp}')
+        elapsed = time.time() - self._started_at
+
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for codes, count in stacks.most_common():
+                f.write(';'.join(self._label(code) for code in codes))
+                f.write(f' {count}\n')
+
+        stack_samples = sum(stacks.values()) or 1
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(f'# {self.name} pid={os.getpid()} {elapsed:.1f}s '
+                    f'interval={self.interval * 1000:g}ms samples={samples} '
+                    f'stacks={sum(stacks.values())} skipped_threads={skipped}\n')
+            f.write(f"{'self':>8} {'self%':>7} {'total':>8} {'total%':>7}  function\n")
+            for label, self_count, total in self._function_table(stacks):
+                f.write(f'{self_count:>8} {self_count / stack_samples:>7.1%} '
+                        f'{total:>8} {total / stack_samples:>7.1%}  {label}\n')
+
+        return {'collapsed': base + '.collapsed', 'table': base + '.txt'}
+
+
+# ----------------------------------------------------------------------
+# シグナル (prefork の子プロセスなど、HTTP・制御コマンドが届かないプロセス用)
+# ----------------------------------------------------------------------
+
+def request_path(pid: int) -> str:
+    """シグナルと一緒に渡すパラメータファイル"""
+    return os.path.join(PROFILE_DIR, f'.request-{pid}.json')
+
+
+def _on_signal(signum, frame):
+    # シグナルハンドラ内ではロックを取らない (メインスレッドが保持中の可能性)
+    def start():
+        params = {}
+        try:
+            with open(request_path(os.getpid()), encoding='utf-8') as f:
+                params = json.load(f)
+            os.unlink(request_path(os.getpid()))
+        except (OSError, ValueError):
+            pass
+        get_profiler().start(params.get('seconds', PROFILE_SECONDS), params.get('tasks', 0))
+
+    threading.Thread(target=start, daemon=True).start()
+
+
+def install_signal_handler():
+    """PROFILE_SIGNAL でプロファイリングを開始するハンドラを登録 (メインスレッドのみ)"""
+    if not PROFILE_SIGNAL or threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        signal.signal(getattr(signal, PROFILE_SIGNAL), _on_signal)
+    except (AttributeError, ValueError, OSError):
+        pass
+
+
+def signal_process(pid: int, seconds: float = PROFILE_SECONDS, tasks: int = 0):
+    """他のプロセスにパラメータ付きでプロファイリング開始のシグナルを送る"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(request_path(pid), 'w', encoding='utf-8') as f:
+        json.dump({'seconds': seconds, 'tasks': tasks}, f)
+    os.kill(pid, getattr(signal, PROFILE_SIGNAL or 'SIGUSR2'))
+
+
+# グローバルインスタンス
+_profiler: Optional[SamplingProfiler] = None
+
+
+def get_profiler() -> SamplingProfiler:
+    """プロセスのプロファイラ (出力ファイル名は実行コマンド名: celery / api_server など)"""
+    global _profiler
+    if _profiler is None:
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        if name == '__main__':
+            # python -m celery など → パッケージ名
+            name = os.path.basename(os.path.dirname(sys.argv[0]))
+        _profiler = SamplingProfiler(name or 'process')
+    return _profiler
+
+
+if __name__ == '__main__':
+    import argparse
+    import runpy
+
+    parser = argparse.ArgumentParser(description='VoiceBox sampling profiler')
+    parser.add_argument('--seconds', type=float, default=PROFILE_SECONDS)
+    parser.add_argument('--all-threads', action='store_true', help='待機中のスレッドも集計')
+    parser.add_argument('script', help='実行するスクリプト')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    profiler = SamplingProfiler(
+        os.path.splitext(os.path.basename(args.script))[0], app_only=not args.all_threads
+    )
+    sys.argv = [args.script] + args.args
+    profiler.start(args.seconds)
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    finally:
+        print(json.dumps(profiler.stop(), ensure_ascii=False), file=sys.stderr)
@@ -0,0 +1,215 @@
+"""
+Rate Limiter for VoiceBox TTS
+トークンバケット方式のレート制限
+
+- TokenBucket: プロセス内のトークンバケット (ボイスナビゲーターの読み上げ頻度など)
+- ClientQuota: POST /tts のクライアントごとのクォータ (Redisで複数APIプロセス間共有)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from config import CELERY_BROKER_URL, CLIENT_QUOTA_RATE, CLIENT_QUOTA_BURST, CLIENT_QUOTAS
+
+# 残量・最終補充時刻を読み、補充してから取得 (複数APIプロセスからの同時アクセスをアトミックにする)
+# 戻り値は取得できるまでの待ち時間 (秒、0 = 取得済み)
+_ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(ARGV[4])
+local state = redis.call('hmget', KEYS[1], 't', 'ts')
+local available = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+available = math.min(capacity, available + math.max(now - last, 0) * rate)
+local wait = 0
+if available >= tokens then
+    available = available - tokens
+else
+    wait = (tokens - available) / rate
+end
+redis.call('hset', KEYS[1], 't', tostring(available), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+# プロセス内で保持するクライアント数の上限 (古いものから破棄)
+_MAX_LOCAL_CLIENTS = 10000
+
+
+class TokenBucket:
+    """トークンバケット
+
+    rate トークン/秒で補充され、最大 capacity まで貯まる。
+    バースト時は capacity 件まで即時に通し、以降は rate に制限する。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self, now: float):
+        elapsed = now - self._last
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """トークンを取得 (不足時は即座に False)"""
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """トークンが貯まるまでの待ち時間 (秒)"""
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            missing = tokens - self._tokens
+            if missing <= 0:
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return missing / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """トークンを取得 (不足時は待機)
+
+        Returns:
+            timeout 内に取得できれば True
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            wait = self.wait_time(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(wait)
+
+
+class ClientQuota:
+    """クライアントごとのトークンバケット (POST /tts のクォータ)
+
+    Args:
+        rate: 既定の補充レート (リクエスト/秒、0 = 無制限)
+        capacity: 既定のバースト許容数
+        overrides: クライアントごとの (rate, capacity)
+        redis_client: 共有に使うRedis (None またはRedisエラー時はプロセス内)
+        namespace: キーの名前空間
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        overrides: Optional[Dict[str, Tuple[float, float]]] = None,
+        redis_client=None,
+        namespace: str = 'tts'
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.overrides = overrides or {}
+        self.redis_client = redis_client
+        self.prefix = f'voicebox:quota:{namespace}:'
+
+        self._lock = threading.Lock()
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        # クライアントごとの [受付数, 拒否数] (バケットと同じ上限で古いものから破棄)
+        self._counts: 'OrderedDict[str, List[int]]' = OrderedDict()
+
+        if redis_client is not None:
+            self._acquire = redis_client.register_script(_ACQUIRE_SCRIPT)
+
+    def limits(self, client: str) -> Tuple[float, float]:
+        """クライアントの (rate, capacity)"""
+        return self.overrides.get(client, (self.rate, self.capacity))
+
+    def try_acquire(self, client: str, tokens: float = 1) -> float:
+        """トークンを取得し、不足時は再試行までの秒数を返す (0 = 取得済み)"""
+        rate, capacity = self.limits(client)
+        wait = 0.0 if rate <= 0 else None
+        if wait is None and self.redis_client is not None:
+            try:
+                # バケットが満杯に戻るまで保持
+                ttl_ms = int(capacity / rate * 1000) + 1000
+                wait = float(self._acquire(
+                    keys=[f'{self.prefix}{client}'], args=[rate, capacity, time.time(), tokens, ttl_ms]
+                ))
+            except redis.RedisError:
+                pass
+        if wait is None:
+            bucket = self._local_bucket(client, rate, capacity)
+            wait = 0.0 if bucket.try_acquire(tokens) else bucket.wait_time(tokens)
+
+        with self._lock:
+            counts = self._counts.get(client)
+            if counts is None:
+                counts = self._counts[client] = [0, 0]
+                if len(self._counts) > _MAX_LOCAL_CLIENTS:
+                    self._counts.popitem(last=False)
+            else:
+                self._counts.move_to_end(client)
+            counts[1 if wait else 0] += 1
+        return wait
+
+    def _local_bucket(self, client: str, rate: float, capacity: float) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(rate, capacity)
+                if len(self._buckets) > _MAX_LOCAL_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket
+
+    def get_stats(self) -> Dict:
+        """統計情報取得 (このプロセスでの受付・拒否数、直近 _MAX_LOCAL_CLIENTS クライアント分)"""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.capacity,
+                'clients': {
+                    client: {
+                        'accepted': accepted,
+                        'rejected': rejected,
+                        'rate': self.limits(client)[0],
+                        'burst': self.limits(client)[1],
+                    }
+                    for client, (accepted, rejected) in sorted(self._counts.items())
+                },
+            }
+
+
+def _parse_quota(value: str) -> Tuple[float, float]:
+    """"rate:burst" (burst 省略時は CLIENT_QUOTA_BURST)"""
+    rate, _, burst = value.partition(':')
+    return float(rate), float(burst) if burst else CLIENT_QUOTA_BURST
+
+
+# グローバルインスタンス
+_client_quota: Optional[ClientQuota] = None
+
+
+def get_client_quota() -> Optional[ClientQuota]:
+    """POST /tts のクォータ (CLIENT_QUOTA_RATE=0 かつ CLIENT_QUOTAS 未設定の場合 None)"""
+    global _client_quota
+    if _client_quota is None and (CLIENT_QUOTA_RATE > 0 or CLIENT_QUOTAS):
+        _client_quota = ClientQuota(
+            CLIENT_QUOTA_RATE,
+            CLIENT_QUOTA_BURST,
+            {client: _parse_quota(value) for client, value in CLIENT_QUOTAS.items()},
+            redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None
+        )
+    return _client_quota
@@ -0,0 +1,238 @@
+"""
+Retention Manager for VoiceBox TTS
+音声ファイル・タスク結果の保持ポリシー管理
+
+scripts/cleanup.sh のディレクトリ走査 (find / ls -t) の代わりに、
+SQLiteインデックスのファイル数・合計サイズの集計と作成時刻のインデックスを使い、
+新規ファイルごとに償却 O(1) 件の削除でポリシーを維持する。
+集計と削除は共有インデックス上の1トランザクションで行うため、
+複数のワーカープロセスがあっても全体で上限が守られる。
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import redis
+
+from config import (
+    CELERY_RESULT_BACKEND,
+    RETENTION_MAX_BYTES,
+    RETENTION_MAX_AGE_DAYS,
+    RETENTION_MAX_FILES,
+    RETENTION_UNLINK_BATCH,
+)
+from serializers import loads as load_result
+from storage import AudioStorage, StoredAudio, get_audio_storage
+
+# Celery Redisバックエンドの結果キー
+RESULT_KEY_PREFIX = 'celery-task-meta-'
+
+
+class RetentionManager:
+    """保持ポリシー管理
+
+    - 容量上限 (max_bytes)、保持期間 (max_age_seconds)、ファイル数上限 (max_files)
+    - 削除したタスクの結果キーはパイプラインでまとめて UNLINK
+    - 0 を指定したポリシーは無効
+    """
+
+    def __init__(
+        self,
+        storage: AudioStorage = None,
+        redis_client=None,
+        max_bytes: int = RETENTION_MAX_BYTES,
+        max_age_seconds: float = RETENTION_MAX_AGE_DAYS * 86400,
+        max_files: int = RETENTION_MAX_FILES,
+        unlink_batch: int = RETENTION_UNLINK_BATCH,
+    ):
+        self.storage = storage or get_audio_storage()
+        self.redis_client = redis_client
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.max_files = max_files
+        self.unlink_batch = unlink_batch
+
+        self._lock = threading.Lock()
+        self._pending_keys: List[str] = []
+
+        # 統計カウンター
+        self.files_evicted = 0
+        self.bytes_evicted = 0
+        self.keys_unlinked = 0
+
+    def load(self) -> int:
+        """シャーディング導入前の直下のファイルをインデックスに取り込む (起動時のみ)
+
+        Returns:
+            取り込んだファイル数
+        """
+        return self.storage.import_legacy()
+
+    def track(self, stored: StoredAudio):
+        """新規ファイル (storage.save で登録済み) の保存後にポリシーを適用"""
+        self.enforce()
+
+    def enforce(self, now: Optional[float] = None) -> int:
+        """ポリシーを適用 (古い順に削除)
+
+        Returns:
+            削除したファイル数
+        """
+        now = now or time.time()
+        victims = self.storage.evict(
+            max_bytes=self.max_bytes,
+            max_files=self.max_files,
+            created_before=now - self.max_age_seconds if self.max_age_seconds else None
+        )
+        if victims:
+            with self._lock:
+                self.files_evicted += len(victims)
+                self.bytes_evicted += sum(stored.size for stored in victims)
+                self._pending_keys.extend(f'{RESULT_KEY_PREFIX}{stored.task_id}' for stored in victims)
+        self.flush()
+        return len(victims)
+
+    def flush(self):
+        """保留中の結果キーをパイプライン UNLINK で削除"""
+        with self._lock:
+            keys, self._pending_keys = self._pending_keys, []
+        if keys and self.redis_client is not None:
+            self.keys_unlinked += self._unlink(keys)
+
+    def _unlink(self, keys: List[str]) -> int:
+        """キーをバッチ単位でパイプライン UNLINK"""
+        unlinked = 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for i in range(0, len(keys), self.unlink_batch):
+            pipe.unlink(*keys[i:i + self.unlink_batch])
+        for count in pipe.execute():
+            unlinked += count
+        return unlinked
+
+    def expire_results(self, now: Optional[float] = None) -> int:
+        """保持期間 (max_age_seconds) より前に完了したタスクの結果キーを削除
+
+        実行中・完了直後のタスクの結果はポーリング中のクライアントが読むため残す。
+        date_done のない結果 (実行中など) と読めない結果も残す。
+
+        Returns:
+            削除したキー数
+        """
+        if self.redis_client is None or not self.max_age_seconds:
+            return 0
+
+        cutoff = (now or time.time()) - self.max_age_seconds
+        unlinked = 0
+        batch = []
+        for key in self.redis_client.scan_iter(match=f'{RESULT_KEY_PREFIX}*', count=self.unlink_batch):
+            batch.append(key)
+            if len(batch) >= self.unlink_batch:
+                unlinked += self._unlink_expired(batch, cutoff)
+                batch = []
+        if batch:
+            unlinked += self._unlink_expired(batch, cutoff)
+        self.keys_unlinked += unlinked
+        return unlinked
+
+    def _unlink_expired(self, keys: List, cutoff: float) -> int:
+        """keys のうち cutoff より前に完了した結果を UNLINK"""
+        expired = [
+            key for key, value in zip(keys, self.redis_client.mget(keys))
+            if value is not None and _done_before(value, cutoff)
+        ]
+        return self._unlink(expired) if expired else 0
+
+    def purge_results(self, pattern: str = f'{RESULT_KEY_PREFIX}*') -> int:
+        """結果キーを一括削除 (SCAN + パイプライン UNLINK、件数上限なし)
+
+        実行中・完了直後のタスクの結果も消えるため、手動の --purge-results でのみ使う。
+        """
+        if self.redis_client is None:
+            return 0
+
+        unlinked = 0
+        batch = []
+        for key in self.redis_client.scan_iter(match=pattern, count=self.unlink_batch):
+            batch.append(key)
+            if len(batch) >= self.unlink_batch:
+                unlinked += self._unlink(batch)
+                batch = []
+        if batch:
+            unlinked += self._unlink(batch)
+        self.keys_unlinked += unlinked
+        return unlinked
+
+    def run_forever(self, interval: float = 60.0):
+        """保持期間ポリシーを定期適用 (新規ファイルがなくても期限切れを削除)"""
+        while True:
+            self.enforce()
+            time.sleep(interval)
+
+    def get_stats(self) -> dict:
+        """統計情報取得"""
+        oldest = next(self.storage.iter_oldest(limit=1), None)
+        with self._lock:
+            return {
+                **self.storage.stats(),
+                'oldest_created': oldest.created if oldest else None,
+                'files_evicted': self.files_evicted,
+                'bytes_evicted': self.bytes_evicted,
+                'keys_unlinked': self.keys_unlinked,
+            }
+
+
+def _done_before(value: bytes, cutoff: float) -> bool:
+    """結果の date_done が cutoff (UNIX時刻) より前か"""
+    try:
+        date_done = load_result(value).get('date_done')
+        if not date_done:
+            return False
+        done = datetime.fromisoformat(date_done)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    if done.tzinfo is None:
+        # Celery は UTC の naive な時刻で保存する
+        done = done.replace(tzinfo=timezone.utc)
+    return done.timestamp() < cutoff
+
+
+# グローバルインスタンス
+_retention_manager: Optional[RetentionManager] = None
+
+
+def get_retention_manager() -> RetentionManager:
+    global _retention_manager
+    if _retention_manager is None:
+        # Redis以外の結果バックエンドでは結果キーの削除は行わない
+        _retention_manager = RetentionManager(
+            redis_client=(
+                redis.from_url(CELERY_RESULT_BACKEND)
+                if CELERY_RESULT_BACKEND.startswith('redis') else None
+            )
+        )
+        _retention_manager.load()
+    return _retention_manager
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='VoiceBox retention manager')
+    parser.add_argument('--daemon', action='store_true', help='ポリシーを定期適用し続ける')
+    parser.add_argument('--interval', type=float, default=60.0, help='デーモン時の適用間隔 (秒)')
+    parser.add_argument('--purge-results', action='store_true',
+                        help='Redisの結果キーを全削除 (実行中のタスクの結果も消える。手動でのみ使う)')
+    args = parser.parse_args()
+
+    manager = get_retention_manager()
+    if args.daemon:
+        manager.run_forever(args.interval)
+    else:
+        manager.enforce()
+        if args.purge_results:
+            manager.purge_results()
+        else:
+            manager.expire_results()
+        print(json.dumps(manager.get_stats()))
@@ -1,34 +1,29 @@
 #!/bin/bash
 # VoiceBox Auto-Cleanup Script
 # 古い音声ファイルとRedisキャッシュを自動クリーンアップ
+#
+# 保持ポリシーはワーカー内の RetentionManager (retention.py) が逐次適用する。
+# このスクリプトはワーカー停止中などの取りこぼしを一括で処理する。
+#   RETENTION_MAX_AGE_DAYS (default: 7)   - 保持期間
+#   RETENTION_MAX_FILES    (default: 100) - 最大ファイル数
+#   RETENTION_MAX_BYTES    (default: 512MB) - 最大容量
 
 set -e
 
-VOICEBOX_DIR="${HOME}/voicebox"
-DAYS_TO_KEEP=7  # 7日以内のファイルは保持
-MAX_FILES=100   # 最大100ファイルまで保持
+PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] VoiceBox cleanup started"
 
-# 1. 古い音声ファイルの削除
-echo "Cleaning audio files older than ${DAYS_TO_KEEP} days..."
-find "$VOICEBOX_DIR" -name "task_*.wav" -mtime +$DAYS_TO_KEEP -delete 2>/dev/null || true
+# 音声ファイル削除 (インデックス順) + 保持期間を過ぎた結果キーの削除 (SCAN + UNLINK)
+# 実行中・完了直後のタスクの結果は残す (全削除は手動で retention.py --purge-results)
+cd "$PROJECT_ROOT"
+REPORT=$(python3 retention.py)
 
-# 2. ファイル数制限（古い順に削除）
-FILE_COUNT=$(ls "$VOICEBOX_DIR"/task_*.wav 2>/dev/null | wc -l)
-if [ $FILE_COUNT -gt $MAX_FILES ]; then
-    echo "Too many files ($FILE_COUNT). Keeping latest $MAX_FILES..."
-    ls -t "$VOICEBOX_DIR"/task_*.wav | tail -n +$(($MAX_FILES + 1)) | xargs rm -f 2>/dev/null || true
-fi
+echo "Cleanup completed: $REPORT"
 
-# 3. Redisキャッシュのクリア（古いタスク結果）
-echo "Cleaning Redis cache..."
-redis-cli --scan --pattern "celery-task-meta-*" | head -n 1000 | xargs redis-cli DEL > /dev/null 2>&1 || true
-
-# 4. ディスク容量レポート
-FINAL_SIZE=$(du -sh "$VOICEBOX_DIR" 2>/dev/null | cut -f1)
-FINAL_COUNT=$(ls "$VOICEBOX_DIR"/task_*.wav 2>/dev/null | wc -l)
-
-echo "Cleanup completed: $FINAL_COUNT files, $FINAL_SIZE"
+# ローテーション済みのトレース (tracing.py が TRACE_MAX_BYTES ごとに .1, .2, ... に切り替える)
+TRACE_EXPORT_PATH="${TRACE_EXPORT_PATH:-logs/traces.jsonl}"
+find "$(dirname "$TRACE_EXPORT_PATH")" -maxdepth 1 -name "$(basename "$TRACE_EXPORT_PATH").[0-9]*" \
+    -mtime +"${RETENTION_MAX_AGE_DAYS:-7}" -delete 2>/dev/null || true
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] VoiceBox cleanup finished"
 echo ""
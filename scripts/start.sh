@@ -25,6 +25,14 @@ VOICEBOX_DIR="$HOME/voicebox"
 API_PORT=5001
 FLOWER_PORT=5555
 CELERY_CONCURRENCY=1  # 直列実行：音声同時再生を防止
+WORKER_EXECUTION_MODE="${WORKER_EXECUTION_MODE:-sync}"
+CELERY_POOL_ARGS=""
+
+# 非同期実行モード: threadsプール + asyncio (1プロセスでリクエストを多重化)
+if [ "$WORKER_EXECUTION_MODE" = "async" ]; then
+    CELERY_CONCURRENCY="${ASYNC_WORKER_CONCURRENCY:-200}"
+    CELERY_POOL_ARGS="--pool=threads"
+fi
 
 log_info "voicebox-tts システム起動中..."
 
@@ -73,7 +81,7 @@ check_existing "celery" || {
         --loglevel=info \
         --pidfile="$PID_DIR/celery.pid" \
         --logfile="$PID_DIR/celery.log" \
-        --concurrency=$CELERY_CONCURRENCY \
+        --concurrency=$CELERY_CONCURRENCY $CELERY_POOL_ARGS \
         > "$PID_DIR/celery.out" 2>&1 &
 
     CELERY_PID=$!
@@ -82,7 +90,7 @@ check_existing "celery" || {
     sleep 3
 
     if kill -0 $CELERY_PID 2>/dev/null; then
-        log_success "Celery Worker起動完了 (Concurrency: $CELERY_CONCURRENCY, PID: $CELERY_PID)"
+        log_success "Celery Worker起動完了 (Mode: $WORKER_EXECUTION_MODE, Concurrency: $CELERY_CONCURRENCY, PID: $CELERY_PID)"
     else
         log_error "Celery Worker起動に失敗しました"
         cat "$PID_DIR/celery.out" 2>/dev/null || cat "$PID_DIR/celery.log" 2>/dev/null
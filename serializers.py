@@ -0,0 +1,88 @@
+"""
+Compact Result Serializer for VoiceBox TTS
+タスク結果用の圧縮シリアライザー
+
+msgpack (なければ json) でエンコードし、zstd (なければ zlib) で圧縮する。
+先頭2バイトに使用したコーデックを記録するため、
+どの組み合わせでエンコードされた結果でも復元できる。
+
+先頭が圧縮形式のタグでないデータは切り替え前に保存された JSON の結果として読む
+(RESULT_SERIALIZER を json から切り替えても既存の結果を取得できる)。
+逆に json に戻した場合、json の読み手は圧縮済みの結果を読めないため、
+結果の有効期限 (result_expires) が過ぎるまでは voicebox-compact のままにする。
+"""
+import json
+import zlib
+
+from kombu.serialization import register
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 任意依存
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 任意依存
+    zstandard = None
+
+SERIALIZER_NAME = 'voicebox-compact'
+CONTENT_TYPE = 'application/x-voicebox-compact'
+
+# ヘッダー: [エンコード形式, 圧縮形式]
+_MSGPACK = b'm'
+_JSON = b'j'
+_ZSTD = b'Z'
+_ZLIB = b'z'
+
+_ZSTD_LEVEL = 3
+_ZLIB_LEVEL = 6
+
+
+def _pack(obj) -> bytes:
+    if msgpack is not None:
+        return _MSGPACK + msgpack.packb(obj, use_bin_type=True)
+    return _JSON + json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _unpack(data: bytes):
+    codec, body = data[:1], data[1:]
+    if codec == _MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def dumps(obj) -> bytes:
+    """オブジェクトをエンコード・圧縮"""
+    packed = _pack(obj)
+    if zstandard is not None:
+        return _ZSTD + zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(packed)
+    return _ZLIB + zlib.compress(packed, _ZLIB_LEVEL)
+
+
+def loads(data: bytes):
+    """圧縮データを復元 (圧縮形式のタグがなければ JSON として読む)"""
+    if isinstance(data, str):
+        if data[:1] not in ('Z', 'z'):
+            return json.loads(data)
+        data = data.encode('latin-1')
+    compression, body = data[:1], data[1:]
+    if compression == _ZSTD:
+        packed = zstandard.ZstdDecompressor().decompress(body)
+    elif compression == _ZLIB:
+        packed = zlib.decompress(body)
+    else:
+        # 切り替え前の JSON の結果
+        return json.loads(data)
+    return _unpack(packed)
+
+
+def register_compact_serializer():
+    """kombuにシリアライザーを登録"""
+    register(
+        SERIALIZER_NAME,
+        dumps,
+        loads,
+        content_type=CONTENT_TYPE,
+        content_encoding='binary'
+    )
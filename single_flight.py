@@ -0,0 +1,238 @@
+"""
+Single-flight Coordination for VoiceBox TTS
+同一テキストの同時合成をワーカー間で1回にまとめる
+
+同じキー (正規化テキスト + 話者) の合成が同時に複数走った場合、
+最初に Redis のリース (SET NX PX) を取ったタスクだけが合成し (リーダー)、
+他のタスク (フォロワー) はリーダーの結果を待って音声を再利用する。
+
+- リーダーは合成中、ハートビートでリースを延長する
+- リーダーがクラッシュするとリースが期限切れになり、待機中のフォロワーが引き継ぐ
+- リーダーの合成が失敗した場合は結果を公開せずリースを解放し、フォロワーが引き継ぐ
+- Redis を使わない (ブローカーが redis:// 以外の) 場合はプロセス内のスレッド間でまとめる
+"""
+import json
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+import redis
+
+from config import (
+    CELERY_BROKER_URL,
+    SINGLE_FLIGHT,
+    SINGLE_FLIGHT_LEASE_SECONDS,
+    SINGLE_FLIGHT_WAIT_SECONDS
+)
+
+# 自分が保持しているリースのみ延長・解放する (compare-and-set)
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# フォロワーのポーリング間隔 (秒)
+_POLL_MIN = 0.005
+_POLL_MAX = 0.1
+
+
+class _LocalFlight:
+    """プロセス内の合成中フライト"""
+
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[dict] = None
+
+
+class SingleFlight:
+    """シングルフライト (ワーカー間の同時合成の集約)
+
+    Args:
+        redis_client: 共有に使うRedis (None ならプロセス内のみ)
+        lease_seconds: リーダーのリース期間 (ハートビートで延長、結果の保持期間も兼ねる)
+        wait_seconds: フォロワーの最大待機時間 (超えたら自分で合成)
+        namespace: キーの名前空間
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        lease_seconds: float = SINGLE_FLIGHT_LEASE_SECONDS,
+        wait_seconds: float = SINGLE_FLIGHT_WAIT_SECONDS,
+        namespace: str = 'synth'
+    ):
+        self.redis_client = redis_client
+        self.lease_ms = int(lease_seconds * 1000)
+        self.wait_seconds = wait_seconds
+        self.prefix = f'voicebox:singleflight:{namespace}:'
+
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _LocalFlight] = {}
+
+        if redis_client is not None:
+            self._extend = redis_client.register_script(_EXTEND_SCRIPT)
+            self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+        # 統計カウンター
+        self.leads = 0
+        self.collapsed = 0
+        self.takeovers = 0
+
+    def run(self, key: str, fn: Callable[[], dict]) -> Tuple[dict, bool]:
+        """キーごとに fn を1回だけ実行し、結果を共有する
+
+        Args:
+            key: 合成キー (text_key など)
+            fn: リーダーが実行する処理 (JSONシリアライズ可能な dict を返す)
+
+        Returns:
+            (結果, リーダーとして実行したか)
+        """
+        if self.redis_client is not None:
+            return self._run_redis(key, fn)
+        return self._run_local(key, fn)
+
+    # ------------------------------------------------------------------
+    # プロセス内
+    # ------------------------------------------------------------------
+
+    def _run_local(self, key: str, fn: Callable[[], dict]) -> Tuple[dict, bool]:
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _LocalFlight()
+
+            if leader:
+                try:
+                    flight.result = fn()
+                    self._count('leads')
+                    return flight.result, True
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+
+            remaining = deadline - time.monotonic()
+            if not flight.done.wait(max(remaining, 0)):
+                # 待機タイムアウト: まとめずに自分で実行
+                return fn(), True
+            if flight.result is not None:
+                self._count('collapsed')
+                return flight.result, False
+            # リーダーが失敗 → 引き継ぐ
+            self._count('takeovers')
+
+    # ------------------------------------------------------------------
+    # Redis
+    # ------------------------------------------------------------------
+
+    def _run_redis(self, key: str, fn: Callable[[], dict]) -> Tuple[dict, bool]:
+        lease_key = f'{self.prefix}lease:{key}'
+        result_key = f'{self.prefix}result:{key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_seconds
+        delay = _POLL_MIN
+        waited = False
+
+        while True:
+            try:
+                # 直前に完了したリーダーの結果があれば再利用
+                cached = self.redis_client.get(result_key)
+                acquired = cached is None and self.redis_client.set(
+                    lease_key, token, nx=True, px=self.lease_ms
+                )
+            except redis.RedisError:
+                # Redis障害時はプロセス内でまとめる
+                return self._run_local(key, fn)
+
+            if cached is not None:
+                self._count('collapsed')
+                return json.loads(cached), False
+
+            if acquired:
+                if waited:
+                    # 期限切れ (リーダーのクラッシュ) か失敗したリーダーからの引き継ぎ
+                    self._count('takeovers')
+                return self._lead(lease_key, result_key, token, fn), True
+
+            if time.monotonic() >= deadline:
+                return fn(), True
+
+            waited = True
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX)
+
+    def _lead(self, lease_key: str, result_key: str, token: str, fn: Callable[[], dict]) -> dict:
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(lease_key, token, stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            result = fn()
+            # 結果を先に公開してからリースを解放 (フォロワーが取りこぼさない)
+            try:
+                self.redis_client.set(result_key, json.dumps(result), px=self.lease_ms)
+            except redis.RedisError:
+                pass
+            self._count('leads')
+            return result
+        finally:
+            stop.set()
+            heartbeat.join()
+            try:
+                self._release(keys=[lease_key], args=[token])
+            except redis.RedisError:
+                pass  # リースは期限切れで解放される
+
+    def _heartbeat(self, lease_key: str, token: str, stop: threading.Event):
+        """リース期間の1/3ごとにリースを延長"""
+        while not stop.wait(self.lease_ms / 3000):
+            try:
+                if not self._extend(keys=[lease_key], args=[token, self.lease_ms]):
+                    return  # リースを失った (他のタスクが引き継いだ)
+            except redis.RedisError:
+                continue
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_stats(self) -> dict:
+        """統計情報取得"""
+        with self._lock:
+            return {
+                'leads': self.leads,
+                'collapsed': self.collapsed,
+                'takeovers': self.takeovers,
+                'in_flight': len(self._flights),
+            }
+
+
+# グローバルインスタンス
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """シングルフライト (SINGLE_FLIGHT=false の場合 None)"""
+    global _single_flight
+    if _single_flight is None and SINGLE_FLIGHT:
+        _single_flight = SingleFlight(
+            redis.from_url(CELERY_BROKER_URL) if CELERY_BROKER_URL.startswith('redis') else None
+        )
+    return _single_flight
@@ -0,0 +1,447 @@
+"""
+Audio Storage Module for VoiceBox TTS
+音声ファイル保存・インデックス管理モジュール
+
+- 保存形式: wav (無圧縮) / flac / opus (書き込み時にエンコード)
+- ディレクトリ: task_id のハッシュでシャーディング (OUTPUT_DIR/ab/cd/task_xxx.flac)
+- インデックス: SQLite (task_id, path, size, created, last_access)
+  ファイル数・合計サイズはトリガーで audio_totals に集計し、全プロセスで共有する
+  (合計サイズは実体ごと: single-flight のハードリンクで共有するファイルは1回だけ数える)
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from config import (
+    OUTPUT_DIR,
+    STORAGE_FORMAT,
+    STORAGE_SHARD_DEPTH,
+    STORAGE_INDEX_PATH,
+    AUDIO_ENCODER_COMMAND,
+    OPUS_BITRATE,
+)
+
+# 保存形式 → 拡張子
+STORAGE_FORMATS = {
+    'wav': '.wav',
+    'flac': '.flac',
+    'opus': '.opus',
+}
+
+# 形式ごとのエンコーダー引数 (ffmpeg)
+_ENCODER_ARGS = {
+    'flac': ['-c:a', 'flac', '-compression_level', '5', '-f', 'flac'],
+    'opus': ['-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-application', 'voip', '-f', 'ogg'],
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_files (
+    task_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audio_files_created ON audio_files(created);
+CREATE INDEX IF NOT EXISTS idx_audio_files_content ON audio_files(content);
+CREATE INDEX IF NOT EXISTS idx_audio_files_last_access ON audio_files(last_access);
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS audio_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO audio_totals SELECT 1, (SELECT COUNT(*) FROM audio_files), (
+    SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM audio_files GROUP BY content)
+);
+CREATE TRIGGER IF NOT EXISTS audio_files_totals_insert AFTER INSERT ON audio_files BEGIN
+    UPDATE audio_totals SET files = files + 1, bytes = bytes + CASE
+        WHEN (SELECT COUNT(*) FROM audio_files WHERE content = NEW.content) = 1 THEN NEW.size ELSE 0
+    END WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS audio_files_totals_delete AFTER DELETE ON audio_files BEGIN
+    UPDATE audio_totals SET files = files - 1, bytes = bytes - CASE
+        WHEN EXISTS (SELECT 1 FROM audio_files WHERE content = OLD.content) THEN 0 ELSE OLD.size
+    END WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS audio_files_totals_update AFTER UPDATE OF size ON audio_files
+WHEN NOT EXISTS (SELECT 1 FROM audio_files WHERE content = NEW.content AND task_id != NEW.task_id) BEGIN
+    UPDATE audio_totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 1;
+END;
+COMMIT;
+"""
+
+def _content_key(st: os.stat_result) -> str:
+    """ファイルの実体の識別子 (ハードリンクは同じ値になる)"""
+    return f'{st.st_dev}:{st.st_ino}'
+
+
+# シャーディング導入前の OUTPUT_DIR 直下のファイル (task_{id}.wav 等)
+_LEGACY_NAME = re.compile(r'^task_(.+)(\.wav|\.flac|\.opus)$')
+
+
+@dataclass
+class StoredAudio:
+    """保存済み音声ファイル情報"""
+    task_id: str
+    path: str
+    size: int
+    format: str
+    created: float
+    last_access: float
+
+    def to_dict(self):
+        return {
+            'task_id': self.task_id,
+            'path': self.path,
+            'size': self.size,
+            'format': self.format,
+            'created': self.created,
+            'last_access': self.last_access,
+        }
+
+
+class EncodingError(Exception):
+    """音声エンコード失敗"""
+
+
+class AudioStorage:
+    """音声ファイルストレージ
+
+    シャーディングされたディレクトリに音声を保存し、SQLiteインデックスで
+    task_id → ファイルの検索と作成順の走査を O(log n) で行う。
+    """
+
+    def __init__(
+        self,
+        root: str = OUTPUT_DIR,
+        storage_format: str = STORAGE_FORMAT,
+        shard_depth: int = STORAGE_SHARD_DEPTH,
+        index_path: str = STORAGE_INDEX_PATH,
+        encoder_command: str = AUDIO_ENCODER_COMMAND,
+    ):
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unsupported storage format: {storage_format}")
+
+        self.root = root
+        self.storage_format = storage_format
+        self.shard_depth = shard_depth
+        self.index_path = index_path
+        self.encoder_command = encoder_command
+
+        # SQLite接続はスレッド・プロセス(fork)ごとに作成
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------
+    # インデックス
+    # ------------------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        """現在のスレッド・プロセス用のSQLite接続を取得"""
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # INSERT OR REPLACE で置き換えた行にも削除トリガーを発火させる (集計のずれ防止)
+            conn.execute('PRAGMA recursive_triggers=ON')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    @staticmethod
+    def _row_to_stored(row) -> StoredAudio:
+        return StoredAudio(*row)
+
+    # ------------------------------------------------------------------
+    # パス
+    # ------------------------------------------------------------------
+
+    def path_for(self, task_id: str, storage_format: Optional[str] = None) -> str:
+        """task_id から保存パスを算出 (ハッシュシャーディング)"""
+        ext = STORAGE_FORMATS[storage_format or self.storage_format]
+        digest = hashlib.sha1(task_id.encode()).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, f'task_{task_id}{ext}')
+
+    # ------------------------------------------------------------------
+    # 保存
+    # ------------------------------------------------------------------
+
+    def _encode(self, wav_bytes: bytes, storage_format: str) -> bytes:
+        """WAVバイト列を指定形式にエンコード"""
+        if storage_format == 'wav':
+            return wav_bytes
+
+        try:
+            proc = subprocess.run(
+                [self.encoder_command, '-hide_banner', '-loglevel', 'error',
+                 '-f', 'wav', '-i', 'pipe:0', *_ENCODER_ARGS[storage_format], 'pipe:1'],
+                input=wav_bytes,
+                capture_output=True,
+                check=True,
+                timeout=30
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise EncodingError(f'{storage_format} encoding failed: {e}') from e
+        return proc.stdout
+
+    def save(self, task_id: str, wav_bytes: bytes, storage_format: Optional[str] = None) -> StoredAudio:
+        """音声を保存してインデックスに登録
+
+        エンコードに失敗した場合はWAVのまま保存する。
+
+        Args:
+            task_id: タスクID
+            wav_bytes: VOICEVOXが返したWAVデータ
+            storage_format: 保存形式 (デフォルト: STORAGE_FORMAT)
+
+        Returns:
+            StoredAudio
+        """
+        storage_format = storage_format or self.storage_format
+        try:
+            data = self._encode(wav_bytes, storage_format)
+        except EncodingError:
+            storage_format = 'wav'
+            data = wav_bytes
+
+        path = self.path_for(task_id, storage_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 書き込み途中のファイルが見えないよう一時ファイル経由で配置
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        stored = StoredAudio(task_id, path, len(data), storage_format, now, now)
+        self._insert(stored, _content_key(os.stat(path)))
+        return stored
+
+    def link(self, task_id: str, source_task_id: str) -> Optional[StoredAudio]:
+        """保存済みの音声を別の task_id でも参照できるよう登録
+
+        同一ファイルシステム上ではハードリンク (データはコピーしない)、
+        リンクできない場合はコピーする。
+
+        Returns:
+            StoredAudio (元の音声が削除済みの場合 None)
+        """
+        source = self.lookup(source_task_id, touch=False)
+        if source is None:
+            return None
+
+        path = self.path_for(task_id, source.format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        try:
+            os.link(source.path, tmp_path)
+        except FileExistsError:
+            os.remove(tmp_path)
+            os.link(source.path, tmp_path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            shutil.copyfile(source.path, tmp_path)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        stored = StoredAudio(task_id, path, source.size, source.format, now, now)
+        # ハードリンクなら元の音声と実体が同じため、合計サイズには加算されない
+        self._insert(stored, _content_key(os.stat(path)))
+        return stored
+
+    def _insert(self, stored: StoredAudio, content: str):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO audio_files '
+            '(task_id, path, size, format, created, last_access, content) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (stored.task_id, stored.path, stored.size, stored.format, stored.created, stored.last_access, content)
+        )
+
+    # ------------------------------------------------------------------
+    # 検索
+    # ------------------------------------------------------------------
+
+    def lookup(self, task_id: str, touch: bool = True) -> Optional[StoredAudio]:
+        """task_id から保存済み音声を検索
+
+        ファイルが外部で削除されていた場合はインデックスからも削除する。
+        """
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT task_id, path, size, format, created, last_access '
+            'FROM audio_files WHERE task_id = ?',
+            (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        stored = self._row_to_stored(row)
+        if not os.path.exists(stored.path):
+            conn.execute('DELETE FROM audio_files WHERE task_id = ?', (task_id,))
+            return None
+
+        if touch:
+            stored.last_access = time.time()
+            conn.execute(
+                'UPDATE audio_files SET last_access = ? WHERE task_id = ?',
+                (stored.last_access, task_id)
+            )
+        return stored
+
+    def iter_oldest(self, limit: Optional[int] = None) -> Iterator[StoredAudio]:
+        """作成順 (古い順) に走査"""
+        sql = ('SELECT task_id, path, size, format, created, last_access '
+               'FROM audio_files ORDER BY created')
+        params = ()
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params = (limit,)
+        for row in self._conn().execute(sql, params):
+            yield self._row_to_stored(row)
+
+    def stats(self) -> dict:
+        """ファイル数・合計サイズ (全プロセス共通の集計)"""
+        count, total = self._conn().execute(
+            'SELECT files, bytes FROM audio_totals WHERE id = 1'
+        ).fetchone()
+        return {'files': count, 'total_bytes': total}
+
+    def import_legacy(self) -> int:
+        """シャーディング導入前の直下のファイルをインデックスに登録
+
+        作成時刻にはファイルの mtime を使う (保持ポリシーで古い順に削除されるように)。
+
+        Returns:
+            新たに登録したファイル数
+        """
+        rows = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                match = _LEGACY_NAME.match(entry.name)
+                if match is None or not entry.is_file():
+                    continue
+                st = entry.stat()
+                rows.append((
+                    match.group(1), entry.path, st.st_size,
+                    match.group(2)[1:], st.st_mtime, st.st_atime, _content_key(st)
+                ))
+        if not rows:
+            return 0
+
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            imported = conn.executemany(
+                'INSERT OR IGNORE INTO audio_files '
+                '(task_id, path, size, format, created, last_access, content) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows
+            ).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return imported
+
+    # ------------------------------------------------------------------
+    # 削除
+    # ------------------------------------------------------------------
+
+    def remove(self, task_id: str) -> bool:
+        """音声ファイルとインデックスを削除"""
+        conn = self._conn()
+        row = conn.execute('SELECT path FROM audio_files WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None:
+            return False
+
+        try:
+            os.remove(row[0])
+        except FileNotFoundError:
+            pass
+        conn.execute('DELETE FROM audio_files WHERE task_id = ?', (task_id,))
+        return True
+
+    def evict(
+        self,
+        max_bytes: int = 0,
+        max_files: int = 0,
+        created_before: Optional[float] = None
+    ) -> List[StoredAudio]:
+        """ポリシーを超えた分を古い順に削除
+
+        集計の確認から削除までを1つの書き込みトランザクション (BEGIN IMMEDIATE) で行うため、
+        複数プロセスが同時に呼んでも全体のファイル数・合計サイズに対して上限が守られる。
+        0 / None を指定したポリシーは無効。
+
+        Returns:
+            削除したファイル
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            files, total = conn.execute(
+                'SELECT files, bytes FROM audio_totals WHERE id = 1'
+            ).fetchone()
+            victims = []
+            # 実体 → 削除対象にしていない残りの行数 (ハードリンクの最後の1つを消すときだけ容量が減る)
+            links: Dict[str, int] = {}
+            cursor = conn.execute(
+                'SELECT task_id, path, size, format, created, last_access, content '
+                'FROM audio_files ORDER BY created'
+            )
+            for row in cursor:
+                stored = self._row_to_stored(row[:-1])
+                if not ((max_bytes and total > max_bytes)
+                        or (max_files and files > max_files)
+                        or (created_before is not None and stored.created < created_before)):
+                    break
+                victims.append(stored)
+                content = row[-1]
+                if content not in links:
+                    links[content] = conn.execute(
+                        'SELECT COUNT(*) FROM audio_files WHERE content = ?', (content,)
+                    ).fetchone()[0]
+                links[content] -= 1
+                files -= 1
+                if not links[content]:
+                    total -= stored.size
+            cursor.close()
+
+            for stored in victims:
+                try:
+                    os.remove(stored.path)
+                except FileNotFoundError:
+                    pass
+            conn.executemany(
+                'DELETE FROM audio_files WHERE task_id = ?',
+                [(stored.task_id,) for stored in victims]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return victims
+
+
+# グローバルインスタンス
+_audio_storage: Optional[AudioStorage] = None
+
+
+def get_audio_storage() -> AudioStorage:
+    global _audio_storage
+    if _audio_storage is None:
+        _audio_storage = AudioStorage()
+    return _audio_storage
@@ -0,0 +1,204 @@
+"""
+Synthesis Micro-batching for VoiceBox TTS
+同一話者の synthesis をプロセス内で短時間ためて VOICEVOX の multi_synthesis 1回にまとめる
+
+- 話者ごとに開いているバッチに audio_query を追加し、最初に追加したタスク (リーダー) が
+  ウィンドウ (SYNTHESIS_BATCH_WINDOW_MS) の経過か SYNTHESIS_BATCH_MAX 件に達するまで待って送信する
+- 返ってきたWAVはクエリ順に各タスク (フォロワー) へ返す
+- 1件だけのバッチは通常の synthesis で送る
+- エンジンが multi_synthesis を持たない (404/405) 場合は以後バッチングせず1件ずつ送る
+- 422 (クエリの検証エラー) の場合はそのバッチを1件ずつ送り直し、エラーは該当タスクにだけ返す
+
+リクエストごとの固定コスト (HTTP往復・リクエスト処理) を件数で割るため、短いテキストが
+高レートで届く場合にエンジンのスループットが上がる。まとめる相手は同じプロセス内で同時に
+処理中のタスクなので、threads プール / 非同期実行モードのワーカーでのみ効果がある
+(prefork では1プロセス1件のため、ウィンドウ分の待ちが増えるだけになる)。
+"""
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    SYNTHESIS_BATCHING,
+    SYNTHESIS_BATCH_WINDOW_MS,
+    SYNTHESIS_BATCH_MAX,
+    WORKER_EXECUTION_MODE
+)
+from voicevox_client import VoicevoxClient, VoicevoxError
+
+# multi_synthesis 非対応とみなすステータス
+_UNSUPPORTED_STATUS = (404, 405)
+# バッチ内のどれかのクエリが不正 (1件ずつ送り直す)
+_INVALID_STATUS = 422
+
+
+class _Batch:
+    """話者ごとの送信待ちバッチ"""
+
+    __slots__ = ('speaker', 'queries', 'futures', 'full')
+
+    def __init__(self, speaker: int):
+        self.speaker = speaker
+        self.queries: List[dict] = []
+        self.futures: List[Future] = []
+        self.full = threading.Event()
+
+
+class SynthesisBatcher:
+    """synthesis のマイクロバッチング
+
+    Args:
+        synthesize: 1件の合成 (query, speaker) -> WAV
+        multi_synthesize: 複数件の合成 (queries, speaker) -> クエリ順のWAV
+        window_ms: 最初の1件から送信までの最大待ち時間
+        max_batch: 1回にまとめる最大件数
+        timeout: フォロワーがリーダーの送信結果を待つ最大時間 (秒)
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[dict, int], bytes],
+        multi_synthesize: Callable[[List[dict], int], List[bytes]],
+        window_ms: float = SYNTHESIS_BATCH_WINDOW_MS,
+        max_batch: int = SYNTHESIS_BATCH_MAX,
+        timeout: float = 30
+    ):
+        self._synthesize = synthesize
+        self._multi_synthesize = multi_synthesize
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self.supported = True
+
+        self._lock = threading.Lock()
+        self._open: Dict[int, _Batch] = {}
+
+        # 統計
+        self.batches = 0
+        self.batched_items = 0
+        self.singles = 0
+        self.fallbacks = 0
+        self.max_size = 0
+
+    def synthesize(self, query: dict, speaker: int) -> Tuple[bytes, int]:
+        """合成してWAVを返す (同じ話者の同時リクエストとまとめて送る)
+
+        Returns:
+            (WAV, 一緒に送ったバッチの件数)
+        """
+        if not self.supported or self.max_batch == 1:
+            self._count(1)
+            return self._synthesize(query, speaker), 1
+
+        with self._lock:
+            batch = self._open.get(speaker)
+            leader = batch is None
+            if leader:
+                batch = self._open[speaker] = _Batch(speaker)
+            future = Future()
+            batch.queries.append(query)
+            batch.futures.append(future)
+            if len(batch.queries) >= self.max_batch:
+                # 満杯: 以降の追加は新しいバッチへ
+                del self._open[speaker]
+                batch.full.set()
+
+        if not leader:
+            return future.result(self.timeout), len(batch.futures)
+
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._open.get(speaker) is batch:
+                del self._open[speaker]
+        self._send(batch)
+        return future.result(), len(batch.futures)
+
+    def _send(self, batch: _Batch):
+        """バッチを送信し、結果 (または例外) を各タスクに返す"""
+        size = len(batch.queries)
+        self._count(size)
+        if size == 1:
+            self._resolve_each(batch)
+            return
+
+        try:
+            wavs = self._multi_synthesize(batch.queries, batch.speaker)
+        except VoicevoxError as e:
+            if e.status in _UNSUPPORTED_STATUS:
+                self.supported = False
+            if e.status in _UNSUPPORTED_STATUS or e.status == _INVALID_STATUS:
+                with self._lock:
+                    self.fallbacks += 1
+                self._resolve_each(batch)
+                return
+            self._fail(batch, e)
+            return
+        except BaseException as e:
+            self._fail(batch, e)
+            return
+
+        for future, wav in zip(batch.futures, wavs):
+            future.set_result(wav)
+
+    def _resolve_each(self, batch: _Batch):
+        """1件ずつ synthesis で送る"""
+        for query, future in zip(batch.queries, batch.futures):
+            try:
+                future.set_result(self._synthesize(query, batch.speaker))
+            except BaseException as e:
+                future.set_exception(e)
+
+    @staticmethod
+    def _fail(batch: _Batch, error: BaseException):
+        for future in batch.futures:
+            future.set_exception(error)
+
+    def _count(self, size: int):
+        with self._lock:
+            if size == 1:
+                self.singles += 1
+            else:
+                self.batches += 1
+                self.batched_items += size
+                self.max_size = max(self.max_size, size)
+
+    def get_stats(self) -> dict:
+        """統計情報取得"""
+        with self._lock:
+            return {
+                'supported': self.supported,
+                'batches': self.batches,
+                'batched_items': self.batched_items,
+                'mean_batch_size': self.batched_items / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_size,
+                'singles': self.singles,
+                'fallbacks': self.fallbacks,
+                'open': len(self._open),
+            }
+
+
+# グローバルインスタンス
+_synthesis_batcher: Optional[SynthesisBatcher] = None
+
+
+def get_synthesis_batcher() -> Optional[SynthesisBatcher]:
+    """synthesis のマイクロバッチング (SYNTHESIS_BATCHING=false の場合 None)
+
+    非同期実行モードではイベントループ上の AsyncVoicevoxClient で送る。
+    """
+    global _synthesis_batcher
+    if _synthesis_batcher is None and SYNTHESIS_BATCHING:
+        if WORKER_EXECUTION_MODE == 'async':
+            from async_runtime import get_async_runtime
+
+            runtime = get_async_runtime()
+            _synthesis_batcher = SynthesisBatcher(
+                lambda query, speaker: runtime.run(runtime.voicevox.synthesis(query, speaker), timeout=20),
+                lambda queries, speaker: runtime.run(
+                    runtime.voicevox.multi_synthesis(queries, speaker), timeout=20
+                ),
+            )
+        else:
+            client = VoicevoxClient(timeout=20)
+            _synthesis_batcher = SynthesisBatcher(client.synthesis, client.multi_synthesis)
+    return _synthesis_batcher
@@ -1,5 +1,7 @@
 #!/bin/bash
 # Test 2: 同時実行負荷テスト
+# ※ 直列送信 (closed-loop) のため送信時間のみの確認。到着レートを指定した負荷での
+#   レイテンシ・飽和スループットは python benchmarks/loadgen.py (オープンループ) を使う
 
 echo "=========================================="
 echo "Test 2: Concurrent Load Test"
@@ -8,19 +8,26 @@ echo ""
 
 API_URL="http://localhost:5001"
 TASK_COUNT=50
+# 長文ナレーション (結果ペイロード比較用)
+NARRATION="メモリテストです。これは長めのナレーションを想定した文章で、結果ペイロードの大きさを比較するために使います。"
+
+# 結果ペイロードの before/after 比較はワーカーの設定を切り替えて2回実行する
+#   before: RESULT_INCLUDE_TEXT=true RESULT_EXTENDED=true RESULT_SERIALIZER=json
+#   after:  RESULT_INCLUDE_TEXT=false RESULT_EXTENDED=false RESULT_SERIALIZER=voicebox-compact
+# 事前に ./scripts/cleanup.sh で既存の結果キーを削除しておくこと
 
 # 初期状態
 echo "【初期状態】"
 echo "Redisメモリ:"
 redis-cli INFO memory | grep used_memory_human
 echo "音声ファイル数:"
-ls ~/voicebox/task_*.wav 2>/dev/null | wc -l
+find ~/voicebox -type f -name "task_*" 2>/dev/null | wc -l
 echo ""
 
 # タスク送信
 echo "【${TASK_COUNT}タスク送信中】"
 for i in $(seq 1 $TASK_COUNT); do
-  voicebox "メモリテスト${i}番目です。" 3 > /dev/null 2>&1
+  voicebox "${i}番目。${NARRATION}" 3 > /dev/null 2>&1
 done
 echo "送信完了"
 echo ""
@@ -35,11 +42,30 @@ echo "【処理後の状態】"
 echo "Redisメモリ:"
 redis-cli INFO memory | grep used_memory_human
 echo "音声ファイル数:"
-ls ~/voicebox/task_*.wav 2>/dev/null | wc -l
+find ~/voicebox -type f -name "task_*" 2>/dev/null | wc -l
 echo "ディスク容量:"
 du -sh ~/voicebox
 echo ""
 
+# 結果キーのメモリ使用量 (10kタスク換算)
+echo "【結果キーのメモリ使用量】"
+KEY_COUNT=0
+KEY_BYTES=0
+for key in $(redis-cli --scan --pattern "celery-task-meta-*" | head -n 1000); do
+  BYTES=$(redis-cli MEMORY USAGE "$key")
+  KEY_BYTES=$((KEY_BYTES + ${BYTES:-0}))
+  KEY_COUNT=$((KEY_COUNT + 1))
+done
+if [ $KEY_COUNT -gt 0 ]; then
+  PER_TASK=$((KEY_BYTES / KEY_COUNT))
+  echo "サンプル: ${KEY_COUNT}キー"
+  echo "1タスクあたり: ${PER_TASK} bytes"
+  echo "10kタスクあたり: $((PER_TASK * 10000 / 1024)) KB"
+else
+  echo "結果キーなし"
+fi
+echo ""
+
 # メモリリークチェック
 echo "=========================================="
 echo "メモリリーク判定"
@@ -63,7 +63,7 @@ echo "テスト終了: $(date '+%Y-%m-%d %H:%M:%S')"
 echo "総所要時間: ${TEST_DURATION}秒"
 
 # 成功タスク数
-SUCCESS_COUNT=$(ls ~/voicebox/task_*.wav 2>/dev/null | wc -l)
+SUCCESS_COUNT=$(find ~/voicebox -type f -name "task_*" 2>/dev/null | wc -l)
 echo "成功タスク数: $SUCCESS_COUNT / $TASK_COUNT"
 
 # エラーチェック
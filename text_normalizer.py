@@ -0,0 +1,228 @@
+"""
+Text Normalizer for VoiceBox TTS
+読み上げテキストの正規化・重複排除モジュール
+
+- Unicode NFKC正規化、制御文字除去、空白の圧縮
+- Markdown記法・コードブロックの除去
+- 文末・書記素境界での安全な切り詰め (UTF-8の途中で切らない)
+- ハッシュ化したキーによるTTL付き重複排除 (Redisで複数プロセス間共有)
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+# Markdown / コード
+_FENCED_CODE_RE = re.compile(r'```.*?(?:```|$)|~~~.*?(?:~~~|$)', re.DOTALL)
+_INLINE_CODE_RE = re.compile(r'`([^`\n]*)`')
+_IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_LINK_RE = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+_URL_RE = re.compile(r'https?://\S+')
+_HTML_TAG_RE = re.compile(r'</?[A-Za-z][^>]*>')
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s*', re.MULTILINE)
+_BLOCKQUOTE_RE = re.compile(r'^\s*>+\s?', re.MULTILINE)
+_LIST_MARKER_RE = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+', re.MULTILINE)
+_TABLE_RULE_RE = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?\s*$', re.MULTILINE)
+_HORIZONTAL_RULE_RE = re.compile(r'^\s*(?:[-*_]\s*){3,}$', re.MULTILINE)
+_EMPHASIS_RE = re.compile(r'(\*{1,3}|_{2,3}|~~)(\S(?:.*?\S)?)\1')
+
+# 空白・制御文字
+_CONTROL_RE = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 文末記号 (NFKC後)
+_SENTENCE_END_RE = re.compile(r'[。．！？!?…]+|\.(?=\s)')
+
+# 自分が登録した値のときだけ削除する (compare-and-delete)
+_DISCARD_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# 書記素の途中と判定する文字
+_ZWJ = '\u200d'
+
+
+def strip_markdown(text: str) -> str:
+    """Markdown記法・コードを読み上げ向けに除去"""
+    text = _FENCED_CODE_RE.sub(' ', text)
+    text = _INLINE_CODE_RE.sub(r'\1', text)
+    text = _IMAGE_RE.sub(r'\1', text)
+    text = _LINK_RE.sub(r'\1', text)
+    text = _URL_RE.sub(' ', text)
+    text = _HTML_TAG_RE.sub(' ', text)
+    text = _TABLE_RULE_RE.sub(' ', text)
+    text = _HORIZONTAL_RULE_RE.sub(' ', text)
+    text = _HEADING_RE.sub('', text)
+    text = _BLOCKQUOTE_RE.sub('', text)
+    text = _LIST_MARKER_RE.sub('', text)
+    text = _EMPHASIS_RE.sub(r'\2', text)
+    return text.replace('|', ' ')
+
+
+def _is_grapheme_extend(char: str) -> bool:
+    """直前の文字と同じ書記素に属する文字か"""
+    code = ord(char)
+    return (
+        unicodedata.category(char) in ('Mn', 'Me', 'Mc')
+        or char == _ZWJ
+        or 0xFE00 <= code <= 0xFE0F      # 異体字セレクタ
+        or 0xE0100 <= code <= 0xE01EF    # 異体字セレクタ補助
+        or 0x1F3FB <= code <= 0x1F3FF    # 絵文字の肌色修飾子
+    )
+
+
+def grapheme_boundary(text: str, index: int) -> int:
+    """index 以下で最も近い書記素境界を返す"""
+    index = min(index, len(text))
+    while 0 < index < len(text) and (
+        _is_grapheme_extend(text[index]) or text[index - 1] == _ZWJ
+    ):
+        index -= 1
+    return index
+
+
+def truncate_text(text: str, max_length: int, min_sentence_ratio: float = 0.5) -> str:
+    """文末または書記素境界で切り詰め
+
+    max_length 以内に文末があり、その位置が max_length * min_sentence_ratio
+    以上であれば文末で切る。なければ書記素境界で切る。
+    """
+    if max_length is None or len(text) <= max_length:
+        return text
+
+    sentence_end = 0
+    for match in _SENTENCE_END_RE.finditer(text, 0, max_length):
+        sentence_end = match.end()
+    if sentence_end >= max_length * min_sentence_ratio:
+        return text[:sentence_end].rstrip()
+
+    return text[:grapheme_boundary(text, max_length)].rstrip()
+
+
+def normalize_text(text: str, max_length: Optional[int] = None, strip_md: bool = True) -> str:
+    """読み上げテキストを正規化
+
+    Args:
+        text: 入力テキスト
+        max_length: 最大文字数 (None: 切り詰めなし)
+        strip_md: Markdown記法・コードを除去する
+
+    Returns:
+        正規化済みテキスト
+    """
+    text = unicodedata.normalize('NFKC', text)
+    if strip_md:
+        text = strip_markdown(text)
+    text = _CONTROL_RE.sub(' ', text)
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+    return truncate_text(text, max_length)
+
+
+def text_key(text: str, speaker: Optional[int] = None) -> str:
+    """正規化済みテキスト (+話者) のハッシュキー"""
+    return hashlib.sha1(f'{speaker}\x00{text}'.encode()).hexdigest()
+
+
+class DedupWindow:
+    """TTL付き重複排除ウィンドウ
+
+    キーはテキストのハッシュ。redis_client を渡すと SET NX PX で
+    複数プロセス間で共有し、Redisエラー時はプロセス内のウィンドウで判定する。
+    """
+
+    def __init__(self, ttl: float, redis_client=None, namespace: str = 'default'):
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.prefix = f'voicebox:dedup:{namespace}:'
+        if redis_client is not None:
+            self._discard = redis_client.register_script(_DISCARD_SCRIPT)
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, str]] = {}
+        self._expiry: Deque[Tuple[float, str]] = deque()  # TTL一定のため挿入順 = 期限順
+
+    def _expire_locked(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = self._expiry.popleft()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self._entries[key]
+
+    def _check_local(self, key: str, value: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire_locked(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1]
+            expires_at = now + self.ttl
+            self._entries[key] = (expires_at, value)
+            self._expiry.append((expires_at, key))
+            return None
+
+    def check_and_add(self, text: str, speaker: Optional[int] = None, value: str = '1') -> Optional[str]:
+        """重複判定と登録
+
+        Args:
+            text: 正規化済みテキスト
+            speaker: 話者ID
+            value: 新規登録時に保存する値 (タスクIDなど)
+
+        Returns:
+            重複時は先行登録の値、新規の場合は None
+        """
+        if self.ttl <= 0:
+            return None
+
+        key = text_key(text, speaker)
+        if self.redis_client is not None:
+            try:
+                redis_key = self.prefix + key
+                if self.redis_client.set(redis_key, value, nx=True, px=int(self.ttl * 1000)):
+                    return None
+                existing = self.redis_client.get(redis_key)
+                if existing is None:
+                    # 判定直後に期限切れ → 新規として扱う
+                    return None
+                return existing.decode() if isinstance(existing, bytes) else existing
+            except Exception:
+                pass
+        return self._check_local(key, value)
+
+    def discard(self, text: str, speaker: Optional[int] = None, value: str = '1'):
+        """登録の取り消し (登録したタスクを投入しなかった場合)
+
+        value が一致する場合のみ削除し、期限切れ後に他が登録した値は消さない。
+        """
+        if self.ttl <= 0:
+            return
+
+        key = text_key(text, speaker)
+        if self.redis_client is not None:
+            try:
+                self._discard(keys=[self.prefix + key], args=[value])
+            except Exception:
+                pass
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == value:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            return len(self._entries)
+
+
+if __name__ == '__main__':
+    import sys
+
+    # フック等から利用: 標準入力のテキストを正規化して出力
+    max_length = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(normalize_text(sys.stdin.read(), max_length=max_length))
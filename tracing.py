@@ -0,0 +1,333 @@
+"""
+Tracing for VoiceBox TTS
+POST /tts → Redisキュー → ワーカー → VOICEVOX のリクエスト単位のトレース
+
+- トレースID・スパンIDは contextvars で保持し、同じスレッド (コンテキスト) の
+  ログ行にも trace_id / span_id を付与する (logger.py)
+- APIは W3C traceparent 形式 (00-<trace_id>-<span_id>-<flags>) でCeleryのメッセージヘッダーに載せ、
+  ワーカーはそれを親としてスパンを作る
+- キュー待ちは投入時刻 (ヘッダーの enqueued_at) からワーカー着手までの queue.wait スパンとして記録
+- スパンは JSONL (TRACE_EXPORT_PATH) に1行ずつ追記する (O_APPEND の1回の write で複数プロセスから安全に追記)
+- ファイルが TRACE_MAX_BYTES を超えたら .1, .2, ... (TRACE_BACKUP_COUNT 個まで) にローテーションする
+  (ロックファイルで1プロセスだけがリネームし、他のプロセスは inode の変化を見て開き直す)
+
+Usage:
+    python tracing.py logs/traces.jsonl   # スパン名ごとの所要時間・キュー待ちとサービス時間の集計
+"""
+import contextvars
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator, Optional
+
+from config import TRACING, TRACE_EXPORT_PATH, TRACE_SAMPLE_RATE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT
+
+# 無効時・非記録時に返す共有のコンテキスト (as で None を受け取る)
+_NOOP = nullcontext()
+
+# ファイルサイズ・ローテーションを確認する間隔 (秒)
+_ROTATE_CHECK_SECONDS = 1.0
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar(
+    'voicebox_current_span', default=None
+)
+
+
+def _new_id(bits: int) -> str:
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Span:
+    """スパン (1つの処理区間)"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'sampled', 'error')
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        sampled: bool = True,
+        start: Optional[float] = None,
+        attributes: Optional[Dict] = None
+    ):
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time() if start is None else start  # UNIX時刻 (秒)
+        self.end: Optional[float] = None
+        self.attributes = attributes or {}
+        self.sampled = sampled
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent ヘッダー値"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': (self.end - self.start) * 1000 if self.end is not None else None,
+            'pid': os.getpid(),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+def parse_traceparent(value: Optional[str]):
+    """traceparent を (trace_id, parent_span_id, sampled) に分解 (不正な値は None)"""
+    if not value:
+        return None
+    parts = value.split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == '01'
+
+
+class JsonlSpanExporter:
+    """スパンを JSONL ファイルに追記 (サイズ上限でローテーション)
+
+    Args:
+        path: 出力先
+        max_bytes: これを超えたらローテーション (0 = 無制限)、確認は1秒ごとのため少し超えることがある
+        backup_count: 残すローテーション済みファイル数 (path.1 が最新)
+    """
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH, max_bytes: int = TRACE_MAX_BYTES,
+                 backup_count: int = TRACE_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = max(backup_count, 0)
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self) -> int:
+        # fork後の子プロセスでは開き直す
+        if self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            self._checked = time.monotonic()
+        return self._fd
+
+    def _reopen(self):
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._pid = None
+
+    def _check_rotation(self):
+        """サイズ上限の確認と、他プロセスによるローテーション後の開き直し (self._lock 保持中)"""
+        now = time.monotonic()
+        if not self.max_bytes or self._pid != os.getpid() or now - self._checked < _ROTATE_CHECK_SECONDS:
+            return
+        self._checked = now
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            self._reopen()
+            return
+        if current.st_ino != os.fstat(self._fd).st_ino:
+            self._reopen()  # 他のプロセスがローテーション済み
+        elif current.st_size >= self.max_bytes:
+            self._rotate()
+            self._reopen()
+
+    def _rotate(self):
+        """path → path.1 → path.2 ... (ロックファイルで複数プロセスのうち1つだけが行う)"""
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_size < self.max_bytes:
+                    return  # ロック待ちの間に他のプロセスがローテーション済み
+            except FileNotFoundError:
+                return
+            if self.backup_count == 0:
+                os.unlink(self.path)
+                return
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f'{self.path}.{i}'
+                if os.path.exists(source):
+                    os.replace(source, f'{self.path}.{i + 1}')
+            os.replace(self.path, f'{self.path}.1')
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, separators=(',', ':')) + '\n'
+        try:
+            with self._lock:
+                self._check_rotation()
+                os.write(self._open(), line.encode())
+        except OSError:
+            pass  # トレースの書き込み失敗で処理を止めない
+
+
+class Tracer:
+    """トレーサー
+
+    Args:
+        exporter: スパンの出力先 (None なら出力しない)
+        enabled: 無効時はスパンを作らない
+        sample_rate: 新規トレースの記録割合 (子スパンは親の判定に従う)
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[JsonlSpanExporter] = None,
+        enabled: bool = TRACING,
+        sample_rate: float = TRACE_SAMPLE_RATE
+    ):
+        self.exporter = exporter
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+
+    def span(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        start: Optional[float] = None,
+        **attributes
+    ) -> ContextManager[Optional[Span]]:
+        """スパンを開始し、終了時に出力する (with で使う、無効時は None)
+
+        Args:
+            name: スパン名
+            traceparent: 別プロセスから引き継ぐ親 (省略時は現在のスパンの子、なければ新規トレース)
+            start: 開始時刻 (UNIX時刻、省略時は現在)
+        """
+        if not self.enabled:
+            return _NOOP
+        return self._span(name, traceparent, start, attributes)
+
+    @contextmanager
+    def _span(self, name: str, traceparent: Optional[str], start: Optional[float], attributes: Dict) -> Iterator[Span]:
+        span = Span(name, *self._parent(traceparent), start=start, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.time()
+            self._export(span)
+
+    def record(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        traceparent: Optional[str] = None,
+        **attributes
+    ) -> Optional[Span]:
+        """計測済みの区間 (キュー待ちなど) をスパンとして出力 (現在のスパンは変えない)"""
+        if not self.enabled:
+            return None
+        span = Span(name, *self._parent(traceparent), start=start, attributes=attributes)
+        span.end = end
+        self._export(span)
+        return span
+
+    def _parent(self, traceparent: Optional[str]):
+        """(trace_id, parent_id, sampled)"""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            return parent
+        current = _current_span.get()
+        if current is not None:
+            return current.trace_id, current.span_id, current.sampled
+        return _new_id(128), None, self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _export(self, span: Span):
+        if span.sampled and self.exporter is not None:
+            self.exporter.export(span)
+
+    def headers(self) -> Dict[str, str]:
+        """Celeryメッセージヘッダー (現在のスパンの traceparent と投入時刻)"""
+        span = _current_span.get()
+        if span is None:
+            return {}
+        return {'traceparent': span.traceparent, 'enqueued_at': time.time()}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def log_context() -> Dict[str, str]:
+    """ログ行に付与する trace_id / span_id"""
+    span = _current_span.get()
+    if span is None:
+        return {}
+    return {'trace_id': span.trace_id, 'span_id': span.span_id}
+
+
+# グローバルインスタンス
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(JsonlSpanExporter())
+    return _tracer
+
+
+def summarize(path: str) -> dict:
+    """JSONLのスパンをスパン名ごと・リクエストごと (キュー待ち / サービス時間) に集計"""
+    by_name: Dict[str, list] = {}
+    traces: Dict[str, Dict[str, float]] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            if span.get('duration_ms') is None:
+                continue
+            by_name.setdefault(span['name'], []).append(span['duration_ms'])
+            if span['name'] in ('queue.wait', 'tts_task'):
+                traces.setdefault(span['trace_id'], {})[span['name']] = span['duration_ms']
+
+    def stats(values):
+        ordered = sorted(values)
+        n = len(ordered)
+        return {
+            'count': n,
+            'p50_ms': ordered[int(n * 0.5)],
+            'p95_ms': ordered[min(int(n * 0.95), n - 1)],
+            'max_ms': ordered[-1],
+        }
+
+    complete = [t for t in traces.values() if len(t) == 2]
+    return {
+        'spans': {name: stats(values) for name, values in sorted(by_name.items())},
+        'requests': {
+            'count': len(complete),
+            'queue_wait': stats([t['queue.wait'] for t in complete]) if complete else None,
+            'service': stats([t['tts_task'] for t in complete]) if complete else None,
+        },
+    }
+
+
+if __name__ == '__main__':
+    import sys
+
+    print(json.dumps(summarize(sys.argv[1] if len(sys.argv) > 1 else TRACE_EXPORT_PATH), indent=2))
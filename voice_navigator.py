@@ -1,26 +1,175 @@
 """
 Voice Navigator - 音声ナビゲーションシステム
 エージェントの実行状態をリアルタイムでVOICEVOX読み上げ
+
+パイプライン構成:
+    イベント受信 → 有界優先度キュー (まとめ読み上げ・破棄ポリシー)
+    → レート制限 → 音声合成スレッドプール → 再生スレッド (1本、順序保持)
 """
+import heapq
+import itertools
 import json
+import queue
+import subprocess
 import time
 import threading
-import urllib.parse
-import urllib.request
-from collections import deque
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 
 import redis
 from celery.events import EventReceiver
 from celery import Celery
 
-from config import VOICEVOX_API_URL, DEFAULT_SPEAKER, CELERY_BROKER_URL, OUTPUT_DIR
+from config import (
+    VOICEVOX_API_URL,
+    DEFAULT_SPEAKER,
+    CELERY_BROKER_URL,
+    OUTPUT_DIR,
+    AUTO_PLAY_COMMAND,
+    NARRATION_MAX_CHARS,
+    NAVIGATOR_DEDUP_TTL_SECONDS,
+    NAVIGATOR_QUEUE_SIZE,
+    NAVIGATOR_SYNTH_WORKERS,
+    NAVIGATOR_RATE,
+    NAVIGATOR_BURST,
+    NAVIGATOR_COALESCE_SECONDS,
+    NAVIGATOR_PHRASE_TEMPLATES
+)
+from phrase_templates import PhraseSynthesizer
+from rate_limiter import TokenBucket
+from text_normalizer import normalize_text, DedupWindow
+from voicevox_client import VoicevoxClient
+
+# 読み上げ優先度 (小さいほど優先)
+PRIORITY_ALERT = 0    # エラー
+PRIORITY_SYSTEM = 1   # 起動・停止などのシステムメッセージ
+PRIORITY_EVENT = 2    # タスク完了
+PRIORITY_VERBOSE = 3  # タスク受信・開始、APIイベント
+
+EVENT_PRIORITIES = {
+    'task-failed': PRIORITY_ALERT,
+    'task-succeeded': PRIORITY_EVENT,
+    'task-received': PRIORITY_VERBOSE,
+    'task-started': PRIORITY_VERBOSE,
+}
+
+# まとめ読み上げ (同種イベントが複数件たまった場合)
+COALESCE_TEMPLATES = {
+    'task-received': "{count}件のタスクを受信しました",
+    'task-started': "{count}件のタスクを開始しました",
+    'task-succeeded': "{count}件のタスクが完了しました",
+    'task-failed': "{count}件のタスクでエラーが発生しました",
+}
+
+
+@dataclass(order=True)
+class SpeechItem:
+    """読み上げ項目"""
+    priority: int
+    seq: int
+    text: str = field(compare=False)
+    created: float = field(compare=False, default_factory=time.monotonic)
+
+
+class SpeechQueue:
+    """有界優先度キュー
+
+    満杯時は最も優先度の低い項目 (同順位なら最も古い項目) を破棄する。
+    新しい項目の方が優先度が低い場合は新しい項目を破棄する。
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._heap: List[SpeechItem] = []
+        self._cond = threading.Condition()
+
+    def put(self, item: SpeechItem) -> bool:
+        """項目を追加
+
+        Returns:
+            追加できた場合 True (破棄された場合 False)
+        """
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                worst = max(self._heap, key=lambda i: (i.priority, -i.seq))
+                self.dropped += 1
+                if item.priority > worst.priority:
+                    return False
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+            heapq.heappush(self._heap, item)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[SpeechItem]:
+        """最優先の項目を取得 (timeout 経過で None)"""
+        with self._cond:
+            if not self._heap:
+                self._cond.wait(timeout)
+            if not self._heap:
+                return None
+            return heapq.heappop(self._heap)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+
+class EventCoalescer:
+    """同種イベントを一定時間まとめる
+
+    最初のイベントから window 秒後に、1件なら元の説明文、
+    複数件なら「N件のタスクが完了しました」のような要約を返す。
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[float, List[str]]] = {}  # event_type → (期限, 説明文)
+
+    def add(self, event_type: str, description: str):
+        with self._lock:
+            if event_type not in self._pending:
+                self._pending[event_type] = (time.monotonic() + self.window, [])
+            self._pending[event_type][1].append(description)
+
+    def pop_due(self, now: Optional[float] = None) -> List[Tuple[str, str, int]]:
+        """期限に達したまとめを取り出す
+
+        Returns:
+            [(event_type, 読み上げ文, 件数), ...]
+        """
+        now = now or time.monotonic()
+        due = []
+        with self._lock:
+            for event_type, (deadline, descriptions) in list(self._pending.items()):
+                if deadline > now:
+                    continue
+                del self._pending[event_type]
+                count = len(descriptions)
+                if count == 1:
+                    due.append((event_type, descriptions[0], count))
+                else:
+                    due.append((event_type, COALESCE_TEMPLATES[event_type].format(count=count), count))
+        return due
+
+    def flush(self) -> List[Tuple[str, str, int]]:
+        """期限に関係なく全て取り出す"""
+        return self.pop_due(float('inf'))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
 
 
 class VoiceNavigator:
     """音声ナビゲーションシステム
 
     Celeryイベントを監視し、状態変化をVOICEVOXで読み上げる。
+    イベント受信スレッドは読み上げ項目をキューに積むだけで、
+    音声合成・再生は別スレッドで行う。
     """
 
     def __init__(
@@ -28,21 +177,47 @@ class VoiceNavigator:
         speaker: int = None,
         voicevox_url: str = None,
         enable_audio: bool = True,
-        verbose: bool = True
+        verbose: bool = True,
+        queue_size: int = NAVIGATOR_QUEUE_SIZE,
+        synth_workers: int = NAVIGATOR_SYNTH_WORKERS,
+        rate: float = NAVIGATOR_RATE,
+        burst: float = NAVIGATOR_BURST,
+        coalesce_window: float = NAVIGATOR_COALESCE_SECONDS,
+        phrase_templates: bool = NAVIGATOR_PHRASE_TEMPLATES
     ):
         self.speaker = speaker or DEFAULT_SPEAKER
         self.voicevox_url = voicevox_url or VOICEVOX_API_URL
+        self.voicevox = VoicevoxClient(self.voicevox_url)
+        # 定型文は固定フレーズ・文字・数詞の断片をつなぎ合わせて合成
+        self.phrases = PhraseSynthesizer(self.voicevox) if phrase_templates else None
         self.enable_audio = enable_audio
         self.verbose = verbose
         self.running = False
 
-        # 音声キュー（重複防止）
-        self.speech_queue = deque(maxlen=100)
-        self.speech_lock = threading.Lock()
-
         # Redis接続（状態追跡用）
         self.redis_client = redis.from_url(CELERY_BROKER_URL)
 
+        # 重複防止（TTL付き、Redisで複数プロセス間共有）
+        self.dedup = DedupWindow(
+            NAVIGATOR_DEDUP_TTL_SECONDS,
+            self.redis_client,
+            namespace='navigator'
+        )
+
+        # 読み上げパイプライン
+        self.speech_queue = SpeechQueue(queue_size)
+        self.coalescer = EventCoalescer(coalesce_window)
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.synth_workers = synth_workers
+        self.playback_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._pipeline_lock = threading.Lock()
+        self._pipeline_started = False
+        self._stopping = threading.Event()
+        self._synth_pool: Optional[ThreadPoolExecutor] = None
+        self._dispatch_thread: Optional[threading.Thread] = None
+        self._playback_thread: Optional[threading.Thread] = None
+
         # Celery app（イベント取得用）
         self.celery_app = Celery('voicebox_tts', broker=CELERY_BROKER_URL)
 
@@ -51,69 +226,153 @@ class VoiceNavigator:
         if self.verbose:
             print(f"[VoiceNavigator] {message}")
 
-    def speak(self, text: str) -> bool:
-        """VOICEVOXで読み上げ
+    def speak(self, text: str, priority: int = PRIORITY_SYSTEM) -> bool:
+        """読み上げキューに追加 (ノンブロッキング)
 
         Args:
             text: 読み上げテキスト
+            priority: 優先度 (PRIORITY_*)
 
         Returns:
-            成功時True
+            キューに追加された場合True
         """
+        return self._enqueue(text, priority, dedup=True)
+
+    def _enqueue(self, text: str, priority: int, dedup: bool) -> bool:
+        text = normalize_text(text, max_length=NARRATION_MAX_CHARS)
+        if not text:
+            return False
+
         if not self.enable_audio:
             self.log(f"[音声スキップ] {text}")
             return True
 
         # 重複チェック
-        with self.speech_lock:
-            if text in self.speech_queue:
-                self.log(f"[重複スキップ] {text}")
-                return False
-            self.speech_queue.append(text)
+        if dedup and self.dedup.check_and_add(text, self.speaker):
+            self.log(f"[重複スキップ] {text}")
+            return False
 
+        self._start_pipeline()
+        item = SpeechItem(priority=priority, seq=next(self._seq), text=text)
+        if not self.speech_queue.put(item):
+            self.log(f"[キュー満杯のため破棄] {text}")
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # パイプライン
+    # ------------------------------------------------------------------
+
+    def _start_pipeline(self):
+        """合成スレッドプール・ディスパッチ・再生スレッドを起動 (初回のみ)"""
+        with self._pipeline_lock:
+            if self._pipeline_started:
+                return
+            self._pipeline_started = True
+            self._stopping.clear()
+            self._synth_pool = ThreadPoolExecutor(
+                max_workers=self.synth_workers,
+                thread_name_prefix='navigator-synth'
+            )
+            self._dispatch_thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._playback_thread = threading.Thread(target=self._playback_loop, daemon=True)
+            self._dispatch_thread.start()
+            self._playback_thread.start()
+
+            # 定型文の固定フレーズを事前合成
+            if self.phrases:
+                self._synth_pool.submit(self._warmup_phrases)
+
+    def _warmup_phrases(self):
         try:
-            self.log(f"🎙️ {text}")
-
-            # audio_query
-            query_url = f'{self.voicevox_url}/audio_query?speaker={self.speaker}&text=' + urllib.parse.quote(text)
-            query_req = urllib.request.Request(query_url, method='POST')
-
-            with urllib.request.urlopen(query_req, timeout=5) as r:
-                query = json.load(r)
-
-            # synthesis
-            synth_url = f'{self.voicevox_url}/synthesis?speaker={self.speaker}'
-            synth_req = urllib.request.Request(
-                synth_url,
-                data=json.dumps(query).encode(),
-                headers={'Content-Type': 'application/json'},
-                method='POST'
+            self.phrases.warmup(self.speaker)
+        except Exception as e:
+            self.log(f"⚠️ 定型フレーズの事前合成失敗: {e}")
+
+    def _flush_coalesced(self, force: bool = False):
+        """まとめ読み上げをキューへ"""
+        due = self.coalescer.flush() if force else self.coalescer.pop_due()
+        for event_type, text, count in due:
+            # 要約文は件数が同じだと同一文になるため重複チェックしない
+            self._enqueue(
+                text,
+                EVENT_PRIORITIES.get(event_type, PRIORITY_EVENT),
+                dedup=(count == 1)
             )
 
-            output_path = f'{OUTPUT_DIR}/navi_{int(time.time())}.wav'
+    def _dispatch_loop(self):
+        """キュー → レート制限 → 合成プール"""
+        while True:
+            stopping = self._stopping.is_set()
+            self._flush_coalesced(force=stopping)
 
-            with urllib.request.urlopen(synth_req, timeout=10) as r:
-                with open(output_path, 'wb') as f:
-                    f.write(r.read())
+            item = self.speech_queue.get(timeout=0.1)
+            if item is None:
+                if stopping and not len(self.coalescer):
+                    break
+                continue
 
-            # 音声再生（非同期）
-            self._play_audio_async(output_path)
-            return True
+            # レート制限 (待機中のイベントはまとめ読み上げ・破棄ポリシーで吸収)
+            while not self.rate_limiter.try_acquire():
+                if self._stopping.is_set():
+                    break
+                time.sleep(min(self.rate_limiter.wait_time(), 0.1))
 
-        except Exception as e:
-            self.log(f"❌ 音声生成エラー: {e}")
-            return False
+            self.log(f"🎙️ {item.text}")
+            future = self._synth_pool.submit(self._synthesize, item.text)
+            self.playback_queue.put(future)
+
+        self.playback_queue.put(None)
+
+    def _synthesize(self, text: str) -> str:
+        """VOICEVOXで音声合成
+
+        Returns:
+            音声ファイルパス
+        """
+        # 定型文は断片の連結、それ以外は audio_query + synthesis (keep-alive接続を再利用)
+        wav_bytes = self.phrases.render(text, self.speaker) if self.phrases else None
+        if wav_bytes is None:
+            wav_bytes = self.voicevox.tts(text, self.speaker)
+
+        output_path = f'{OUTPUT_DIR}/navi_{int(time.time())}_{next(self._seq)}.wav'
+
+        with open(output_path, 'wb') as f:
+            f.write(wav_bytes)
+
+        return output_path
+
+    def _playback_loop(self):
+        """合成結果を投入順に1件ずつ再生 (重なり防止)"""
+        while True:
+            future: Optional[Future] = self.playback_queue.get()
+            if future is None:
+                break
 
-    def _play_audio_async(self, audio_path: str):
-        """非同期で音声再生"""
-        def play():
             try:
-                import subprocess
-                subprocess.run(['afplay', audio_path], check=False, capture_output=True)
+                audio_path = future.result()
+            except Exception as e:
+                self.log(f"❌ 音声生成エラー: {e}")
+                continue
+
+            try:
+                subprocess.run([AUTO_PLAY_COMMAND, audio_path], check=False, capture_output=True)
             except Exception as e:
                 self.log(f"⚠️ 音声再生エラー: {e}")
 
-        threading.Thread(target=play, daemon=True).start()
+    def shutdown_pipeline(self, timeout: float = 10.0):
+        """キューに残った読み上げを再生し終えてから停止"""
+        with self._pipeline_lock:
+            if not self._pipeline_started:
+                return
+            self._stopping.set()
+
+        self._dispatch_thread.join(timeout)
+        self._playback_thread.join(timeout)
+        self._synth_pool.shutdown(wait=False)
+
+        with self._pipeline_lock:
+            self._pipeline_started = False
 
     def describe_task_event(self, event: dict) -> str:
         """Celeryタスクイベントを説明文に変換
@@ -141,7 +400,7 @@ class VoiceNavigator:
         # タスク成功
         elif event_type == 'task-succeeded':
             result = event.get('result', {})
-            if result.get('success'):
+            if isinstance(result, dict) and result.get('success'):
                 size = result.get('file_size', 0) // 1024
                 return f"タスク{uuid}、完了しました。ファイルサイズ{size}キロバイト"
             return f"タスク{uuid}、完了しました"
@@ -164,8 +423,15 @@ class VoiceNavigator:
             event: Celeryイベント辞書
         """
         description = self.describe_task_event(event)
-        if description:
-            self.speak(description)
+        if not description:
+            return
+
+        # イベント受信スレッドはキューに積むだけ (合成・再生は待たない)
+        event_type = event.get('type')
+        if event_type in COALESCE_TEMPLATES and self.coalescer.window > 0:
+            self.coalescer.add(event_type, description)
+        else:
+            self.speak(description, EVENT_PRIORITIES.get(event_type, PRIORITY_EVENT))
 
     def start_celery_monitor(self):
         """Celeryイベント監視を開始"""
@@ -203,11 +469,11 @@ class VoiceNavigator:
                 if event_type == 'request':
                     endpoint = data.get('endpoint', 'unknown')
                     method = data.get('method', 'GET')
-                    self.speak(f"APIリクエスト受信。{method} {endpoint}")
+                    self.speak(f"APIリクエスト受信。{method} {endpoint}", PRIORITY_VERBOSE)
 
                 elif event_type == 'response':
                     status = data.get('status', 200)
-                    self.speak(f"APIレスポンス送信。ステータスコード{status}")
+                    self.speak(f"APIレスポンス送信。ステータスコード{status}", PRIORITY_VERBOSE)
 
     def start(self):
         """音声ナビゲーション開始"""
@@ -240,7 +506,7 @@ class VoiceNavigator:
         """音声ナビゲーション停止"""
         self.running = False
         self.speak("音声ナビゲーション、停止します")
-        time.sleep(2)  # 読み上げ完了待機
+        self.shutdown_pipeline()  # 読み上げ完了待機
 
 
 if __name__ == '__main__':
@@ -0,0 +1,291 @@
+"""
+VOICEVOX HTTP Client for VoiceBox TTS
+keep-alive接続を再利用するVOICEVOX APIクライアント
+
+urllib.request はリクエストごとにTCP接続を張り直すため、
+常駐プロセスでは http.client の接続をプールして再利用する。
+AsyncVoicevoxClient は asyncio のストリームで同じAPIを提供する (非同期実行モード用)。
+"""
+import asyncio
+import http.client
+import io
+import json
+import queue
+import urllib.parse
+import zipfile
+from typing import List, Optional
+
+from config import VOICEVOX_API_URL
+
+# 接続切れとみなして再接続・再送する例外
+_RECONNECT_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class VoicevoxError(Exception):
+    """VOICEVOX APIエラー (status: HTTPステータス)"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _multi_synthesis_request(queries: List[dict], speaker: int):
+    """multi_synthesis のパスとボディ"""
+    return f'/multi_synthesis?speaker={speaker}', json.dumps(queries).encode()
+
+
+def _unzip_wavs(data: bytes, count: int) -> List[bytes]:
+    """multi_synthesis のレスポンス (001.wav, 002.wav, ... のZIP) をクエリ順のWAVに展開"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = sorted(name for name in archive.namelist() if name.endswith('.wav'))
+        if len(names) != count:
+            raise VoicevoxError(f'multi_synthesis returned {len(names)} wavs for {count} queries')
+        return [archive.read(name) for name in names]
+
+
+class VoicevoxClient:
+    """VOICEVOX APIクライアント (keep-alive接続プール)
+
+    スレッドセーフ。接続はリクエストごとにプールから借りて返却する。
+    プールに空きがなければ新規接続を作り、max_idle を超えた分は閉じる。
+    """
+
+    def __init__(self, base_url: str = None, timeout: float = 10, max_idle: int = 8):
+        parsed = urllib.parse.urlsplit(base_url or VOICEVOX_API_URL)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 80
+        self.base_path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=max_idle)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn: http.client.HTTPConnection):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """待機中の接続を全て閉じる"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[dict] = None) -> bytes:
+        """リクエスト送信 (接続切れの場合は1回だけ再接続して再送)"""
+        for attempt in (0, 1):
+            conn = self._acquire()
+            try:
+                conn.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except _RECONNECT_ERRORS:
+                # keep-alive切れ: 新しい接続で再送
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            self._release(conn)
+            if response.status >= 400:
+                raise VoicevoxError(f'{method} {path} -> {response.status}: {data[:200]!r}', response.status)
+            return data
+
+    def warmup(self, connections: int = 1):
+        """接続を事前に確立してプールに入れる"""
+        conns = []
+        try:
+            for _ in range(connections):
+                conn = self._acquire()
+                conns.append(conn)
+                conn.request('GET', self.base_path + '/version')
+                conn.getresponse().read()
+        finally:
+            for conn in conns:
+                self._release(conn)
+
+    def version(self) -> str:
+        """エンジンバージョン取得"""
+        return json.loads(self._request('GET', '/version'))
+
+    def audio_query(self, text: str, speaker: int) -> dict:
+        """audio_query API"""
+        path = f'/audio_query?speaker={speaker}&text=' + urllib.parse.quote(text)
+        return json.loads(self._request('POST', path))
+
+    def synthesis(self, query: dict, speaker: int) -> bytes:
+        """synthesis API (WAVバイト列を返す)"""
+        return self._request(
+            'POST',
+            f'/synthesis?speaker={speaker}',
+            body=json.dumps(query).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+
+    def multi_synthesis(self, queries: List[dict], speaker: int) -> List[bytes]:
+        """multi_synthesis API (同一話者の複数クエリを1回で合成し、クエリ順のWAVを返す)"""
+        path, body = _multi_synthesis_request(queries, speaker)
+        data = self._request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        return _unzip_wavs(data, len(queries))
+
+    def tts(self, text: str, speaker: int, speed_scale: Optional[float] = None) -> bytes:
+        """audio_query + synthesis"""
+        query = self.audio_query(text, speaker)
+        if speed_scale is not None:
+            query['speedScale'] = speed_scale
+        return self.synthesis(query, speaker)
+
+
+class AsyncVoicevoxClient:
+    """VOICEVOX APIクライアント (asyncio、keep-alive接続プール)
+
+    1つのイベントループ上で多数のリクエストを多重化する。
+    同時リクエスト数は max_inflight のセマフォで制限する。
+    イベントループ専用 (別スレッドからは AsyncRuntime.run() 経由で呼ぶ)。
+    """
+
+    def __init__(self, base_url: str = None, timeout: float = 20, max_idle: int = 64,
+                 max_inflight: int = 64):
+        parsed = urllib.parse.urlsplit(base_url or VOICEVOX_API_URL)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 80
+        self.base_path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_inflight = max_inflight
+        self._idle = []  # [(reader, writer)]
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def close(self):
+        """待機中の接続を全て閉じる"""
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    async def _roundtrip(self, reader, writer, method: str, path: str, body: bytes,
+                         headers: dict):
+        """1リクエスト送信してレスポンスを読む
+
+        Returns:
+            (ステータス, ボディ, 接続を再利用できるか)
+        """
+        lines = [f'{method} {self.base_path}{path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'Content-Length: {len(body)}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by VOICEVOX')
+        version, status = status_line.split(None, 2)[:2]
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = (
+            version == b'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        )
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return int(status), data, keep_alive
+
+    async def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                       headers: Optional[dict] = None) -> bytes:
+        """リクエスト送信 (再利用した接続が切れていた場合は新しい接続で1回だけ再送)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+
+        async with self._semaphore:
+            while True:
+                reused = bool(self._idle)
+                if reused:
+                    reader, writer = self._idle.pop()
+                else:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), self.timeout
+                    )
+                try:
+                    status, data, keep_alive = await asyncio.wait_for(
+                        self._roundtrip(reader, writer, method, path, body or b'', headers or {}),
+                        self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue  # keep-alive切れ: 新しい接続で再送
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+
+        if keep_alive and len(self._idle) < self.max_idle:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        if status >= 400:
+            raise VoicevoxError(f'{method} {path} -> {status}: {data[:200]!r}', status)
+        return data
+
+    async def audio_query(self, text: str, speaker: int) -> dict:
+        """audio_query API"""
+        path = f'/audio_query?speaker={speaker}&text=' + urllib.parse.quote(text)
+        return json.loads(await self._request('POST', path))
+
+    async def synthesis(self, query: dict, speaker: int) -> bytes:
+        """synthesis API (WAVバイト列を返す)"""
+        return await self._request(
+            'POST',
+            f'/synthesis?speaker={speaker}',
+            body=json.dumps(query).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+
+    async def multi_synthesis(self, queries: List[dict], speaker: int) -> List[bytes]:
+        """multi_synthesis API (同一話者の複数クエリを1回で合成し、クエリ順のWAVを返す)"""
+        path, body = _multi_synthesis_request(queries, speaker)
+        data = await self._request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        return _unzip_wavs(data, len(queries))
+
+    async def tts(self, text: str, speaker: int, speed_scale: Optional[float] = None) -> bytes:
+        """audio_query + synthesis"""
+        query = await self.audio_query(text, speaker)
+        if speed_scale is not None:
+            query['speedScale'] = speed_scale
+        return await self.synthesis(query, speaker)